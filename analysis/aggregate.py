@@ -0,0 +1,55 @@
+import os
+from helpers.futures_patch import patch_mp_connection_bpo_17560
+from helpers.futures import futures_keys, load_futures
+from helpers.reduction import load_and_fold, treereduce
+from helpers.incremental import Manifest, incremental_reduce
+from macros.scale import primary_datasets, scale
+
+def reduce_key(filenames, key):
+    """Sum one histogram over all the .futures files, one file at a time"""
+    return load_and_fold(filenames, [key])[key]
+
+def aggregate(folder, output, variable=None, exclude=None, checkpoint=False, fanin=4, workers=16):
+    """From the .futures files of folder straight to a .scaled file.
+
+    Does what reduce.py, merge.py (with --postprocess) and macros/scale.py
+    do one after the other, a histogram at a time: every key is summed over
+    all the files, grouped into primary datasets, scaled and grouped into
+    processes, and written to output. With checkpoint, the sums are also
+    kept as <folder>/<key>.aggregated and updated incrementally on the next
+    run, one key at a time so that a single sum is held in memory. These
+    are not the .merged files of merge.py, which are summed from the
+    .reduced files and tracked separately in the manifest.
+    """
+    filenames = [folder+'/'+filename for filename in os.listdir(folder) if '.futures' in filename]
+    if not filenames:
+        raise ValueError("aggregate: no .futures files in %s" % folder)
+    keys = futures_keys(filenames[0])
+    if variable is not None: keys = [k for k in keys if k in variable.split(',') or k == 'sumw']
+    if exclude is not None: keys = [k for k in keys if k not in exclude.split(',') or k == 'sumw']
+    print('Aggregating',len(keys),'histograms from',len(filenames),'files')
+
+    if checkpoint:
+        manifest = Manifest(folder)
+        checkpoints = {k: folder+'/'+k+'.aggregated' for k in keys}
+        for k in keys:
+            incremental_reduce(manifest, filenames, {k: checkpoints[k]}, transform=lambda k, h: primary_datasets(h), fanin=fanin, workers=workers)
+        scale([(checkpoints[k], k) for k in keys], load_futures(checkpoints['sumw'], ['sumw'])['sumw'], output, workers=workers)
+    else:
+        sumw = treereduce(filenames, keys=['sumw'], fanin=fanin, workers=workers)['sumw']
+        scale([(filenames, k) for k in keys], sumw, output, aggregate=True, workers=workers, loader=reduce_key)
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option('-f', '--folder', help='folder', dest='folder')
+    parser.add_option('-o', '--output', help='output file, <folder>.scaled by default', dest='output', default=None)
+    parser.add_option('-v', '--variable', help='variable', dest='variable', default=None)
+    parser.add_option('-e', '--exclude', help='exclude', dest='exclude', default=None)
+    parser.add_option('-c', '--checkpoint', help='keep the summed histograms as .aggregated files and update them incrementally', action='store_true', dest='checkpoint')
+    parser.add_option('-k', '--fanin', help='number of inputs summed by each reduction task', dest='fanin', type=int, default=4)
+    parser.add_option('-w', '--workers', help='number of workers in the pool', dest='workers', type=int, default=16)
+    (options, args) = parser.parse_args()
+
+    patch_mp_connection_bpo_17560()
+    aggregate(options.folder, options.output or options.folder.rstrip('/')+'.scaled', options.variable, options.exclude, options.checkpoint, options.fanin, options.workers)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+from __future__ import print_function, division
+import re
+import json
+import os
+from optparse import OptionParser
+from coffea.util import load
+from helpers.condor import Dag, CondorScheduler, FakeScheduler
+from helpers.ledger import drop_stale
+from helpers.futures import futures_keys, NOT_SAVED
+
+parser = OptionParser()
+parser.add_option('-d', '--dataset', help='dataset', dest='dataset', default='')
+parser.add_option('-e', '--exclude', help='exclude', dest='exclude', default='')
+parser.add_option('-p', '--processor', help='processor', dest='processor', default='')
+parser.add_option('-m', '--metadata', help='metadata', dest='metadata', default='')
+parser.add_option('-v', '--variable', help='variables to reduce and merge, all the keys of the .futures files by default', dest='variable', default='')
+parser.add_option('-c', '--cluster', help='cluster', dest='cluster', default='lpc')
+parser.add_option('-t', '--tar', action='store_true', dest='tar')
+parser.add_option('-x', '--copy', action='store_true', dest='copy')
+parser.add_option('-n', '--dry-run', action='store_true', dest='dry_run', help='Walk the DAG locally with a fake scheduler instead of submitting it')
+(options, args) = parser.parse_args()
+
+###
+# One DAG per production: a run node per primary dataset, a reduce node
+# per primary dataset that only waits for its own run node, and a merge
+# node after all of them. Outputs are remapped to absolute paths, inputs of
+# reduce and merge are transferred, so the tarball is made only once.
+###
+
+folder = 'hists/'+options.processor
+os.system("mkdir -p "+folder)
+
+if options.tar:
+    os.system('tar --exclude-caches-all --exclude-vcs -czvf ../../decaf.tgz '
+              '--exclude=\'analysis/logs\' '
+              '--exclude=\'analysis/plots\' '
+              '--exclude=\'analysis/datacards\' '
+              '--exclude=\'analysis/results\' '
+              '--exclude=\'analysis/dag\' '
+              '--exclude=\'analysis/data/models\' '
+              '--exclude=\'analysis/hists/*/*.futures\' '
+              '--exclude=\'analysis/hists/*/*.ledger\' '
+              '--exclude=\'analysis/hists/*/*.merged\' '
+              '--exclude=\'analysis/hists/*/*.aggregated\' '
+              '--exclude=\'analysis/hists/*/*.reduced\' '
+              '--exclude=\'analysis/hists/*/.manifest\' '
+              '../../decaf')
+    os.system('tar --exclude-caches-all --exclude-vcs -czvf ../../pylocal.tgz -C ~/.local/lib/python3.6/ site-packages')
+
+if options.cluster == 'kisti':
+    if options.copy:
+        os.system('xrdfs root://cms-xrdr.private.lo:2094/ rm /xrd/store/user/'+os.environ['USER']+'/decaf.tgz')
+        print('decaf removed')
+        os.system('xrdcp -f ../../decaf.tgz root://cms-xrdr.private.lo:2094//xrd/store/user/'+os.environ['USER']+'/decaf.tgz')
+        os.system('xrdfs root://cms-xrdr.private.lo:2094/ rm /xrd/store/user/'+os.environ['USER']+'/pylocal.tgz')
+        print('pylocal removed')
+        os.system('xrdcp -f ../../pylocal.tgz root://cms-xrdr.private.lo:2094//xrd/store/user/'+os.environ['USER']+'/pylocal.tgz')
+    proxy = ', /tmp/x509up_u556950957'
+    extra = 'accounting_group=group_cms\n'
+    memory = 7000
+
+if options.cluster == 'lpc':
+    if options.copy:
+        os.system('xrdcp -f ../../decaf.tgz root://cmseos.fnal.gov//store/user/'+os.environ['USER']+'/decaf.tgz')
+        os.system('xrdcp -f ../../pylocal.tgz root://cmseos.fnal.gov//store/user/'+os.environ['USER']+'/pylocal.tgz')
+    proxy = ''
+    extra = ''
+    memory = 5700
+
+pwd = os.getcwd()
+user = os.environ.get('USER', '')
+
+run_jdl = """universe = vanilla
+Executable = run.sh
+Should_Transfer_Files = YES
+WhenToTransferOutput = ON_EXIT_OR_EVICT
+Transfer_Input_Files = run.sh"""+proxy+"""$(ledgers)
+Output = logs/condor/run/out/"""+options.processor+"""_$(sample)_$(Cluster)_$(Process).stdout
+Error = logs/condor/run/err/"""+options.processor+"""_$(sample)_$(Cluster)_$(Process).stderr
+Log = logs/condor/run/log/"""+options.processor+"""_$(sample)_$(Cluster)_$(Process).log
+TransferOutputRemaps = \""""+options.processor+"""_$(sample).futures="""+pwd+'/'+folder+"""/$(sample).futures;"""+options.processor+"""_$(sample).ledger="""+pwd+'/'+folder+"""/$(sample).ledger"
+Arguments = """+options.metadata+""" $(sample) """+options.processor+""" """+options.cluster+""" """+user+"""
+"""+extra+"""JobBatchName = $(batch)
+request_cpus = 8
+request_memory = """+str(memory)+"""
+Queue sample from $(items)
+"""
+
+reduce_jdl = """universe = vanilla
+Executable = reduce.sh
+Should_Transfer_Files = YES
+WhenToTransferOutput = ON_EXIT
+Transfer_Input_Files = reduce.sh"""+proxy+"""$(futures)
+Output = logs/condor/reduce/out/"""+options.processor+"""_$(sample)_$(variable)_$(Cluster)_$(Process).stdout
+Error = logs/condor/reduce/err/"""+options.processor+"""_$(sample)_$(variable)_$(Cluster)_$(Process).stderr
+Log = logs/condor/reduce/log/"""+options.processor+"""_$(sample)_$(variable)_$(Cluster)_$(Process).log
+TransferOutputRemaps = "$(variable)_$(sample).reduced="""+pwd+'/'+folder+"""/$(variable)--$(sample).reduced"
+Arguments = """+folder+""" $(variable) $(sample) """+options.cluster+""" """+user+"""
+"""+extra+"""JobBatchName = $(sample)
+request_cpus = 16
+request_disk = 10G
+Queue variable from $(items)
+"""
+
+merge_jdl = """universe = vanilla
+Executable = merge.sh
+Should_Transfer_Files = YES
+WhenToTransferOutput = ON_EXIT
+Transfer_Input_Files = merge.sh"""+proxy+"""$(reduced)
+Output = logs/condor/merge/out/"""+options.processor+"""_$(variable)_$(Cluster)_$(Process).stdout
+Error = logs/condor/merge/err/"""+options.processor+"""_$(variable)_$(Cluster)_$(Process).stderr
+Log = logs/condor/merge/log/"""+options.processor+"""_$(variable)_$(Cluster)_$(Process).log
+TransferOutputRemaps = "$(variable).merged="""+pwd+'/'+folder+"""/$(variable).merged"
+Arguments = """+folder+""" $(variable) """+options.cluster+""" """+user+"""
+"""+extra+"""JobBatchName = $(variable)
+request_cpus = 16
+Queue variable from $(items)
+"""
+
+with open('metadata/'+options.metadata+'.json') as fin:
+    datadef = json.load(fin)
+
+samples = {}
+for dataset in datadef:
+    if options.dataset:
+        if not any(_dataset in dataset for _dataset in options.dataset.split(',')): continue
+    if options.exclude:
+        if any(_dataset in dataset for _dataset in options.exclude.split(',')): continue
+    samples.setdefault(dataset.split('____')[0], []).append(dataset)
+
+existing = [folder+'/'+dataset+'.futures' for datasets in samples.values() for dataset in datasets if os.path.exists(folder+'/'+dataset+'.futures')]
+if options.variable:
+    variables = options.variable.split(',')
+elif existing:
+    variables = futures_keys(existing[0])
+else:
+    variables = [key for key in load('data/'+options.processor+'.processor').accumulator.keys() if key not in NOT_SAVED]
+
+node = lambda stage, name: stage+'_'+re.sub(r'[^\w.-]', '_', name)
+
+dag = Dag(options.processor, 'dag/'+options.processor)
+dag.submit('run', run_jdl)
+dag.submit('reduce', reduce_jdl)
+dag.submit('merge', merge_jdl)
+for pdi, datasets in samples.items():
+    ledgers = [pwd+'/'+folder+'/'+dataset+'.ledger' for dataset in datasets if drop_stale(folder+'/'+dataset+'.ledger', folder+'/'+dataset+'.futures')]
+    futures = [pwd+'/'+folder+'/'+dataset+'.futures' for dataset in datasets]
+    dag.node(node('run', pdi), 'run', datasets, batch=pdi, ledgers=''.join(', '+ledger for ledger in ledgers))
+    dag.node(node('reduce', pdi), 'reduce', variables, parents=[node('run', pdi)], sample=pdi, futures=''.join(', '+f for f in futures))
+reduced = ''.join(', '+pwd+'/'+folder+'/$(variable)--'+pdi+'.reduced' for pdi in samples)
+dag.node('merge', 'merge', variables, parents=[node('reduce', pdi) for pdi in samples], reduced=reduced)
+dagfile = dag.write()
+print('DAG written to',dagfile+':',sum(len(datasets) for datasets in samples.values()),'run,',len(samples)*len(variables),'reduce and',len(variables),'merge jobs')
+
+for stage in ['run', 'reduce', 'merge']:
+    for log in ['err', 'log', 'out']:
+        os.system('mkdir -p logs/condor/'+stage+'/'+log+'/')
+        os.system('rm -rf logs/condor/'+stage+'/'+log+'/*'+options.processor+'*')
+
+if options.dry_run:
+    FakeScheduler().submit(dagfile)
+else:
+    CondorScheduler().submit(dagfile)
@@ -0,0 +1,51 @@
+from collections.abc import Mapping
+
+
+class ChunkCache(object):
+    """Memo of derived per-event columns for one chunk.
+
+    Entries are keyed by (quantity, region), region-independent quantities
+    use region=None. A new cache is made for every chunk so nothing outlives
+    the events it was computed from.
+    """
+
+    def __init__(self):
+        self._memo = {}
+
+    def __contains__(self, key):
+        return key in self._memo
+
+    def get(self, quantity, compute, region=None):
+        key = (quantity, region)
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+
+
+class LazyDict(Mapping):
+    """Read-only mapping whose values are computed on first access.
+
+    Built from a mapping of key to a function without arguments, e.g. the
+    per-region recoil or scale factors, so that only the regions actually
+    looked up are evaluated, once each. Membership and iteration do not
+    evaluate anything.
+    """
+
+    def __init__(self, factories):
+        self._factories = dict(factories)
+        self._values = {}
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            self._values[key] = self._factories[key]()
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key in self._factories
+
+    def __iter__(self):
+        return iter(self._factories)
+
+    def __len__(self):
+        return len(self._factories)
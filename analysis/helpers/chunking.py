@@ -0,0 +1,99 @@
+import time
+import math
+from collections import defaultdict
+from coffea.processor.executor import WorkItem
+
+
+def _status(field):
+    """Field of /proc/self/status in MB, None if not available"""
+    try:
+        with open('/proc/self/status') as fin:
+            for line in fin:
+                if line.startswith(field+':'):
+                    return float(line.split()[1])/1024.
+    except IOError:
+        pass
+    return None
+
+
+def _reset_peak():
+    try:
+        with open('/proc/self/clear_refs', 'w') as fout:
+            fout.write('5')
+    except IOError:
+        pass
+
+
+_calls = [0]
+
+
+def measure(function, item):
+    """Run function(item) in a worker, also return the wall time, the RSS before and the peak RSS during the call.
+
+    The last value tells whether this was the first call in the worker,
+    which also pays for unpickling the processor and compiling its kernels.
+    """
+    fresh = _calls[0] == 0
+    _calls[0] += 1
+    base = _status('VmRSS')
+    _reset_peak()
+    tstart = time.time()
+    out = function(item)
+    return out, time.time()-tstart, base, _status('VmHWM'), fresh
+
+
+class AdaptiveChunker(object):
+    """Chunk size per dataset from the cost per event of its first chunks.
+
+    The first `probes` chunks of a dataset are processed at the default size.
+    The remaining ranges are then cut so that a chunk takes about target_time
+    seconds and its peak RSS stays within the share of `memory` (MB) of one
+    of the `workers`, with a 20% margin. Probes run on a fresh worker only
+    count when there are no others, and never for the memory limit, as
+    they include the one-time costs of the worker. If the worker already
+    uses its whole share, only the time target is used.
+    """
+
+    def __init__(self, target_time=60., memory=5700., workers=8, probes=2, minsize=1000, maxsize=1000000):
+        self.target_time = target_time
+        self.budget = memory/workers
+        self.probes = probes
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self._measured = defaultdict(list)
+
+    def update(self, dataset, entries, walltime, base, peak, fresh=False):
+        self._measured[dataset].append((entries, walltime, base, peak, fresh))
+
+    def measured(self, dataset):
+        return len(self._measured[dataset])
+
+    def chunksize(self, dataset):
+        measured = [m for m in self._measured[dataset] if not m[4]]
+        warm = len(measured) > 0
+        entries, walltime, base, peak, _ = zip(*(measured or self._measured[dataset]))
+        size = self.target_time*sum(entries)/max(sum(walltime), 1e-6)
+        if warm and None not in base and None not in peak:
+            perevent = max((p-b)/n for n, b, p in zip(entries, base, peak) if n > 0)
+            if self.budget-max(base) <= 0:
+                print('WARNING: workers already use %.0f MB of their %.0f MB, chunk size for %s from the time target only' % (max(base), self.budget, dataset))
+            elif perevent > 0:
+                size = min(size, 0.8*(self.budget-max(base))/perevent)
+        return int(min(max(size, self.minsize), self.maxsize))
+
+    def rechunk(self, chunks, size):
+        """Cut the entry ranges covered by chunks, file by file, into chunks of about size entries"""
+        ranges = defaultdict(list)
+        for chunk in chunks:
+            ranges[(chunk.dataset, chunk.filename, chunk.treename, chunk.fileuuid)].append((chunk.entrystart, chunk.entrystop))
+        out = []
+        for (dataset, filename, treename, fileuuid), spans in ranges.items():
+            merged = []
+            for start, stop in sorted(spans):
+                if merged and merged[-1][1] == start: merged[-1][1] = stop
+                else: merged.append([start, stop])
+            for start, stop in merged:
+                n = int(math.ceil((stop-start)/float(size)))
+                edges = [start+((stop-start)*i)//n for i in range(n+1)]
+                out.extend(WorkItem(dataset, filename, treename, a, b, fileuuid) for a, b in zip(edges[:-1], edges[1:]))
+        return out
@@ -0,0 +1,19 @@
+import json
+from coffea.nanoaod import NanoEvents
+
+
+def discover(processor_instance, filename, dataset, entrystop=1000, treename='Events'):
+    """Branches read by processor_instance.process() on the first entrystop events of filename"""
+    events = NanoEvents.from_file(file=filename, treename=treename, entrystop=entrystop, metadata={'dataset': dataset})
+    processor_instance.process(events)
+    return set(events.materialized)
+
+
+def save_columns(columns, filename):
+    with open(filename, 'w') as fout:
+        json.dump(sorted(columns), fout, indent=1)
+
+
+def load_columns(filename):
+    with open(filename) as fin:
+        return set(json.load(fin))
@@ -0,0 +1,125 @@
+import os
+import re
+import shlex
+from collections import OrderedDict
+
+
+def _expand(value, macros):
+    return re.sub(r'\$\((\w+)\)', lambda m: macros.get(m.group(1), m.group(0)), value)
+
+
+class Dag(object):
+    """DAGMan workflow whose nodes are each one cluster of a shared submit file.
+
+    Every node runs a submit file ending with "queue <variables> from
+    $(items)" over its own item list, so a stage is one submit file and a
+    handful of nodes rather than one condor_submit per job. Node macros
+    are passed with VARS and parents are the nodes that must have
+    completed first.
+    """
+
+    def __init__(self, name, directory):
+        self.name = name
+        self.directory = directory
+        self._submits = OrderedDict()
+        self._nodes = OrderedDict()
+
+    def submit(self, name, description):
+        self._submits[name] = description
+
+    def node(self, name, submit, items, parents=(), **macros):
+        if submit not in self._submits:
+            raise KeyError("Dag: no submit file named %s" % submit)
+        for parent in parents:
+            if parent not in self._nodes:
+                raise KeyError("Dag: parent %s of %s is not defined yet" % (parent, name))
+        self._nodes[name] = {'submit': submit, 'items': list(items), 'parents': list(parents), 'macros': macros}
+
+    def write(self):
+        """Write the submit files, the item lists and <directory>/<name>.dag, whose path is returned"""
+        os.makedirs(self.directory, exist_ok=True)
+        for name, description in self._submits.items():
+            with open(os.path.join(self.directory, name+'.submit'), 'w') as fout:
+                fout.write(description)
+        lines = []
+        for name, node in self._nodes.items():
+            items = os.path.join(self.directory, name+'.items')
+            with open(items, 'w') as fout:
+                fout.write('\n'.join(node['items'])+'\n')
+            lines.append('JOB %s %s' % (name, os.path.join(self.directory, node['submit']+'.submit')))
+            macros = dict(node['macros'], items=items)
+            lines.append('VARS %s %s' % (name, ' '.join('%s="%s"' % (k, v) for k, v in sorted(macros.items()))))
+        for name, node in self._nodes.items():
+            if node['parents']:
+                lines.append('PARENT %s CHILD %s' % (' '.join(node['parents']), name))
+        filename = os.path.join(self.directory, self.name+'.dag')
+        with open(filename, 'w') as fout:
+            fout.write('\n'.join(lines)+'\n')
+        return filename
+
+
+class CondorScheduler(object):
+    """Hands a DAG file to DAGMan"""
+
+    def submit(self, dagfile):
+        os.system('condor_submit_dag -f '+dagfile)
+
+
+class FakeScheduler(object):
+    """Walks a written DAG the way DAGMan would, without submitting anything.
+
+    The DAG, submit and item files are read back from disk, every node is
+    started once all its parents are done, and every job of its cluster is
+    passed to run(node, executable, arguments) with the queue and VARS
+    macros expanded, which by default prints it. The nodes in the order
+    they were run are returned.
+    """
+
+    def __init__(self, run=None):
+        self._run = run or (lambda node, executable, arguments: print(node+':', executable, arguments))
+
+    def _read_dag(self, dagfile):
+        jobs, macros, parents = OrderedDict(), {}, {}
+        with open(dagfile) as fin:
+            for line in fin:
+                words = shlex.split(line)
+                if not words: continue
+                if words[0] == 'JOB':
+                    jobs[words[1]] = words[2]
+                    parents[words[1]] = set()
+                elif words[0] == 'VARS':
+                    macros[words[1]] = dict(word.split('=', 1) for word in words[2:])
+                elif words[0] == 'PARENT':
+                    split = words.index('CHILD')
+                    for child in words[split+1:]:
+                        parents[child].update(words[1:split])
+        return jobs, macros, parents
+
+    def _read_submit(self, filename):
+        submit = {}
+        with open(filename) as fin:
+            for line in fin:
+                if line.lower().startswith('queue'):
+                    submit['queue'] = re.match(r'queue\s+(.*)\s+from\s+(\S+)', line.strip(), re.I).groups()
+                elif '=' in line:
+                    key, value = line.split('=', 1)
+                    submit[key.strip().lower()] = value.strip()
+        return submit
+
+    def submit(self, dagfile):
+        jobs, macros, parents = self._read_dag(dagfile)
+        done = []
+        while len(done) < len(jobs):
+            ready = [name for name in jobs if name not in done and parents[name] <= set(done)]
+            if not ready:
+                raise RuntimeError("FakeScheduler: cycle between %s" % ', '.join(name for name in jobs if name not in done))
+            for name in ready:
+                submit = self._read_submit(jobs[name])
+                variables, items = submit['queue']
+                with open(_expand(items, macros.get(name, {}))) as fin:
+                    for item in fin:
+                        if not item.strip(): continue
+                        values = dict(macros.get(name, {}), **dict(zip(re.split(r'[\s,]+', variables), re.split(r'[\s,]+', item.strip()))))
+                        self._run(name, submit['executable'], _expand(submit['arguments'], values))
+                done.append(name)
+        return done
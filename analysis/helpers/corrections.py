@@ -0,0 +1,91 @@
+import os
+import json
+from coffea.util import save, load
+from helpers.cache import LazyDict
+
+YEARS = ['2016', '2017', '2018']
+
+_loaded = {}
+
+
+def _by_year(value):
+    return isinstance(value, dict) and len(value) > 0 and all(key in YEARS for key in value)
+
+
+def _load(filename):
+    """Load a corrections file once per process, processors are unpickled for every chunk"""
+    if filename not in _loaded:
+        _loaded[filename] = load(filename)
+    return _loaded[filename]
+
+
+def _load_index(filename):
+    if filename not in _loaded:
+        with open(filename) as fin:
+            _loaded[filename] = json.load(fin)
+    return _loaded[filename]
+
+
+def save_corrections(corrections, directory):
+    """Write a corrections dict as one file per entry and year.
+
+    Entries keyed by year are written to <directory>/<year>/<name>.coffea,
+    entries keyed by tagger (or any other key) and then by year to
+    <directory>/<year>/<name>.<key>.coffea, anything else to
+    <directory>/<name>.coffea. index.json records how every entry was split.
+    """
+    index = {}
+    for year in YEARS:
+        os.makedirs(os.path.join(directory, year), exist_ok=True)
+    for name, value in corrections.items():
+        if _by_year(value):
+            index[name] = []
+            for year, entry in value.items():
+                save(entry, os.path.join(directory, year, name+'.coffea'))
+        elif isinstance(value, dict) and len(value) > 0 and all(_by_year(v) for v in value.values()):
+            index[name] = sorted(value)
+            for key in value:
+                for year, entry in value[key].items():
+                    save(entry, os.path.join(directory, year, name+'.'+key+'.coffea'))
+        else:
+            index[name] = None
+            save(value, os.path.join(directory, name+'.coffea'))
+    with open(os.path.join(directory, 'index.json'), 'w') as fout:
+        json.dump(index, fout, indent=1, sort_keys=True)
+
+
+class LazyCorrections(object):
+    """The corrections of save_corrections() for a single year, loaded on first access.
+
+    Indexing works as with the full dict, e.g.
+    corrections['get_pu_weight'][year] or
+    corrections['get_btag_weight']['deepflav'][year], but only the given year
+    is there and every file is read the first time it is looked up. Only the
+    directory and the year are pickled with the processor.
+    """
+
+    def __init__(self, directory, year):
+        self._directory = directory
+        self._year = year
+
+    def _index(self):
+        return _load_index(os.path.join(self._directory, 'index.json'))
+
+    def _file(self, *parts):
+        return os.path.join(self._directory, *parts)
+
+    def __contains__(self, name):
+        return name in self._index()
+
+    def __iter__(self):
+        return iter(self._index())
+
+    def __getitem__(self, name):
+        split = self._index()[name]
+        if split is None:
+            return _load(self._file(name+'.coffea'))
+        year = self._year
+        if not split:
+            return LazyDict({year: lambda: _load(self._file(year, name+'.coffea'))})
+        return {key: LazyDict({year: lambda key=key: _load(self._file(year, name+'.'+key+'.coffea'))}) for key in split}
+
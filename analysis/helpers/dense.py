@@ -0,0 +1,174 @@
+import fnmatch
+import numpy as np
+from coffea import hist, processor
+
+
+class DenseHist(processor.AccumulatorABC):
+    """Preallocated, array-backed histogram for large fixed-layout templates.
+
+    Every category axis other than the dataset is fixed at construction and
+    mapped to an integer index. sumw and sumw2 hold one contiguous float64
+    slab of shape (nbin_1+3, ..., nbin_m+3) per (dataset, category) that has
+    been filled, allocated on its first fill, so a dataset only costs the
+    regions and systematics it actually fills. Dense axes are coffea hist.Bin
+    objects and use the same underflow/overflow/nanflow layout as coffea, so
+    to_hist() is a copy. Adding two DenseHist is one in-place np.add per slab.
+    """
+
+    def __init__(self, label, categories, bins, dataset=('dataset', 'Dataset')):
+        self._label = label
+        self._dataset = tuple(dataset)
+        self._categories = [(name, cat_label, list(identifiers)) for name, cat_label, identifiers in categories]
+        self._bins = list(bins)
+        self._index = {name: {c: i for i, c in enumerate(identifiers)} for name, _, identifiers in self._categories}
+        self._cat_shape = tuple(len(identifiers) for _, _, identifiers in self._categories)
+        self._dense_shape = tuple(ax.size for ax in self._bins)
+        self._sumw = {}
+        self._sumw2 = {}
+
+    def __repr__(self):
+        return "<DenseHist (%s) instance at 0x%0x>" % (",".join([self._dataset[0]] + [c[0] for c in self._categories] + [b.name for b in self._bins]), id(self))
+
+    @property
+    def label(self):
+        return self._label
+
+    @property
+    def shape(self):
+        return self._cat_shape + self._dense_shape
+
+    def _slab(self, dataset, cat):
+        key = (dataset,) + tuple(cat)
+        if key not in self._sumw:
+            self._sumw[key] = np.zeros(self._dense_shape, dtype=np.float64)
+            self._sumw2[key] = np.zeros(self._dense_shape, dtype=np.float64)
+        return self._sumw[key], self._sumw2[key]
+
+    def _cat_index(self, values):
+        try:
+            return tuple(self._index[name][values[name]] for name, _, _ in self._categories)
+        except KeyError as e:
+            raise ValueError("DenseHist categories are fixed at construction, %s is not one of them" % e)
+
+    def identity(self):
+        return DenseHist(self._label, self._categories, self._bins, self._dataset)
+
+    def add(self, other):
+        if not isinstance(other, DenseHist) or other.shape != self.shape:
+            raise ValueError("Cannot add DenseHist with different layouts")
+        for key in other._sumw:
+            if key not in self._sumw:
+                self._sumw[key] = other._sumw[key].copy()
+                self._sumw2[key] = other._sumw2[key].copy()
+                continue
+            np.add(self._sumw[key], other._sumw[key], out=self._sumw[key])
+            np.add(self._sumw2[key], other._sumw2[key], out=self._sumw2[key])
+
+    def index(self, **values):
+        """Flat index of every event into a (dataset, category) slab"""
+        dense_index = tuple(np.asarray(ax.index(values[ax.name])).reshape(-1) for ax in self._bins)
+        return np.ravel_multi_index(dense_index, self._dense_shape)
+
+    def fill(self, weight=None, **values):
+        """Same call signature as hist.Hist.fill, categories must be scalars"""
+        dataset = values.pop(self._dataset[0])
+        sumw, sumw2 = self._slab(dataset, self._cat_index(values))
+        index = self.index(**values)
+        size = int(np.prod(self._dense_shape))
+        slab, slab2 = sumw.reshape(-1), sumw2.reshape(-1)
+        if weight is None:
+            counts = np.bincount(index, minlength=size)
+            slab += counts
+            slab2 += counts
+        else:
+            weight = np.broadcast_to(np.asarray(weight, dtype=np.float64), index.shape)
+            slab += np.bincount(index, weights=weight, minlength=size)
+            slab2 += np.bincount(index, weights=weight*weight, minlength=size)
+
+    def fill_systematics(self, axis, identifiers, weight, index=None, **values):
+        """Fill several identifiers of one category axis in a single pass.
+
+        weight is an (len(identifiers), n_events) matrix, row i is filled into
+        identifiers[i]. The events are binned once, either here from the dense
+        values or by the caller through index(), which allows the same binning
+        to be reused for several fills. All the rows are binned with one
+        np.bincount on a combined (row, bin) index and added to their slabs.
+        """
+        dataset = values.pop(self._dataset[0])
+        if index is None:
+            index = self.index(**{ax.name: values.pop(ax.name) for ax in self._bins})
+        weight = np.asarray(weight, dtype=np.float64).reshape(len(identifiers), -1)
+        size = int(np.prod(self._dense_shape))
+        index = (np.arange(len(identifiers))[:, None]*size + index[None, :]).reshape(-1)
+        weight = weight.reshape(-1)
+        sumw = np.bincount(index, weights=weight, minlength=len(identifiers)*size).reshape(len(identifiers), size)
+        sumw2 = np.bincount(index, weights=weight*weight, minlength=len(identifiers)*size).reshape(len(identifiers), size)
+        for i, identifier in enumerate(identifiers):
+            values[axis] = identifier
+            slab, slab2 = self._slab(dataset, self._cat_index(values))
+            slab += sumw[i].reshape(self._dense_shape)
+            slab2 += sumw2[i].reshape(self._dense_shape)
+
+    def dense_axes(self):
+        return list(self._bins)
+
+    def identifiers(self, axis, overflow='none'):
+        if axis == self._dataset[0]:
+            return [hist.StringBin(d) for d in dict.fromkeys(key[0] for key in self._sumw)]
+        for name, _, identifiers in self._categories:
+            if name == axis: return [hist.StringBin(c) for c in identifiers]
+        raise KeyError("No sparse axis named %s" % axis)
+
+    def values(self, sumw2=False, overflow='none'):
+        """Same as hist.Hist.values, only the filled (dataset, category) slabs are returned"""
+        view = tuple(hist.hist_tools.overflow_behavior(overflow) for _ in self._bins)
+        out = {}
+        for key in self._sumw:
+            name = (key[0],) + tuple(self._categories[i][2][c] for i, c in enumerate(key[1:]))
+            out[name] = (self._sumw[key][view], self._sumw2[key][view]) if sumw2 else self._sumw[key][view]
+        return out
+
+    def scale(self, factor, axis=None):
+        """Scale by a number, or per dataset with a {dataset: factor} mapping"""
+        if not isinstance(factor, dict):
+            for key in self._sumw:
+                self._sumw[key] *= factor
+                self._sumw2[key] *= factor*factor
+            return
+        if axis != self._dataset[0]:
+            raise ValueError("DenseHist can only be scaled along the %s axis" % self._dataset[0])
+        factor = {str(dataset): f for dataset, f in factor.items()}
+        for key in self._sumw:
+            if key[0] not in factor: continue
+            self._sumw[key] *= factor[key[0]]
+            self._sumw2[key] *= factor[key[0]]**2
+
+    def group(self, old_axes, new_axis, mapping, overflow='none'):
+        """Regroup datasets, mapping values are (lists of) glob patterns as for hist.Hist.group"""
+        if isinstance(old_axes, str): old_axes = (old_axes,)
+        if tuple(old_axes) != (self._dataset[0],):
+            raise ValueError("DenseHist can only be grouped along the %s axis" % self._dataset[0])
+        out = DenseHist(self._label, self._categories, self._bins, (new_axis.name, new_axis.label))
+        for new, patterns in mapping.items():
+            if isinstance(patterns, str): patterns = (patterns,)
+            for key in self._sumw:
+                if not any(fnmatch.fnmatchcase(key[0], str(p)) for p in patterns): continue
+                sumw, sumw2 = out._slab(str(new), key[1:])
+                np.add(sumw, self._sumw[key], out=sumw)
+                np.add(sumw2, self._sumw2[key], out=sumw2)
+        return out
+
+    def to_hist(self):
+        """Convert to a coffea hist.Hist for the datacard and plotting code"""
+        h = hist.Hist(self._label,
+                      hist.Cat(self._dataset[0], self._dataset[1]),
+                      *[hist.Cat(name, cat_label) for name, cat_label, _ in self._categories],
+                      *self._bins)
+        sparse = h.sparse_axes()
+        for key, (sumw, sumw2) in self.values(sumw2=True, overflow='allnan').items():
+            if not sumw.any() and not sumw2.any(): continue
+            sparse_key = tuple(ax.index(k) for ax, k in zip(sparse, key))
+            h._sumw[sparse_key] = sumw.copy()
+            if h._sumw2 is None: h._init_sumw2()
+            h._sumw2[sparse_key] = sumw2.copy()
+        return h
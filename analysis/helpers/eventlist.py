@@ -0,0 +1,36 @@
+import numpy as np
+
+# Packed key layout: run in bits 45-63, luminosity block in bits 32-44,
+# event number in bits 0-31
+RUN_BITS, LUMI_BITS, EVENT_BITS = 19, 13, 32
+
+
+def pack(run, lumi, event):
+    """Pack (run, lumi, event) into uint64 keys, also return which triplets fit the layout"""
+    run = np.asarray(run).astype(np.uint64)
+    lumi = np.asarray(lumi).astype(np.uint64)
+    event = np.asarray(event).astype(np.uint64)
+    valid = (run < (1 << RUN_BITS)) & (lumi < (1 << LUMI_BITS)) & (event < (1 << EVENT_BITS))
+    keys = (run << np.uint64(LUMI_BITS+EVENT_BITS)) | (lumi << np.uint64(EVENT_BITS)) | event
+    return keys, valid
+
+
+class EventList(object):
+    """Sorted packed (run, lumi, event) keys with a vectorised membership test"""
+
+    def __init__(self, run, lumi, event):
+        keys, valid = pack(run, lumi, event)
+        if not valid.all():
+            raise ValueError("EventList: %d (run, lumi, event) do not fit in the packed key" % (~valid).sum())
+        self._keys = np.unique(keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __call__(self, run, lumi, event):
+        """True for the events that are in the list, an exact tuple match in O(N log M)"""
+        keys, valid = pack(run, lumi, event)
+        if len(self._keys) == 0:
+            return np.zeros(len(keys), dtype=np.bool_)
+        index = np.minimum(np.searchsorted(self._keys, keys), len(self._keys)-1)
+        return valid & (self._keys[index] == keys)
@@ -0,0 +1,102 @@
+import time
+import hashlib
+import concurrent.futures
+from collections import defaultdict
+from functools import partial
+
+import lz4.frame as lz4f
+import cloudpickle
+from coffea.processor import dict_accumulator
+from coffea.processor.executor import (_work_function, _get_metadata, _normalize_fileset,
+                                       _compression_wrapper, _maybe_decompress)
+from helpers.ledger import Ledger
+from helpers.chunking import measure
+
+
+def _chunks(pool, fileset, treename, chunksize):
+    """Work items per dataset, file metadata is fetched through the pool"""
+    filemetas = list(_normalize_fileset(fileset, treename))
+    populated = set()
+    for out in pool.map(_get_metadata, filemetas):
+        populated |= set(out)
+    chunks = defaultdict(list)
+    for filemeta in populated:
+        chunks[filemeta.dataset].extend(filemeta.chunks(chunksize, False))
+    return chunks
+
+
+def run_datasets(fileset, processor_instance, save_dataset, treename='Events', chunksize=100000, workers=8, nano=True, ledger=None, chunker=None, processor_hash=''):
+    """Process every dataset of fileset in a single worker pool.
+
+    All the chunks are submitted at once, dataset after dataset with the
+    largest datasets first, so idle workers pick up the chunks of the next
+    dataset instead of waiting for the tail of the current one. Every dataset
+    keeps its own accumulator; as soon as its last chunk is in, it is
+    postprocessed and handed to save_dataset(dataset, output, metrics).
+
+    ledger(dataset) gives the file where the progress of a dataset is
+    checkpointed; chunks found there are not processed again, unless the
+    ledger was written for another processor_hash or other input files.
+    With an AdaptiveChunker only the first chunks of a new dataset are
+    submitted, the rest is cut to the chunk size they measure.
+    """
+    pi_to_send = lz4f.compress(cloudpickle.dumps(processor_instance), compression_level=1)
+    fingerprint = lambda dataset: hashlib.sha1((processor_hash+repr(fileset[dataset])).encode()).hexdigest()
+    closure = _compression_wrapper(1, partial(_work_function, processor_instance=pi_to_send, nano=nano, savemetrics=True))
+    closure = partial(measure, closure)
+    identity = lambda: dict_accumulator({'out': processor_instance.accumulator.identity(), 'metrics': dict_accumulator()})
+    ledgers = {dataset: Ledger(ledger(dataset) if ledger else None, identity(), fingerprint=fingerprint(dataset)) for dataset in fileset}
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        tochunk = {dataset: files for dataset, files in fileset.items() if ledgers[dataset].chunks is None}
+        for dataset, chunks in _chunks(pool, tochunk, treename, chunksize).items():
+            ledgers[dataset].chunks = chunks
+        order = [dataset for dataset in ledgers if ledgers[dataset].chunks is not None]
+        order.sort(key=lambda d: -sum(c.entrystop-c.entrystart for c in ledgers[d].missing()))
+        pending = {dataset: len(ledgers[dataset].missing()) for dataset in order}
+        print('Submitting',sum(pending.values()),'chunks from',len(order),'datasets')
+
+        def finish(dataset):
+            out = ledgers[dataset].out
+            processor_instance.postprocess(out['out'])
+            print('Done:',dataset,'after %.1f s,' % (time.time()-tstart),len(futures),'chunks left')
+            save_dataset(dataset, out['out'], out['metrics'])
+            ledgers.pop(dataset).remove()
+
+        futures = {}
+        held = {}
+        for dataset in order:
+            missing = ledgers[dataset].missing()
+            if chunker and not ledgers[dataset].done and len(missing) > chunker.probes:
+                held[dataset] = missing[chunker.probes:]
+                missing = missing[:chunker.probes]
+            for chunk in missing:
+                futures[pool.submit(closure, chunk)] = (dataset, chunk)
+        tstart = time.time()
+        try:
+            for dataset in order:
+                if pending[dataset] == 0: finish(dataset)
+            while futures:
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    dataset, chunk = futures.pop(future)
+                    result, walltime, base, peak, fresh = future.result()
+                    ledgers[dataset].add(chunk, _maybe_decompress(result))
+                    pending[dataset] -= 1
+                    if dataset in held:
+                        chunker.update(dataset, chunk.entrystop-chunk.entrystart, walltime, base, peak, fresh)
+                        if chunker.measured(dataset) == chunker.probes:
+                            size = chunker.chunksize(dataset)
+                            rest = chunker.rechunk(held.pop(dataset), size)
+                            print('Chunk size for',dataset+':',size,'entries,',len(rest),'chunks left')
+                            ledgers[dataset].chunks = ledgers[dataset].chunks[:chunker.probes]+rest
+                            pending[dataset] = len(ledgers[dataset].missing())
+                            for chunk in rest:
+                                futures[pool.submit(closure, chunk)] = (dataset, chunk)
+                    if pending[dataset] == 0: finish(dataset)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            for dataset in ledgers:
+                ledgers[dataset].save()
+            raise
@@ -0,0 +1,107 @@
+import os
+import json
+import zipfile
+import lz4.frame as lz4f
+import cloudpickle
+from coffea.processor import dict_accumulator
+from coffea.util import load
+from helpers.cache import LazyDict
+
+INDEX = 'index.json'
+
+# Accumulator keys run.py writes to their own files, never to the .futures
+NOT_SAVED = ['profile', 'skim']
+
+
+class FuturesWriter(object):
+    """Sharded .futures file written one key at a time, see save_futures.
+
+    The zip is written to <filename>.tmp and only moved to filename once
+    close() has written the index, so an interrupted write never leaves a
+    truncated file under the final name. abort() deletes the temporary file.
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._tmp = filename+'.tmp'
+        self._zip = zipfile.ZipFile(self._tmp, 'w', zipfile.ZIP_STORED)
+        self._index = {}
+
+    def add(self, key, value):
+        self._index[key] = '%d.lz4' % len(self._index)
+        self._zip.writestr(self._index[key], lz4f.compress(cloudpickle.dumps(value), compression_level=1))
+
+    def close(self):
+        self._zip.writestr(INDEX, json.dumps(self._index))
+        self._zip.close()
+        os.replace(self._tmp, self._filename)
+
+    def abort(self):
+        self._zip.close()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def save_futures(output, filename):
+    """Write an output accumulator as a zip with one lz4 pickle per key.
+
+    index.json maps every key to its member, so single histograms can be
+    read, and the keys listed, without touching the others.
+    """
+    with FuturesWriter(filename) as fout:
+        for key, value in output.items():
+            fout.add(key, value)
+
+
+def _index(zin):
+    return json.loads(zin.read(INDEX))
+
+
+def futures_keys(filename):
+    """Keys of a .futures file, only the index of a sharded file is read"""
+    if not zipfile.is_zipfile(filename):
+        return list(load(filename).keys())
+    with zipfile.ZipFile(filename) as zin:
+        return list(_index(zin))
+
+
+def load_futures(filename, keys=None):
+    """Load the given keys, or all of them, of a sharded or of a plain coffea .futures file"""
+    if not zipfile.is_zipfile(filename):
+        out = load(filename)
+        if keys is not None:
+            out = dict_accumulator({k: v for k, v in out.items() if k in keys})
+        return out
+    out = dict_accumulator()
+    with zipfile.ZipFile(filename) as zin:
+        for key, member in _index(zin).items():
+            if keys is not None and key not in keys: continue
+            out[key] = cloudpickle.loads(lz4f.decompress(zin.read(member)))
+    return out
+
+
+def _read(filename, member):
+    with zipfile.ZipFile(filename) as zin:
+        return cloudpickle.loads(lz4f.decompress(zin.read(member)))
+
+
+def load_scaled(filename):
+    """{'bkg'|'sig'|'data': {key: hist}} of a .scaled file, each histogram is read on first access"""
+    if not zipfile.is_zipfile(filename):
+        return load(filename)
+    with zipfile.ZipFile(filename) as zin:
+        index = _index(zin)
+    members = {}
+    for name, member in index.items():
+        category, key = name.split('/', 1)
+        members.setdefault(category, {})[key] = lambda member=member: _read(filename, member)
+    return {category: LazyDict(factories) for category, factories in members.items()}
@@ -0,0 +1,198 @@
+import numpy as np
+import awkward
+from numba import njit
+
+# statusFlags bits, as in coffea.nanoaod.methods.GenParticle.FLAGS
+FROMHARDPROCESS = 1 << 8
+ISFIRSTCOPY = 1 << 12
+ISLASTCOPY = 1 << 13
+
+# Quarks counted per fat jet for each sign of the mother: q/c from a W from
+# a top, b from a top, q/c from a W, b/c/q from a Z, b from a H, b from a Hs.
+# The last two channels are last-copy b and c quarks of any origin.
+CHANNELS = ['tWq', 'tWc', 'tb', 'Wq', 'Wc', 'Zb', 'Zc', 'Zq', 'Hb', 'Hsb']
+NCHANNELS = 2*len(CHANNELS)+2
+B, C = 2*len(CHANNELS), 2*len(CHANNELS)+1
+
+
+@njit
+def _distinct_parent(pdg, mother):
+    """Mother index skipping ancestors with the same pdgId, as GenParticle.distinctParent"""
+    out = mother.copy()
+    for i in range(len(pdg)):
+        parent = mother[i]
+        while parent >= 0 and pdg[parent] == pdg[i]:
+            parent = mother[parent]
+        out[i] = parent
+    return out
+
+
+@njit
+def _count_matches(fj_offsets, fj_eta, fj_phi, gen_starts, gen_stops, gen_eta, gen_phi, gen_channels, dr, out):
+    dr2 = dr*dr
+    for iev in range(len(fj_offsets)-1):
+        for i in range(fj_offsets[iev], fj_offsets[iev+1]):
+            for k in range(gen_starts[iev], gen_stops[iev]):
+                channels = gen_channels[k]
+                if channels == 0: continue
+                deta = gen_eta[k]-fj_eta[i]
+                dphi = (gen_phi[k]-fj_phi[i]+np.pi) % (2*np.pi) - np.pi
+                if deta*deta+dphi*dphi >= dr2: continue
+                for c in range(NCHANNELS):
+                    if (channels >> c) & 1: out[i, c] += 1
+
+
+@njit
+def _dynamic_isolation(offsets, eta, phi, pt, candidate, hadron, r0, epsilon, n, iterations, out):
+    for iev in range(len(offsets)-1):
+        hadrons = np.arange(offsets[iev], offsets[iev+1])[hadron[offsets[iev]:offsets[iev+1]]]
+        for i in range(offsets[iev], offsets[iev+1]):
+            if not candidate[i]: continue
+            if len(hadrons) == 0:
+                out[i] = True
+                continue
+            dr = np.empty(len(hadrons))
+            for j in range(len(hadrons)):
+                dphi = (phi[hadrons[j]]-phi[i]+np.pi) % (2*np.pi) - np.pi
+                dr[j] = np.sqrt((eta[hadrons[j]]-eta[i])**2 + dphi*dphi)
+            order = np.argsort(dr)
+            isolated = True
+            k, et = 0, 0.
+            for it in range(1, iterations+1):
+                R = r0[i]*it/iterations
+                while k < len(hadrons) and dr[order[k]] <= R:
+                    et += pt[hadrons[order[k]]]
+                    k += 1
+                if not et <= epsilon*pt[i]*((1-np.cos(R))/(1-np.cos(r0[i])))**n:
+                    isolated = False
+                    break
+            out[i] = isolated
+
+
+def _mother_index(gen):
+    """Mother of every particle as an index into gen.content, -1 if none"""
+    content = gen.content
+    if isinstance(content, awkward.VirtualArray): content = content.array
+    parent = content.parent
+    if isinstance(parent, awkward.VirtualArray): parent = parent.array
+    return np.asarray(parent.mask, dtype=np.int64)
+
+
+def gen_channels(gen):
+    """One bit per matching channel for every generator particle, in gen.content order"""
+    pdg = np.asarray(gen.pdgId.content, dtype=np.int64)
+    flags = np.asarray(gen.statusFlags.content, dtype=np.int64)
+    dp = _distinct_parent(pdg, _mother_index(gen))
+    dppdg = np.where(dp >= 0, pdg[dp], 0)
+    dpdp = np.where(dp >= 0, dp[dp], -1)
+    dpdppdg = np.where(dpdp >= 0, pdg[dpdp], 0)
+
+    apdg = abs(pdg)
+    first = (flags & (FROMHARDPROCESS|ISFIRSTCOPY)) == (FROMHARDPROCESS|ISFIRSTCOPY)
+    last = (flags & (FROMHARDPROCESS|ISLASTCOPY)) == (FROMHARDPROCESS|ISLASTCOPY)
+    isq, isc, isb = first&(apdg<4), first&(apdg==4), first&(apdg==5)
+    fromW = abs(dppdg) == 24
+
+    channels = np.zeros(len(pdg), dtype=np.int64)
+    for offset, sign in [(0, 1), (len(CHANNELS), -1)]:
+        for c, match in enumerate([
+                isq & fromW & (dpdppdg == 6*sign),
+                isc & fromW & (dpdppdg == 6*sign),
+                isb & (dppdg == 6*sign),
+                isq & (dppdg == 24*sign),
+                isc & (dppdg == 24*sign),
+                isb & (dppdg == 23*sign),
+                isc & (dppdg == 23*sign),
+                isq & (dppdg == 23*sign),
+                isb & (dppdg == 25*sign),
+                isb & (dppdg == 54*sign)]):
+            channels |= match.astype(np.int64) << (offset+c)
+    channels |= (last&(apdg==5)).astype(np.int64) << B
+    channels |= (last&(apdg==4)).astype(np.int64) << C
+    return channels
+
+
+def dynamic_isolation(gen, candidate, hadron, r0, epsilon, n, iterations=5):
+    """Dynamic cone isolation of the candidates, as in arXiv:1705.04664.
+
+    A candidate is isolated if, for R = r0*i/iterations with i = 1..iterations,
+    the hadronic pt within delta R <= R stays below epsilon*pt*((1-cos R)/(1-cos r0))^n.
+    The distances to the hadrons of the event are computed and sorted once per
+    candidate and all the cones are read from their running sum.
+    """
+    out = np.zeros(gen.counts.sum(), dtype=np.bool_)
+    offsets = np.zeros(len(gen.counts)+1, dtype=np.int64)
+    np.cumsum(gen.counts, out=offsets[1:])
+    _dynamic_isolation(offsets,
+                       np.asarray(gen.eta.flatten(), dtype=np.float64),
+                       np.asarray(gen.phi.flatten(), dtype=np.float64),
+                       np.asarray(gen.pt.flatten(), dtype=np.float64),
+                       np.asarray(candidate.flatten(), dtype=np.bool_),
+                       np.asarray(hadron.flatten(), dtype=np.bool_),
+                       np.asarray(r0.flatten(), dtype=np.float64),
+                       float(epsilon), float(n), int(iterations), out)
+    return awkward.JaggedArray.fromcounts(gen.counts, out)
+
+
+def match_counts(fj, gen, dR=1.5):
+    """(n_fatjets, NCHANNELS) number of generator quarks of each channel within dR of every fat jet.
+
+    Fat jets are taken flat in fj order, matching uses the soft-drop p4 as the
+    analysis does. The parentage is walked once and every fat jet meets every
+    tagged generator quark of its event once.
+    """
+    fj_offsets = np.zeros(len(fj.counts)+1, dtype=np.int64)
+    np.cumsum(fj.counts, out=fj_offsets[1:])
+    out = np.zeros((fj_offsets[-1], NCHANNELS), dtype=np.int64)
+    _count_matches(fj_offsets,
+                   np.asarray(fj.sd.eta.flatten(), dtype=np.float64),
+                   np.asarray(fj.sd.phi.flatten(), dtype=np.float64),
+                   np.asarray(gen.starts, dtype=np.int64),
+                   np.asarray(gen.stops, dtype=np.int64),
+                   np.asarray(gen.eta.content, dtype=np.float64),
+                   np.asarray(gen.phi.content, dtype=np.float64),
+                   gen_channels(gen),
+                   float(dR),
+                   out)
+    return out
+
+
+def categories(counts):
+    """Gentype categories of every fat jet from its match counts, as a dict of boolean arrays"""
+    cat = {k: np.zeros(len(counts), dtype=np.bool_) for k in ['xbb', 'tbcq', 'tbqq', 'zcc', 'wcq', 'vqq', 'tbc', 'tbq']}
+    for offset in [0, len(CHANNELS)]:
+        tWq, tWc, tb, Wq, Wc, Zb, Zc, Zq, Hb, Hsb = [counts[:, offset+c] for c in range(len(CHANNELS))]
+        cat['xbb']  |= (Hsb==2)|(Hb==2)|(Zb==2)
+        cat['tbcq'] |= (tWc==1)&(tWq==1)&(tb==1)
+        cat['tbqq'] |= (tWq==2)&(tb==1)
+        cat['zcc']  |= (Zc==2)
+        cat['wcq']  |= ((tWc==1)&(tWq==1))|((Wc==1)&(Wq==1))
+        cat['vqq']  |= (Wq==2)|(Zq==2)|(tWq==2)
+        cat['tbc']  |= (tWc==1)&(tb==1)
+        cat['tbq']  |= (tWq==1)&(tb==1)
+    nb, nc = counts[:, B], counts[:, C]
+    cat['bb'] = (nb==2)
+    cat['bc'] = cat.pop('tbc')|((nb==1)&(nc==1))
+    cat['b']  = cat.pop('tbq')|(nb==1)
+    cat['cc'] = (nc==2)
+    cat['c']  = (nc==1)
+    return cat
+
+
+def gentype_table(gentype_map):
+    """Code of the first category set in a bitmask, categories ordered by code, 'other' if none"""
+    ordered = sorted((v, k) for k, v in gentype_map.items() if k != 'other')
+    table = np.full(1 << len(ordered), gentype_map['other'], dtype=np.int64)
+    for mask in range(1, len(table)):
+        table[mask] = ordered[(mask & -mask).bit_length()-1][0]
+    return table
+
+
+def gentype(fj, gen, gentype_map, dR=1.5):
+    """Gentype code of every fat jet, jagged like fj, following the priority of gentype_map"""
+    cat = categories(match_counts(fj, gen, dR))
+    ordered = sorted((v, k) for k, v in gentype_map.items() if k != 'other')
+    mask = np.zeros(fj.counts.sum(), dtype=np.int64)
+    for bit, (_, name) in enumerate(ordered):
+        mask |= cat[name].astype(np.int64) << bit
+    return awkward.JaggedArray.fromcounts(fj.counts, gentype_table(gentype_map)[mask])
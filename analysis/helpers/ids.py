@@ -0,0 +1,127 @@
+import numpy as np
+import awkward
+from numba import njit
+
+# Bits of the packed ID masks: leptons and photons carry LOOSE/TIGHT,
+# jets carry GOOD/HEM
+LOOSE = 1
+TIGHT = 2
+GOOD = 1
+HEM = 2
+
+
+def _flat(array, dtype):
+    return np.asarray(array.flatten(), dtype=dtype)
+
+
+def _jagged(counts, out):
+    return awkward.JaggedArray.fromcounts(counts, out)
+
+
+#Electron_cutBased  Int_t   cut-based ID Fall17 V2 (0:fail, 1:veto, 2:loose, 3:medium, 4:tight)
+@njit
+def _electron_id(pt, eta, dxy, dz, cutbased, loose_pt, tight_pt, out):
+    for i in range(len(pt)):
+        aeta = abs(eta[i])
+        if aeta < 1.4442:
+            if not (abs(dxy[i]) < 0.05 and abs(dz[i]) < 0.1): continue
+        elif aeta > 1.5660 and aeta < 2.5:
+            if not (abs(dxy[i]) < 0.1 and abs(dz[i]) < 0.2): continue
+        else:
+            continue
+        if pt[i] > loose_pt and cutbased[i] >= 1: out[i] |= LOOSE
+        if pt[i] > tight_pt and cutbased[i] == 4: out[i] |= TIGHT
+
+
+def electron_id(pt, eta, dxy, dz, cutbased, loose_pt, tight_pt):
+    """Loose (veto ID) and tight (tight ID) electron bits, eta is the supercluster eta"""
+    out = np.zeros(pt.counts.sum(), dtype=np.uint8)
+    _electron_id(_flat(pt, np.float64), _flat(eta, np.float64), _flat(dxy, np.float64), _flat(dz, np.float64),
+                 _flat(cutbased, np.int64), loose_pt, tight_pt, out)
+    return _jagged(pt.counts, out)
+
+
+#dxy and dz cuts are missing from loose_id and baked in tight_id; loose isolation is 0.25, tight is 0.15
+@njit
+def _muon_id(pt, eta, iso, loose_id, tight_id, loose_pt, tight_pt, out):
+    for i in range(len(pt)):
+        if not abs(eta[i]) < 2.4: continue
+        if pt[i] > loose_pt and loose_id[i] and iso[i] < 0.25: out[i] |= LOOSE
+        if pt[i] > tight_pt and tight_id[i] and iso[i] < 0.15: out[i] |= TIGHT
+
+
+def muon_id(pt, eta, iso, loose_id, tight_id, loose_pt, tight_pt):
+    out = np.zeros(pt.counts.sum(), dtype=np.uint8)
+    _muon_id(_flat(pt, np.float64), _flat(eta, np.float64), _flat(iso, np.float64),
+             _flat(loose_id, np.bool_), _flat(tight_id, np.bool_), loose_pt, tight_pt, out)
+    return _jagged(pt.counts, out)
+
+
+#bitmask 1 = VVLoose, 2 = VLoose, 4 = Loose, 8 = Medium, 16 = Tight, 32 = VTight, 64 = VVTight
+@njit
+def _tau_id(pt, eta, decay_mode, mva_id, out):
+    for i in range(len(pt)):
+        if pt[i] > 18 and abs(eta[i]) < 2.3 and decay_mode[i] and (mva_id[i] & 2) == 2: out[i] |= LOOSE
+
+
+def tau_id(pt, eta, decay_mode, mva_id):
+    out = np.zeros(pt.counts.sum(), dtype=np.uint8)
+    _tau_id(_flat(pt, np.float64), _flat(eta, np.float64), _flat(decay_mode, np.bool_), _flat(mva_id, np.int64), out)
+    return _jagged(pt.counts, out)
+
+
+#Photon_cutBased Int_t "cut-based spring16-V2p2 ID (0:fail, 1:loose, 2:medium, 3:tight" for 2016 NanoAOD
+#Photon_cutBasedBitmap  Int_t   cut-based ID bitmap, 2^(0:loose, 1:medium, 2:tight)
+#Tight photons use the medium ID and are barrel only, as in monojet
+@njit
+def _photon_id(pt, eta, cutbased, electron_veto, is_eb, bitmap, tight_pt, out):
+    for i in range(len(pt)):
+        if not electron_veto[i]: continue
+        if bitmap:
+            loose_id, medium_id = (cutbased[i] & 1) == 1, (cutbased[i] & 2) == 2
+        else:
+            loose_id, medium_id = cutbased[i] >= 1, cutbased[i] >= 2
+        aeta = abs(eta[i])
+        if pt[i] > 15 and not (aeta > 1.4442 and aeta < 1.5660) and aeta < 2.5 and loose_id: out[i] |= LOOSE
+        if pt[i] > tight_pt and medium_id and is_eb[i]: out[i] |= TIGHT
+
+
+def photon_id(pt, eta, cutbased, electron_veto, is_eb, bitmap, tight_pt):
+    """Loose and tight photon bits, both include the electron veto.
+
+    cutbased is Photon_cutBasedBitmap if bitmap is True, Photon_cutBased otherwise.
+    """
+    out = np.zeros(pt.counts.sum(), dtype=np.uint8)
+    _photon_id(_flat(pt, np.float64), _flat(eta, np.float64), _flat(cutbased, np.int64),
+               _flat(electron_veto, np.bool_), _flat(is_eb, np.bool_), bitmap, tight_pt, out)
+    return _jagged(pt.counts, out)
+
+
+#Jet ID flags bit1 is loose (always false in 2017 since it does not exist), bit2 is tight, bit3 is tightLepVeto
+#POG use tight jetID as a standart JetID, pileup ID loose wp below 50 GeV
+@njit
+def _jet_id(pt, eta, phi, jet_id, pu_id, nhf, chf, out):
+    for i in range(len(pt)):
+        if (pt[i] > 30 and abs(eta[i]) < 2.4 and (jet_id[i] & 2) == 2 and nhf[i] < 0.8 and chf[i] > 0.1
+                and (pt[i] >= 50 or (pu_id[i] & 1) == 1)):
+            out[i] |= GOOD
+        if pt[i] > 30 and eta[i] > -3.0 and eta[i] < -1.3 and phi[i] > -1.57 and phi[i] < -0.87: out[i] |= HEM
+
+
+def jet_id(pt, eta, phi, jet_id, pu_id, nhf, chf):
+    out = np.zeros(pt.counts.sum(), dtype=np.uint8)
+    _jet_id(_flat(pt, np.float64), _flat(eta, np.float64), _flat(phi, np.float64), _flat(jet_id, np.int64),
+            _flat(pu_id, np.int64), _flat(nhf, np.float64), _flat(chf, np.float64), out)
+    return _jagged(pt.counts, out)
+
+
+@njit
+def _fatjet_id(pt, eta, jet_id, out):
+    for i in range(len(pt)):
+        if pt[i] > 160 and abs(eta[i]) < 2.4 and (jet_id[i] & 2) == 2: out[i] |= GOOD
+
+
+def fatjet_id(pt, eta, jet_id):
+    out = np.zeros(pt.counts.sum(), dtype=np.uint8)
+    _fatjet_id(_flat(pt, np.float64), _flat(eta, np.float64), _flat(jet_id, np.int64), out)
+    return _jagged(pt.counts, out)
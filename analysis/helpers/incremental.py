@@ -0,0 +1,166 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+from contextlib import contextmanager
+from copy import deepcopy
+from collections import defaultdict
+from coffea.util import load, save
+from helpers.reduction import treereduce
+
+
+def negated(h):
+    """Copy of a hist.Hist or DenseHist with sumw and sumw2 negated, adding it subtracts h"""
+    if not hasattr(h, '_sumw'):
+        raise TypeError("negated: cannot subtract a %s" % type(h).__name__)
+    out = deepcopy(h)
+    for buffers in (out._sumw, out._sumw2 or {}):
+        for key in buffers:
+            buffers[key] = -buffers[key]
+    return out
+
+
+class Manifest(object):
+    """Content hashes of the inputs summed into the output files of a folder.
+
+    Kept in <folder>/.manifest/: manifest.json maps every output file to the
+    {input name: hash} it was summed from, and every input is copied there,
+    under its hash, as it was when summed, so that a changed or removed
+    input can be subtracted again. Hashes are recomputed only for files
+    whose size or modification time changed.
+    """
+
+    def __init__(self, folder):
+        self._dir = os.path.join(folder, '.manifest')
+        self._file = os.path.join(self._dir, 'manifest.json')
+        self._files, self._outputs = self._read()
+        self._recorded = set()
+
+    def _read(self):
+        if not os.path.exists(self._file): return {}, {}
+        with open(self._file) as fin:
+            state = json.load(fin)
+        return state['files'], state['outputs']
+
+    @contextmanager
+    def lock(self):
+        """Hold <folder>/.manifest/lock and reload the manifest, from load through record to save"""
+        os.makedirs(self._dir, exist_ok=True)
+        with open(os.path.join(self._dir, 'lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._files, self._outputs = self._read()
+                self._recorded = set()
+                yield self
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def hash(self, filename):
+        stat = os.stat(filename)
+        name = os.path.basename(filename)
+        known = self._files.get(name)
+        if known is None or known['size'] != stat.st_size or known['mtime'] != stat.st_mtime:
+            sha = hashlib.sha1()
+            with open(filename, 'rb') as fin:
+                for block in iter(lambda: fin.read(1 << 24), b''):
+                    sha.update(block)
+            known = {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': sha.hexdigest()}
+            self._files[name] = known
+        return known['hash']
+
+    def inputs(self, output):
+        if not os.path.exists(output): return None
+        return self._outputs.get(os.path.basename(output))
+
+    def contribution(self, digest):
+        return os.path.join(self._dir, digest)
+
+    def record(self, output, filenames):
+        """Note the inputs of output and keep a copy of each of them"""
+        os.makedirs(self._dir, exist_ok=True)
+        inputs = {}
+        for filename in filenames:
+            digest = self.hash(filename)
+            inputs[os.path.basename(filename)] = digest
+            if not os.path.exists(self.contribution(digest)):
+                shutil.copyfile(filename, self.contribution(digest)+'.tmp')
+                os.replace(self.contribution(digest)+'.tmp', self.contribution(digest))
+        self._outputs[os.path.basename(output)] = inputs
+        self._recorded.add(os.path.basename(output))
+
+    def save(self):
+        """Merge into manifest.json on disk and drop the copies no output refers to anymore.
+
+        Only the outputs recorded since the manifest was (re)loaded replace
+        the ones on disk, so the outputs written by another run in the same
+        folder are kept, together with their copies.
+        """
+        if not os.path.isdir(self._dir): return
+        files, outputs = self._read()
+        files.update(self._files)
+        outputs.update({name: self._outputs[name] for name in self._recorded})
+        self._files, self._outputs = files, outputs
+        used = set(digest for inputs in self._outputs.values() for digest in inputs.values())
+        for name in os.listdir(self._dir):
+            if name not in ('manifest.json', 'lock') and name not in used:
+                os.remove(os.path.join(self._dir, name))
+        with open(self._file+'.tmp', 'w') as fout:
+            json.dump({'files': self._files, 'outputs': self._outputs}, fout)
+        os.replace(self._file+'.tmp', self._file)
+
+
+def incremental_reduce(manifest, filenames, outputs, transform=None, fanin=4, workers=16):
+    """Sum the key of outputs ({key: output file}) over filenames into the output files.
+
+    An output summed before from a similar set of inputs is updated in
+    place: the inputs that are new or changed since are summed and added,
+    the old copies of the changed or removed ones are summed and
+    subtracted. Outputs sharing the same changes are done in one pass.
+    transform(key, h), e.g. the dataset grouping of reduce.py, is applied to
+    every sum before it is saved or combined. Every output is saved as {key: h}.
+    Without a manifest every output is summed in full and nothing is
+    recorded or copied, e.g. in a condor sandbox that is thrown away. With
+    one, the manifest is locked for the whole update, so that runs sharing
+    a folder, e.g. reduce.py and aggregate.py, do not interleave.
+    """
+    if manifest is None:
+        print('Summing',len(filenames),'inputs for',len(outputs),'outputs')
+        sums = treereduce(filenames, keys=list(outputs), fanin=fanin, workers=workers)
+        for key in sums:
+            save({key: transform(key, sums[key]) if transform else sums[key]}, outputs[key])
+        return
+    with manifest.lock():
+        hashes = {os.path.basename(f): manifest.hash(f) for f in filenames}
+        plans = defaultdict(list)
+        for key, output in outputs.items():
+            previous = manifest.inputs(output)
+            if previous is None:
+                plans[None].append(key)
+                continue
+            added = tuple(sorted(f for f in filenames if previous.get(os.path.basename(f)) != hashes[os.path.basename(f)]))
+            removed = tuple(sorted(digest for name, digest in previous.items() if hashes.get(name) != digest))
+            plans[(added, removed)].append(key)
+
+        for plan, keys in plans.items():
+            if plan is None:
+                print('Summing',len(filenames),'inputs for',len(keys),'outputs')
+                sums = treereduce(filenames, keys=keys, fanin=fanin, workers=workers)
+                for key in sums:
+                    save({key: transform(key, sums[key]) if transform else sums[key]}, outputs[key])
+            else:
+                added, removed = plan
+                if not added and not removed:
+                    print('Unchanged:',len(keys),'outputs')
+                else:
+                    print('Updating',len(keys),'outputs:',len(added),'inputs added,',len(removed),'removed')
+                    new = treereduce(added, keys=keys, fanin=fanin, workers=workers)
+                    stale = treereduce([manifest.contribution(digest) for digest in removed], keys=keys, fanin=fanin, workers=workers)
+                    for key in keys:
+                        out = load(outputs[key])[key]
+                        if key in new: out.add(transform(key, new[key]) if transform else new[key])
+                        if key in stale: out.add(negated(transform(key, stale[key]) if transform else stale[key]))
+                        save({key: out}, outputs[key])
+            for key in keys:
+                if os.path.exists(outputs[key]): manifest.record(outputs[key], filenames)
+        manifest.save()
@@ -0,0 +1,66 @@
+import os
+import time
+from coffea.util import load, save
+
+
+def chunk_key(chunk):
+    return (chunk.fileuuid, chunk.entrystart, chunk.entrystop)
+
+
+class Ledger(object):
+    """Chunks of one dataset, the ones already processed and the accumulator they add up to.
+
+    With a filename the ledger is checkpointed there every `every` seconds,
+    and picked up again when a job is restarted. Writes go to a temporary
+    file that is then renamed, so a job killed mid-write leaves the previous
+    checkpoint intact. A checkpoint is only resumed if it was written for
+    the same fingerprint, i.e. the same processor and input files.
+    """
+
+    def __init__(self, filename, accumulator, every=300, fingerprint=None):
+        self.filename = filename
+        self.every = every
+        self.fingerprint = fingerprint
+        self.chunks = None
+        self.done = set()
+        self.out = accumulator
+        if filename and os.path.exists(filename):
+            state = load(filename)
+            if state.get('fingerprint') != fingerprint:
+                print('Not resuming from',filename+': written for a different processor or input files')
+            else:
+                self.chunks, self.done, self.out = state['chunks'], state['done'], state['out']
+                print('Resuming from',filename+':',len(self.done),'of',len(self.chunks),'chunks done')
+        self._last = time.time()
+
+    def missing(self):
+        return [chunk for chunk in self.chunks if chunk_key(chunk) not in self.done]
+
+    def add(self, chunk, result):
+        self.out.add(result)
+        self.done.add(chunk_key(chunk))
+        if time.time()-self._last > self.every:
+            self.save()
+
+    def save(self):
+        if not self.filename or self.chunks is None: return
+        save({'chunks': self.chunks, 'done': self.done, 'out': self.out, 'fingerprint': self.fingerprint}, self.filename+'.tmp')
+        os.replace(self.filename+'.tmp', self.filename)
+        self._last = time.time()
+
+    def remove(self):
+        if self.filename and os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+def drop_stale(filename, futures):
+    """Remove a ledger older than the .futures of its dataset, left over from a job that was later completed.
+
+    Returns whether the ledger is still there.
+    """
+    if not os.path.exists(filename): return False
+    if os.path.exists(futures) and os.path.getmtime(filename) <= os.path.getmtime(futures):
+        print('Removing',filename+': older than',futures)
+        os.remove(filename)
+        return False
+    return True
@@ -0,0 +1,40 @@
+import numpy as np
+
+
+def _axes(lookup):
+    return [lookup._axes] if lookup._dimension == 1 else list(lookup._axes)
+
+
+def _resample(lookup, lower):
+    """Values of a dense_lookup at the lower edges of a finer binning"""
+    index = [np.clip(np.searchsorted(edges, points, side='right') - 1, 0, nbins - 1)
+             for edges, points, nbins in zip(_axes(lookup), lower, lookup._values.shape)]
+    return lookup._values[np.ix_(*index)]
+
+
+class FusedLookup(object):
+    """Several dense_lookups evaluated at the same coordinates in one pass.
+
+    The lookups are resampled onto the union of their bin edges, axis by
+    axis, and stacked into a single table, so evaluating all of them takes
+    one searchsorted per coordinate and one indexed read. Every edge of
+    every lookup is kept, and coordinates out of range are clipped to the
+    first and last bins, so the values are the ones dense_lookup gives.
+    Calling it returns a dict with the values of every lookup by name.
+    """
+
+    def __init__(self, lookups):
+        if len(set(lookup._dimension for lookup in lookups.values())) != 1:
+            raise ValueError("FusedLookup: cannot fuse lookups of different dimensions")
+        self._names = list(lookups)
+        self._edges = [np.unique(np.concatenate(edges)) for edges in zip(*[_axes(lookup) for lookup in lookups.values()])]
+        lower = [edges[:-1] for edges in self._edges]
+        self._table = np.stack([_resample(lookup, lower) for lookup in lookups.values()])
+
+    def __call__(self, *args):
+        index = tuple(np.clip(np.searchsorted(edges, np.asarray(arg), side='right') - 1, 0, len(edges) - 2)
+                      for edges, arg in zip(self._edges, args))
+        return dict(zip(self._names, self._table[(slice(None),)+index]))
+
+    def __repr__(self):
+        return "FusedLookup of %s on %s bins" % (', '.join(self._names), 'x'.join(str(len(edges)-1) for edges in self._edges))
@@ -0,0 +1,47 @@
+import numpy as np
+import awkward
+from numba import njit
+
+
+@njit
+def _match_kernel(a_offsets, a_eta, a_phi, b_offsets, b_eta, b_phi, val, out):
+    """For every event, sort the b candidates in eta and, for every a object,
+    only visit the b candidates inside the [eta-val, eta+val] strip"""
+    dr2 = val*val
+    for iev in range(len(a_offsets)-1):
+        b0, b1 = b_offsets[iev], b_offsets[iev+1]
+        if b0 == b1: continue
+        order = np.argsort(b_eta[b0:b1])
+        eta = b_eta[b0:b1][order]
+        phi = b_phi[b0:b1][order]
+        for i in range(a_offsets[iev], a_offsets[iev+1]):
+            k = np.searchsorted(eta, a_eta[i]-val)
+            while k < b1-b0:
+                deta = eta[k]-a_eta[i]
+                if deta > val: break
+                dphi = (phi[k]-a_phi[i]+np.pi) % (2*np.pi) - np.pi
+                if deta*deta+dphi*dphi < dr2:
+                    out[i] = True
+                    break
+                k += 1
+
+
+def _offsets(counts):
+    offsets = np.zeros(len(counts)+1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def match(a, b, val):
+    """True for every object in a with at least one object of b within delta R < val.
+
+    Same result as (a.cross(b, nested=True) delta_r < val).any(), without
+    building the pairs: only the flat eta/phi contents and the counts are read.
+    """
+    a_eta = np.asarray(a.eta.flatten(), dtype=np.float64)
+    a_phi = np.asarray(a.phi.flatten(), dtype=np.float64)
+    b_eta = np.asarray(b.eta.flatten(), dtype=np.float64)
+    b_phi = np.asarray(b.phi.flatten(), dtype=np.float64)
+    out = np.zeros(len(a_eta), dtype=np.bool_)
+    _match_kernel(_offsets(a.counts), a_eta, a_phi, _offsets(b.counts), b_eta, b_phi, float(val), out)
+    return awkward.JaggedArray.fromcounts(a.counts, out)
@@ -0,0 +1,62 @@
+import time
+import tracemalloc
+
+MODES = ['time', 'memory']
+
+
+class Profiler(object):
+    """Wall time or peak allocated memory of the successive stages of process().
+
+    profile.start(stage) closes the running stage and opens the next one,
+    profile.stop() closes the last one. Totals are added to a
+    defaultdict_accumulator(float) under (dataset, stage, mode), and the
+    number of events under (dataset, 'events'), so they sum over chunks.
+    Nothing is recorded unless a mode is given. In 'time' mode the stages
+    are only timed. In 'memory' mode allocations are traced with tracemalloc,
+    which numpy reports its buffers to, and the stages are not timed, since
+    tracing slows them down.
+    """
+
+    def __init__(self, output, dataset, nevents, mode=None):
+        mode = mode or None
+        if mode is not None and mode not in MODES:
+            raise ValueError("Profiler: mode must be one of %s, not %s" % (', '.join(MODES), mode))
+        self._output = output
+        self._dataset = dataset
+        self._mode = mode
+        self._stage = None
+        if mode == 'memory' and not tracemalloc.is_tracing(): tracemalloc.start()
+        if mode is not None:
+            output[(dataset, 'events')] += nevents
+
+    def start(self, stage):
+        if self._mode is None: return
+        self.stop()
+        self._stage = stage
+        if self._mode == 'memory':
+            tracemalloc.clear_traces()
+        else:
+            self._time = time.time()
+
+    def stop(self):
+        if self._mode is None or self._stage is None: return
+        if self._mode == 'memory':
+            self._output[(self._dataset, self._stage, 'memory')] += tracemalloc.get_traced_memory()[1]/1048576.
+        else:
+            self._output[(self._dataset, self._stage, 'time')] += time.time()-self._time
+        self._stage = None
+
+
+def table(profile):
+    """us/event or MB/event of every stage, dataset by dataset, as printable lines"""
+    mode = 'memory' if any(len(key) == 3 and key[2] == 'memory' for key in profile) else 'time'
+    unit, scale, precision = ('MB/event', 1., 4) if mode == 'memory' else ('us/event', 1e6, 2)
+    lines = ['%-50s %-12s %12s' % ('Dataset', 'Stage', unit) + '   (--profile=%s)' % mode]
+    for dataset in sorted(set(key[0] for key in profile)):
+        nevents = profile[(dataset, 'events')]
+        stages = []
+        for key in profile:
+            if key[0] == dataset and len(key) == 3 and key[1] not in stages: stages.append(key[1])
+        for stage in stages:
+            lines.append('%-50s %-12s %12.*f' % (dataset, stage, precision, scale*profile[(dataset, stage, mode)]/nevents))
+    return lines
@@ -0,0 +1,77 @@
+import concurrent.futures
+from helpers.futures import load_futures
+
+
+def fold(acc, hin, keys=None):
+    """Add every (selected) entry of hin into acc in place and return acc"""
+    for k in list(hin.keys()):
+        if keys is not None and k not in keys: continue
+        if k not in acc: acc[k] = hin[k]
+        else: acc[k].add(hin[k])
+    return acc
+
+
+def load_and_fold(filenames, keys=None):
+    """Leaf task: load the files one at a time and fold them into a running sum.
+
+    Only the running sum and the file being loaded are alive at any time,
+    and no histogram is shipped to the worker, just the file names.
+    """
+    acc = {}
+    for filename in filenames:
+        print('Opening:',filename)
+        hin = load_futures(filename, keys)
+        fold(acc, hin, keys)
+        del hin
+    return acc
+
+
+def fold_partials(partials):
+    """Inner task: fold at most fanin partial sums into one"""
+    acc = partials[0]
+    for partial in partials[1:]:
+        fold(acc, partial)
+    return acc
+
+
+def treereduce(filenames, keys=None, fanin=4, workers=16, loader=load_and_fold):
+    """Sum the content of filenames with a k-ary tree on a single worker pool.
+
+    Leaves load fanin files each and fold them as soon as they are read.
+    Partial sums are re-submitted in groups of fanin as soon as enough of
+    them are available, so reduction of a level overlaps with the loading
+    of the next files and no worker holds more than fanin histograms.
+    """
+    if keys is not None: keys = set(keys)
+    filenames = list(filenames)
+    if len(filenames) == 0: return {}
+    fanin = max(2, fanin)
+    leaves = [filenames[i:i+fanin] for i in range(0, len(filenames), fanin)]
+    if len(leaves) == 1 or workers <= 1:
+        return fold_partials([loader(leaf, keys) for leaf in leaves])
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = set(executor.submit(loader, leaf, keys) for leaf in leaves)
+        pending = len(futures)
+        ready = []
+        try:
+            while pending > 1:
+                finished, futures = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for job in finished:
+                    ready.append(job.result())
+                # Keep folding while enough partials are ready, or when
+                # the remaining ones are all that is left of the tree
+                while len(ready) >= fanin or (len(ready) > 1 and len(ready) == pending):
+                    group, ready = ready[:fanin], ready[fanin:]
+                    futures.add(executor.submit(fold_partials, group))
+                    pending -= len(group) - 1
+            if not ready:
+                ready = [job.result() for job in concurrent.futures.as_completed(futures)]
+        except KeyboardInterrupt:
+            print("Ok quitter")
+            for job in futures: job.cancel()
+            raise
+        except:
+            for job in futures: job.cancel()
+            raise
+    return ready[0]
@@ -0,0 +1,63 @@
+import numpy as np
+
+_compiled = {}
+
+
+def compile_regions(names, regions):
+    """uint64 masks of the cumulative cutflow and the N-1 selections of every region.
+
+    For a region with n cuts, rows [0, n) are the first 1..n cuts and rows
+    [n, 2n) all the cuts but the i-th. Compiled masks are kept per worker,
+    keyed by the selection names and the region cuts.
+    """
+    key = (tuple(names), tuple((region, tuple(cuts)) for region, cuts in regions.items()))
+    if key not in _compiled:
+        masks, slices = [], {}
+        for region, cuts in regions.items():
+            bits = [1 << names.index(cut) for cut in cuts]
+            full = 0
+            for bit in bits: full |= bit
+            cumulative = 0
+            slices[region] = (len(masks), len(cuts))
+            for bit in bits:
+                cumulative |= bit
+                masks.append(cumulative)
+            masks.extend(full & ~bit for bit in bits)
+        masks, inverse = np.unique(np.array(masks, dtype=np.uint64), return_inverse=True)
+        _compiled[key] = (masks, inverse, slices)
+    return _compiled[key]
+
+
+class RegionMasks(object):
+    """Selection, cutflow and N-1 masks of all the regions of a PackedSelection.
+
+    Every distinct mask of every region is tested once against the packed
+    cut bits, (bits & mask) == mask, into one row of a preallocated
+    (n_masks, n_events) bool array, reusing a single uint64 buffer.
+    """
+
+    def __init__(self, selection, regions):
+        masks, self._inverse, self._slices = compile_regions(selection.names, regions)
+        self._cuts = {region: list(cuts) for region, cuts in regions.items()}
+        bits = selection._mask
+        buffer = np.empty_like(bits)
+        self._passed = np.empty((len(masks), len(bits)), dtype=bool)
+        for i, mask in enumerate(masks):
+            np.bitwise_and(bits, mask, out=buffer)
+            np.equal(buffer, mask, out=self._passed[i])
+
+    def _column(self, row):
+        return self._passed[self._inverse[row]]
+
+    def all(self, region):
+        start, n = self._slices[region]
+        return self._column(start+n-1)
+
+    def cumulative(self, region):
+        """The i-th mask passes the first i+1 cuts of the region"""
+        start, n = self._slices[region]
+        return [self._column(start+i) for i in range(n)]
+
+    def nminusone(self, region, cut):
+        start, n = self._slices[region]
+        return self._column(start+n+self._cuts[region].index(cut))
@@ -0,0 +1,129 @@
+import json
+import numpy as np
+import awkward
+from coffea import hist
+from coffea.processor import column_accumulator
+from helpers.dense import DenseHist
+
+
+class Skim(object):
+    """Per-event quantities of the events kept by a processor, to re-fill histograms without NanoAOD.
+
+    Columns are registered with add(), variables() and weights() while process() runs and
+    the rows of the kept events are written to the skim accumulator by
+    fill(), together with the PackedSelection bitmask. The selection names,
+    the region cuts and the sum of weights go in as one row per chunk.
+    Weights are stored per region as the individual corrections and the
+    relative up/down modifiers of processor.Weights.
+    """
+
+    def __init__(self, output, enabled=False):
+        self._output = output
+        self._enabled = enabled
+        self._columns = {}
+
+    def add(self, name, array):
+        if self._enabled:
+            self._columns[name] = np.asarray(array)
+
+    def variables(self, region, variables):
+        """Histogrammed variables of a region, NaN where the leading object is missing"""
+        if not self._enabled: return
+        for name, variable in variables.items():
+            if isinstance(variable, awkward.JaggedArray):
+                variable = variable.pad(1, clip=True).fillna(np.nan).flatten()
+            self._columns['var_'+region+'_'+name] = np.asarray(variable, dtype=np.float32)
+
+    def weights(self, region, weights):
+        if not self._enabled: return
+        for name, weight in list(weights._weights.items())+list(weights._modifiers.items()):
+            self._columns['weight_'+region+'_'+name] = np.asarray(weight, dtype=np.float32)
+
+    def fill(self, keep, selection, regions, sumw):
+        if not self._enabled: return
+        keep = np.asarray(keep, dtype=np.bool_)
+        for name, array in self._columns.items():
+            self._output[name] = column_accumulator(array[keep])
+        self._output['selection'] = column_accumulator(selection._mask[keep])
+        self._output['names'] = column_accumulator(np.array([selection.names]))
+        self._output['regions'] = column_accumulator(np.array([json.dumps(regions)]))
+        self._output['sumw'] = column_accumulator(np.array([sumw], dtype=np.float64))
+
+
+def save_skim(skim, filename):
+    np.savez_compressed(filename, **{name: column.value for name, column in skim.items()})
+
+
+def load_skim(filename):
+    with np.load(filename) as fin:
+        skim = {name: fin[name] for name in fin.files}
+    if len(skim['names']) and (skim['names'] != skim['names'][0]).any():
+        raise ValueError("load_skim: %s mixes chunks with different selections" % filename)
+    return skim
+
+
+def _cut(skim, cuts):
+    names = list(skim['names'][0])
+    required = np.uint64(sum(1 << names.index(name) for name in cuts))
+    return (skim['selection'] & required) == required
+
+
+def _weight(skim, region, modifier=None):
+    prefix = 'weight_'+region+'_'
+    components = [k for k in skim if k.startswith(prefix) and not k.endswith('Up') and not k.endswith('Down')]
+    if not components:
+        return np.ones(len(skim['selection']))
+    weight = np.prod([skim[k].astype(np.float64) for k in components], axis=0)
+    if modifier is None:
+        return weight
+    if modifier.endswith('Down') and prefix+modifier not in skim:
+        return weight/skim[prefix+modifier[:-len('Down')]+'Up']
+    return weight*skim[prefix+modifier]
+
+
+def _has_modifier(skim, region, modifier):
+    prefix = 'weight_'+region+'_'
+    return prefix+modifier in skim or (modifier.endswith('Down') and prefix+modifier[:-len('Down')]+'Up' in skim)
+
+
+def refill(skim, hout, dataset, regions=None):
+    """Fill the template and the variable histograms of hout from a skim.
+
+    The cutflow and sumw need all the events, sumw is rebuilt from the stored
+    sums, the cutflow is left empty. regions maps a region to its cuts and defaults to the ones the skim was
+    made with. V+jets skims are split into HF-- and LF-- datasets as in the
+    processors.
+    """
+    if regions is None:
+        regions = json.loads(skim['regions'][0])
+    isData = not any(k.startswith('weight_') for k in skim)
+    gentype = skim['gentype'] if 'gentype' in skim else np.zeros(len(skim['selection']), dtype=np.int64)
+    if 'hf' in skim:
+        splits = [('HF--'+dataset, skim['hf'].astype(np.bool_)), ('LF--'+dataset, ~skim['hf'].astype(np.bool_))]
+    else:
+        splits = [(dataset, np.ones(len(skim['selection']), dtype=np.bool_))]
+    for name, _ in splits:
+        hout['sumw'].fill(dataset=name, sumw=1, weight=skim['sumw'].sum())
+
+    for region, cuts in regions.items():
+        prefix = 'var_'+region+'_'
+        columns = {k[len(prefix):]: v for k, v in skim.items() if k.startswith(prefix)}
+        if not columns: continue
+        columns['gentype'] = gentype
+        cut = _cut(skim, cuts)
+        wnom = np.ones(len(cut)) if isData else _weight(skim, region)
+        for name, split in splits:
+            sel = cut & split
+            for histname, h in hout.items():
+                if isinstance(h, DenseHist):
+                    index = h.index(**{ax.name: columns[ax.name][sel] for ax in h.dense_axes()})
+                    systematics = [s.name for s in h.identifiers('systematic')]
+                    systematics = [s for s in systematics if s == 'nominal' or (not isData and _has_modifier(skim, region, s))]
+                    wsys = np.stack([(wnom if s == 'nominal' else _weight(skim, region, s))[sel] for s in systematics])
+                    h.fill_systematics('systematic', systematics, wsys, index=index, dataset=name, region=region)
+                elif isinstance(h, hist.Hist) and histname in columns and histname != 'gentype':
+                    axes = [ax.name for ax in h.axes() if ax.name not in ('dataset', 'region')]
+                    if not all(ax in columns for ax in axes): continue
+                    weight = ~np.isnan(columns[histname][sel])*wnom[sel]
+                    h.fill(dataset=name, region=region, weight=weight, **{ax: columns[ax][sel] for ax in axes})
+    return hout
@@ -2,9 +2,15 @@ import cloudpickle
 import pickle
 import gzip
 import os
+import re
+import fnmatch
+import concurrent.futures
+import numpy as np
 from collections import defaultdict, OrderedDict
 from coffea import hist, processor 
 from coffea.util import load, save
+from helpers.dense import DenseHist
+from helpers.futures import futures_keys, load_futures, FuturesWriter
 
 xsec = {
     ### 2018 signal, mhs = 50 GeV
@@ -65,68 +71,30 @@ xsec = {
     "Mz3000_mhs90_Mdm1500": 0.00001292,
 }
 
-def scale_file(file):
+data = ['MET', 'SingleElectron', 'SinglePhoton', 'EGamma', 'BTagMu']
 
-    print('Loading file:',file)    
-    hists=load(file)
+def is_data(dataset):
+    return any(d in dataset for d in data)
 
-    pd = []
-    for d in hists['sumw'].identifiers('dataset'):
-        dataset = d.name
-        if dataset.split("____")[0] not in pd: pd.append(dataset.split("____")[0])
-    print('List of primary datasets:',pd)
+def primary_datasets(h):
 
     ##
     # Aggregate all the histograms that belong to a single dataset
     ##
 
     dataset = hist.Cat("dataset", "dataset", sorting='placement')
-    dataset_cats = ("dataset",)
     dataset_map = OrderedDict()
-    for pdi in pd:
-        dataset_map[pdi] = (pdi+"*",)
-    for key in hists.keys():
-        hists[key] = hists[key].group(dataset_cats, dataset, dataset_map)
-    print('Datasets aggregated')
-
-    return scale(hists)
-
-def scale_directory(directory):
-
-    hists = {}
-    for filename in os.listdir(directory):
-        if '.merged' not in filename: continue
-        print('Opening:', filename)
-        hin = load(directory+'/'+filename)
-        hists.update(hin)
-
-    return scale(hists)
-
-def scale(hists):
-
-    ###
-    # Rescaling MC histograms using the xsec weight
-    ###
-
-    scale={}
-    for d in hists['sumw'].identifiers('dataset'):
-        scale[d]=hists['sumw'].integrate('dataset', d).values(overflow='all')[()][1]
-    print('Sumw extracted')
-
-    for key in hists.keys():
-        if key=='sumw': continue
-        for d in hists[key].identifiers('dataset'):
-            if 'MET' in d.name or 'SingleElectron' in d.name or 'SinglePhoton' in d.name or 'EGamma' in d.name or 'BTagMu' in d.name: continue
-            hists[key].scale({d:1/scale[d]},axis='dataset')
-    print('Histograms scaled')
+    for d in h.identifiers('dataset'):
+        pdi = d.name.split("____")[0]
+        if pdi not in dataset_map: dataset_map[pdi] = (pdi+"*",)
+    return h.group(("dataset",), dataset, dataset_map)
 
+def processes(datasets):
 
     ###
     # Defining 'process', to aggregate different samples into a single process
     ##
 
-    process = hist.Cat("process", "Process", sorting='placement')
-    cats = ("dataset",)
     sig_map = OrderedDict()
     bkg_map = OrderedDict()
     data_map = OrderedDict()
@@ -159,47 +127,169 @@ def scale(hists):
     data_map["SinglePhoton"] = ("SinglePhoton*", )
     data_map["EGamma"] = ("EGamma*", )
     data_map["BTagMu"] = ("BTagMu*", )
-    for signal in hists['sumw'].identifiers('dataset'):
-        if 'mhs' not in str(signal): continue
+    for signal in datasets:
+        if 'mhs' not in signal: continue
         print(signal)
-        sig_map[str(signal)] = (str(signal),)  ## signals
+        sig_map[signal] = (signal,)  ## signals
     print('Processes defined')
-    
+
+    return {'bkg': bkg_map, 'sig': sig_map, 'data': data_map}
+
+def factors(sumw, maps):
+
     ###
-    # Storing signal and background histograms
+    # One factor per process and dataset: 1/sumw for MC, times the xsec for
+    # signals, 1 for data. The sumw histogram itself only gets the xsec.
     ###
-    bkg_hists={}
-    sig_hists={}
-    data_hists={}
-    for key in hists.keys():
-        bkg_hists[key] = hists[key].group(cats, process, bkg_map)
-        data_hists[key] = hists[key].group(cats, process, data_map)
-        sig_hists[key] = hists[key].group(cats, process, sig_map)
-        for signal in sig_hists[key].identifiers('process'):
-            print('Scaling '+str(signal)+' by xsec '+str(xsec[str(signal)]))
-            sig_hists[key].scale({signal:xsec[str(signal)]},axis='process')
-        
-    print('Histograms grouped')
-
-    return bkg_hists, sig_hists, data_hists
+
+    norm = {}
+    for d in sumw.identifiers('dataset'):
+        norm[d.name] = 1. if is_data(d.name) else 1./sumw.integrate('dataset', d).values(overflow='all')[()][1]
+    print('Sumw extracted')
+
+    out = {'sumw': {}, 'hists': {}}
+    for category, mapping in maps.items():
+        out['sumw'][category], out['hists'][category] = {}, {}
+        for p in mapping:
+            f = 1.
+            if category == 'sig':
+                print('Scaling '+p+' by xsec '+str(xsec[p]))
+                f = xsec[p]
+            out['sumw'][category][p] = {d: f for d in norm}
+            out['hists'][category][p] = {d: f*norm[d] for d in norm}
+    return out
+
+def members(datasets, patterns, glob):
+    """Datasets selected by a group() mapping value, as hist.Hist.group (glob=False) or DenseHist.group (glob=True) does"""
+    if glob:
+        if isinstance(patterns, str): patterns = (patterns,)
+        return [d for d in datasets if any(fnmatch.fnmatchcase(d, str(p)) for p in patterns)]
+    if isinstance(patterns, tuple): patterns = patterns[0]
+    if isinstance(patterns, hist.StringBin):
+        return [d for d in datasets if d == patterns.name]
+    if isinstance(patterns, list):
+        return [d for d in datasets if d in patterns]
+    pattern = re.compile("^" + re.escape(patterns).replace(r'\*', '.*') + "$")
+    return [d for d in datasets if pattern.match(d)]
+
+def scale_and_group(h, mapping, factor, sumw2):
+    """h grouped into processes with every dataset scaled on the way, in one pass.
+
+    Same result as scaling h with factor[process][dataset] and grouping it
+    with mapping, without copying or rescaling h. sumw2 tells whether the
+    sum of squares is to be filled, from sumw if h has none.
+    """
+    process = hist.Cat("process", "Process", sorting='placement')
+    if isinstance(h, DenseHist):
+        out = DenseHist(h._label, h._categories, h._bins, (process.name, process.label))
+        datasets = [d.name for d in h.identifiers('dataset')]
+        for p, patterns in mapping.items():
+            selected = set(members(datasets, patterns, glob=True))
+            for key in h._sumw:
+                if key[0] not in selected: continue
+                f = factor[p][key[0]]
+                sumw, w2 = out._slab(p, key[1:])
+                sumw += f*h._sumw[key]
+                w2 += f*f*h._sumw2[key]
+        return out.to_hist()
+
+    idataset = [ax.name for ax in h.sparse_axes()].index('dataset')
+    out = hist.Hist(h.label, process, *[ax for ax in h.axes() if ax.name != 'dataset'], dtype=h._dtype)
+    if sumw2: out._init_sumw2()
+    datasets = [d.name for d in h.identifiers('dataset')]
+    for p, patterns in mapping.items():
+        selected = set(members(datasets, patterns, glob=False))
+        pidx = process.index(p)
+        for key in h._sumw:
+            if key[idataset].name not in selected: continue
+            f = factor[p][key[idataset].name]
+            new = (pidx,) + key[:idataset] + key[idataset+1:]
+            w2 = h._sumw2[key] if h._sumw2 is not None else h._sumw[key]
+            if new not in out._sumw:
+                out._sumw[new] = f*h._sumw[key]
+                if sumw2: out._sumw2[new] = f*f*w2
+            else:
+                out._sumw[new] += f*h._sumw[key]
+                if sumw2: out._sumw2[new] += f*f*w2
+    return out
+
+def load_key(filename, key):
+    return load_futures(filename, [key])[key]
+
+def scale_key(source, key, maps, factor, aggregate, loader=load_key):
+    """Worker task: load a single histogram, with loader(source, key), and return its bkg, sig and data versions"""
+    print('Considering variable',key)
+    h = loader(source, key)
+    if aggregate: h = primary_datasets(h)
+    factor = factor['sumw'] if key == 'sumw' else factor['hists']
+    # hist.Hist.scale fills the sum of squares if missing, and the MC and
+    # signal scaling of the unfused version always did
+    mc = key != 'sumw' and any(not is_data(d.name) for d in h.identifiers('dataset'))
+    out = {}
+    for category, mapping in maps.items():
+        sumw2 = h._sumw2 is not None or mc or (category == 'sig' and len(mapping) > 0)
+        out[category] = scale_and_group(h, mapping, factor[category], sumw2)
+    return key, out
+
+def scale(inputs, sumw, output, aggregate=False, workers=8, loader=load_key):
+    """Scale and group every (source, key) of inputs, writing the results to output as they come.
+
+    factors and processes are derived once from the sumw histogram, then
+    every key is loaded, scaled and grouped by its own task, and each
+    result is written out, as bkg/<key>, sig/<key> and data/<key>, and
+    dropped as soon as it is ready.
+    """
+    if aggregate: sumw = primary_datasets(sumw)
+    maps = processes([d.name for d in sumw.identifiers('dataset')])
+    factor = factors(sumw, maps)
+
+    with FuturesWriter(output) as fout:
+        def write(key, out):
+            for category in ['bkg', 'sig', 'data']:
+                fout.add(category+'/'+key, out[category])
+            print('Histograms grouped:',key)
+        if workers <= 1:
+            for source, key in inputs:
+                write(*scale_key(source, key, maps, factor, aggregate, loader))
+            return
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = set(executor.submit(scale_key, source, key, maps, factor, aggregate, loader) for source, key in inputs)
+            try:
+                for job in concurrent.futures.as_completed(futures):
+                    write(*job.result())
+            except KeyboardInterrupt:
+                print("Ok quitter")
+                for job in futures: job.cancel()
+                raise
+            except:
+                for job in futures: job.cancel()
+                raise
+
+def scale_file(file, output, workers=8):
+
+    print('Loading file:',file)
+    inputs = [(file, key) for key in futures_keys(file)]
+    scale(inputs, load_futures(file, ['sumw'])['sumw'], output, aggregate=True, workers=workers)
+
+def scale_directory(directory, output, workers=8):
+
+    inputs = []
+    for filename in os.listdir(directory):
+        if '.merged' not in filename: continue
+        print('Opening:', filename)
+        inputs += [(directory+'/'+filename, key) for key in futures_keys(directory+'/'+filename)]
+    sumw = [filename for filename, key in inputs if key == 'sumw'][0]
+    scale(inputs, load_futures(sumw, ['sumw'])['sumw'], output, workers=workers)
 
 if __name__ == '__main__':
     from optparse import OptionParser
     parser = OptionParser()
     parser.add_option('-f', '--file', help='file', dest='file')
     parser.add_option('-d', '--directory', help='directory', dest='directory')
+    parser.add_option('-w', '--workers', help='number of parallel scaling tasks', dest='workers', type=int, default=8)
     (options, args) = parser.parse_args()
 
     if options.directory: 
-        bkg_hists, sig_hists, data_hists = scale_directory(options.directory)
-        name = options.directory
+        scale_directory(options.directory, options.directory+'.scaled', options.workers)
     if options.file: 
-        bkg_hists, sig_hists, data_hists = scale_file(options.file)
-        name = options.file.split(".")[0]
-
-    hists={
-        'bkg': bkg_hists,
-        'sig': sig_hists,
-        'data': data_hists
-    }
-    save(hists,name+'.scaled')
+        scale_file(options.file, options.file.split(".")[0]+'.scaled', options.workers)
@@ -1,4 +1,3 @@
-import concurrent.futures
 import cloudpickle
 import pickle
 import gzip
@@ -8,70 +7,25 @@ from collections import defaultdict, OrderedDict
 from coffea import hist, processor 
 from coffea.util import load, save
 from helpers.futures_patch import patch_mp_connection_bpo_17560
+from helpers.incremental import Manifest, incremental_reduce
 
-def add(chunk_tmp_arr):
-     print('Job started')
-     return np.sum(chunk_tmp_arr)
-
-def futuresum(tmp_arr):
-     while np.size(tmp_arr)>1:
-          chunk_sum=[]
-          chunk_tmp_arr = np.array_split(tmp_arr, int(np.size(tmp_arr)/2))
-          if len(chunk_tmp_arr)>1:
-               with concurrent.futures.ProcessPoolExecutor(max_workers=16) as executor:
-                    futures = set()
-                    futures.update(executor.submit(add,chunk_tmp_arr[i]) for i in range(0,len(chunk_tmp_arr)))
-                    if(len(futures)==0): continue
-                    try:
-                         total = len(futures)
-                         processed = 0
-                         while len(futures) > 0:
-                              finished = set(job for job in futures if job.done())
-                              for job in finished:
-                                   chunk_i = job.result()
-                                   chunk_sum.append(chunk_i)
-                              futures -= finished
-                         del finished
-                    except KeyboardInterrupt:
-                         print("Ok quitter")
-                         for job in futures: job.cancel()
-                    except:
-                         for job in futures: job.cancel()
-                         raise
-          else:
-               chunk_sum.append(add(chunk_tmp_arr[0]))
-          tmp_arr=np.array(chunk_sum)
-          print(tmp_arr)
-     return tmp_arr
-
-def merge(folder,variable=None, exclude=None):
+def merge(folder,variable=None, exclude=None, fanin=4, workers=16, use_manifest=True):
 
      lists = {}
      for filename in os.listdir(folder):
           if '.reduced' not in filename: continue
+          if os.path.getsize(folder+'/'+filename) == 0: continue
           if filename.split('--')[0] not in lists: lists[filename.split('--')[0]] = []
           lists[filename.split('--')[0]].append(folder+'/'+filename)
 
+     manifest = Manifest(folder) if use_manifest else None
      for var in lists.keys():
-          tmp={}
           if variable is not None:
                if not any(v==var for v in variable.split(',')): continue
           if exclude is not None:
                if any(v==var for v in exclude.split(',')): continue
           print(lists[var])
-          for filename in lists[var]:
-               print('Opening:',filename)
-               hin = load(filename)
-               if var not in tmp: tmp[var]=[hin[var]]
-               else: tmp[var].append(hin[var])
-               del hin
-          print(tmp)
-          for k in tmp:
-               tmp_arr=futuresum(np.array(tmp[k]))
-               hists = {}
-               hists[k]=tmp_arr[0]
-               print(hists)
-               save(hists, folder+'/'+k+'.merged')
+          incremental_reduce(manifest, lists[var], {var: folder+'/'+var+'.merged'}, fanin=fanin, workers=workers)
 
 
 def postprocess(folder):
@@ -101,10 +55,13 @@ if __name__ == '__main__':
     parser.add_option('-v', '--variable', help='variable', dest='variable', default=None)
     parser.add_option('-e', '--exclude', help='exclude', dest='exclude', default=None)
     parser.add_option('-p', '--postprocess', action='store_true', dest='postprocess')
+    parser.add_option('-k', '--fanin', help='number of inputs summed by each reduction task', dest='fanin', type=int, default=4)
+    parser.add_option('-w', '--workers', help='number of workers in the reduction pool', dest='workers', type=int, default=16)
+    parser.add_option('-n', '--no-manifest', action='store_true', dest='no_manifest', help='Sum everything again and keep no manifest, for jobs whose folder is thrown away')
     (options, args) = parser.parse_args()
 
     patch_mp_connection_bpo_17560()    
     if options.postprocess:
          postprocess(options.folder)
     else:
-         merge(options.folder,options.variable,options.exclude)
+         merge(options.folder,options.variable,options.exclude,options.fanin,options.workers,not options.no_manifest)
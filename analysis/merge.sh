@@ -44,8 +44,16 @@ export PYTHONPATH=$(find ${_CONDOR_SCRATCH_DIR}/site-packages/ -name *.egg |tr '
 export PYTHONWARNINGS="ignore"
 echo "Updated python path: " $PYTHONPATH
 cd analysis
+if ls ${_CONDOR_SCRATCH_DIR}/*.reduced >/dev/null 2>&1; then
+    mkdir -p ${1}
+    mv ${_CONDOR_SCRATCH_DIR}/*.reduced ${1}/
+fi
 ls
-echo "python merge.py --folder ${1} --variable ${2}"
-python merge.py --folder ${1} --variable ${2}
-ls ${1}/${2}.merged
-cp ${1}/${2}.merged ${_CONDOR_SCRATCH_DIR}/${2}.merged
+echo "python merge.py --folder ${1} --variable ${2} --no-manifest"
+python merge.py --folder ${1} --variable ${2} --no-manifest
+if [ -f ${1}/${2}.merged ]; then
+    ls ${1}/${2}.merged
+    cp ${1}/${2}.merged ${_CONDOR_SCRATCH_DIR}/${2}.merged
+else
+    echo "No ${2} histograms to merge"
+fi
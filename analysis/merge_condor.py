@@ -30,6 +30,8 @@ if options.tar:
               '--exclude=\'analysis/results\' '
               '--exclude=\'analysis/hists/*/*.futures\' '
               '--exclude=\'analysis/hists/*/*.merged\' '
+              '--exclude=\'analysis/hists/*/*.aggregated\' '
+              '--exclude=\'analysis/hists/*/.manifest\' '
               '../../decaf')
     os.system('tar --exclude-caches-all --exclude-vcs -czvf ../../pylocal.tgz -C ~/.local/lib/python3.6/ site-packages')
 
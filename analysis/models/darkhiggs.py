@@ -11,6 +11,7 @@ import gzip
 import json
 from coffea import hist, processor
 from coffea.util import load, save
+from helpers.futures import load_scaled
 from scipy import stats
 import ROOT
 
@@ -1054,7 +1055,7 @@ if __name__ == "__main__":
     # Extract histograms from input file and remap
     ###
 
-    hists = load("hists/darkhiggs" + year + ".scaled")
+    hists = load_scaled("hists/darkhiggs" + year + ".scaled")
     hists = remap_histograms(hists)
 
     ###
@@ -1294,7 +1295,7 @@ if __name__ == "__main__":
     # Reload and remap histograms 
     ###
 
-    hists = load("hists/darkhiggs" + year + ".scaled")
+    hists = load_scaled("hists/darkhiggs" + year + ".scaled")
     hists = remap_histograms(hists)
 
     ###
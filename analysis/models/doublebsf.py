@@ -12,6 +12,7 @@ import gzip
 import json
 from coffea import hist, processor
 from coffea.util import load, save
+from helpers.futures import load_scaled
 import ROOT
 
 rl.util.install_roofit_helpers()
@@ -222,9 +223,7 @@ if __name__ == "__main__":
         ###
 
         print("Extracting histograms for", year, category)
-        hists = load("hists/doublebsf" + year + ".scaled")
-        data_hists = hists["data"]
-        bkg_hists = hists["bkg"]
+        hists = load_scaled("hists/doublebsf" + year + ".scaled")
 
         #### Setting up fractional systematics (assume 50%)
         frac_b = rl.NuisanceParameter("frac_b" + year + category, "lnN")
@@ -236,8 +235,8 @@ if __name__ == "__main__":
         ###
         # Rebin templates for fit 
         ##
-        data_hists["svtemplate"] = data_hists["svtemplate"].rebin("svmass", hist.Bin("svmass", "svmass", binning[year]))
-        bkg_hists["svtemplate"] = bkg_hists["svtemplate"].rebin("svmass", hist.Bin("svmass", "svmass", binning[year]))
+        data_hists = {"svtemplate": hists["data"]["svtemplate"].rebin("svmass", hist.Bin("svmass", "svmass", binning[year]))}
+        bkg_hists = {"svtemplate": hists["bkg"]["svtemplate"].rebin("svmass", hist.Bin("svmass", "svmass", binning[year]))}
 
         ###
         # Preparing histograms for fit
@@ -10,6 +10,13 @@ np.seterr(divide='ignore', invalid='ignore', over='ignore')
 from coffea.arrays import Initialize
 from coffea import hist, processor
 from coffea.util import load, save
+from helpers.dense import DenseHist
+from helpers.cache import ChunkCache, LazyDict
+from helpers.selection import RegionMasks
+from helpers.ids import LOOSE, TIGHT, GOOD, HEM
+from helpers.profile import Profiler
+from helpers.skim import Skim
+from helpers.corrections import LazyCorrections
 from optparse import OptionParser
 from uproot_methods import TVector2Array, TLorentzVectorArray
 
@@ -53,6 +60,10 @@ class AnalysisProcessor(processor.ProcessorABC):
             
     def __init__(self, year, xsec, corrections, ids, common):
 
+        self._columns = set() # frozen by python run.py --columns, see helpers/columns.py
+        self._profile = None # set by python run.py --profile=time|memory, see helpers/profile.py
+        self._skim = False # set by python run.py --skim, see helpers/skim.py
+
         self._year = year
         self._lumi = 1000.*float(AnalysisProcessor.lumis[year])
         self._xsec = xsec
@@ -105,11 +116,43 @@ class AnalysisProcessor(processor.ProcessorABC):
             ]
         }
 
+        self._systematics = [None,
+                             'btagUp',
+                             'btagDown',
+                             'qcd1Up',
+                             'qcd1Down',
+                             'qcd2Up',
+                             'qcd2Down',
+                             'qcd3Up',
+                             'qcd3Down',
+                             'muFUp',
+                             'muFDown',
+                             'muRUp',
+                             'muRDown',
+                             'ew1Up',
+                             'ew1Down',
+                             'ew2GUp',
+                             'ew2GDown',
+                             'ew2WUp',
+                             'ew2WDown',
+                             'ew2ZUp',
+                             'ew2ZDown',
+                             'ew3GUp',
+                             'ew3GDown',
+                             'ew3WUp',
+                             'ew3WDown',
+                             'ew3ZUp',
+                             'ew3ZDown',
+                             'mixUp',
+                             'mixDown']
+
         self._corrections = corrections
         self._ids = ids
         self._common = common
 
         self._accumulator = processor.dict_accumulator({
+            'profile': processor.defaultdict_accumulator(float),
+            'skim': processor.dict_accumulator({}),
             'sumw': hist.Hist(
                 'sumw', 
                 hist.Cat('dataset', 'Dataset'), 
@@ -123,14 +166,13 @@ class AnalysisProcessor(processor.ProcessorABC):
                 hist.Bin('cut', 'Cut index', [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]),
                 hist.Bin('ZHbbvsQCD','ZHbbvsQCD', [0, self._ZHbbvsQCDwp[self._year], 1])
             ),
-            'template': hist.Hist(
+            'template': DenseHist(
                 'Events',
-                hist.Cat('dataset', 'Dataset'),
-                hist.Cat('region', 'Region'),
-                hist.Cat('systematic', 'Systematic'),
-                hist.Bin('recoil','Hadronic Recoil',[250,310,370,470,590,840,1020,1250,3000]),
-                hist.Bin('fjmass','AK15 Jet Mass', [40,50,60,70,80,90,100,110,120,130,150,160,180,200,220,240,300]),#[0, 30, 60, 80, 120, 300]),
-                hist.Bin('ZHbbvsQCD','ZHbbvsQCD', [0, self._ZHbbvsQCDwp[self._year], 1])
+                [('region', 'Region', self._samples.keys()),
+                 ('systematic', 'Systematic', ['nominal' if s is None else s for s in self._systematics])],
+                [hist.Bin('recoil','Hadronic Recoil',[250,310,370,470,590,840,1020,1250,3000]),
+                 hist.Bin('fjmass','AK15 Jet Mass', [40,50,60,70,80,90,100,110,120,130,150,160,180,200,220,240,300]),#[0, 30, 60, 80, 120, 300]),
+                 hist.Bin('ZHbbvsQCD','ZHbbvsQCD', [0, self._ZHbbvsQCDwp[self._year], 1])]
             ),
             'ZHbbvsQCD': hist.Hist(
                 'Events', 
@@ -301,7 +343,10 @@ class AnalysisProcessor(processor.ProcessorABC):
         isData = 'genWeight' not in events.columns
         selection = processor.PackedSelection()
         hout = self.accumulator.identity()
+        profile = Profiler(hout['profile'], dataset, events.size, mode=self._profile)
+        skim = Skim(hout['skim'], enabled=self._skim)
 
+        profile.start('corrections')
         ###
         #Getting corrections, ids from .coffea files
         ###
@@ -323,24 +368,23 @@ class AnalysisProcessor(processor.ProcessorABC):
         get_ele_reco_lowet_sf   = self._corrections['get_ele_reco_lowet_sf']
         get_mu_tight_iso_sf     = self._corrections['get_mu_tight_iso_sf'][self._year]
         get_mu_loose_iso_sf     = self._corrections['get_mu_loose_iso_sf'][self._year]
+        get_ele_sf              = self._corrections['get_ele_sf'][self._year]
+        get_mu_sf               = self._corrections['get_mu_sf'][self._year]
         get_ecal_bad_calib      = self._corrections['get_ecal_bad_calib']
         get_deepflav_weight     = self._corrections['get_btag_weight']['deepflav'][self._year]
         
-        isLooseElectron = self._ids['isLooseElectron'] 
-        isTightElectron = self._ids['isTightElectron'] 
-        isLooseMuon     = self._ids['isLooseMuon']     
-        isTightMuon     = self._ids['isTightMuon']     
-        isLooseTau      = self._ids['isLooseTau']      
-        isLoosePhoton   = self._ids['isLoosePhoton']   
-        isTightPhoton   = self._ids['isTightPhoton']   
-        isGoodJet       = self._ids['isGoodJet']       
-        isGoodFatJet    = self._ids['isGoodFatJet']    
-        isHEMJet        = self._ids['isHEMJet']        
+        electronId      = self._ids['electronId'][self._year]
+        muonId          = self._ids['muonId'][self._year]
+        tauId           = self._ids['tauId'][self._year]
+        photonId        = self._ids['photonId'][self._year]
+        jetId           = self._ids['jetId']
+        fatJetId        = self._ids['fatJetId']
         
         match = self._common['match']
         deepflavWPs = self._common['btagWPs']['deepflav'][self._year]
         deepcsvWPs = self._common['btagWPs']['deepcsv'][self._year]
 
+        profile.start('objects')
         ###
         #Initialize global quantities (MET ecc.)
         ###
@@ -356,8 +400,9 @@ class AnalysisProcessor(processor.ProcessorABC):
         ###
 
         mu = events.Muon
-        mu['isloose'] = isLooseMuon(mu.pt,mu.eta,mu.pfRelIso04_all,mu.looseId,self._year)
-        mu['istight'] = isTightMuon(mu.pt,mu.eta,mu.pfRelIso04_all,mu.tightId,self._year)
+        mu['idmask'] = muonId(mu.pt,mu.eta,mu.pfRelIso04_all,mu.looseId,mu.tightId)
+        mu['isloose'] = (mu.idmask&LOOSE)==LOOSE
+        mu['istight'] = (mu.idmask&TIGHT)==TIGHT
         mu['T'] = TVector2Array.from_polar(mu.pt, mu.phi)
         mu_loose=mu[mu.isloose.astype(np.bool)]
         mu_tight=mu[mu.istight.astype(np.bool)]
@@ -369,8 +414,9 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         e = events.Electron
         e['isclean'] = ~match(e,mu_loose,0.3) 
-        e['isloose'] = isLooseElectron(e.pt,e.eta+e.deltaEtaSC,e.dxy,e.dz,e.cutBased,self._year)
-        e['istight'] = isTightElectron(e.pt,e.eta+e.deltaEtaSC,e.dxy,e.dz,e.cutBased,self._year)
+        e['idmask'] = electronId(e.pt,e.eta+e.deltaEtaSC,e.dxy,e.dz,e.cutBased)
+        e['isloose'] = (e.idmask&LOOSE)==LOOSE
+        e['istight'] = (e.idmask&TIGHT)==TIGHT
         e['T'] = TVector2Array.from_polar(e.pt, e.phi)
         e_clean = e[e.isclean.astype(np.bool)]
         e_loose = e_clean[e_clean.isloose.astype(np.bool)]
@@ -384,7 +430,7 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         tau = events.Tau
         tau['isclean']=~match(tau,mu_loose,0.4)&~match(tau,e_loose,0.4)
-        tau['isloose']=isLooseTau(tau.pt,tau.eta,tau.idDecayMode,tau.idMVAoldDM2017v2,self._year)
+        tau['isloose']=(tauId(tau.pt,tau.eta,tau.idDecayMode,tau.idMVAoldDM2017v2)&LOOSE)==LOOSE
         tau_clean=tau[tau.isclean.astype(np.bool)]
         tau_loose=tau_clean[tau_clean.isloose.astype(np.bool)]
         tau_ntot=tau.counts
@@ -395,8 +441,9 @@ class AnalysisProcessor(processor.ProcessorABC):
         _id = 'cutBasedBitmap'
         if self._year=='2016': 
             _id = 'cutBased'
-        pho['isloose']=isLoosePhoton(pho.pt,pho.eta,pho[_id],self._year)&(pho.electronVeto) #added electron veto flag
-        pho['istight']=isTightPhoton(pho.pt,pho[_id],self._year)&(pho.isScEtaEB)&(pho.electronVeto) #tight photons are barrel only
+        pho['idmask']=photonId(pho.pt,pho.eta,pho[_id],pho.electronVeto,pho.isScEtaEB) #electron veto on both, tight photons are barrel only
+        pho['isloose']=(pho.idmask&LOOSE)==LOOSE
+        pho['istight']=(pho.idmask&TIGHT)==TIGHT
         pho['T'] = TVector2Array.from_polar(pho.pt, pho.phi)
         pho_clean=pho[pho.isclean.astype(np.bool)]
         pho_loose=pho_clean[pho_clean.isloose.astype(np.bool)]
@@ -411,7 +458,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         fj = events.AK15Puppi
         fj['sd'] = fj.subjets.sum()
         fj['isclean'] =~match(fj.sd,pho_loose,1.5)&~match(fj.sd,mu_loose,1.5)&~match(fj.sd,e_loose,1.5)
-        fj['isgood'] = isGoodFatJet(fj.sd.pt, fj.sd.eta, fj.jetId)
+        fj['isgood'] = (fatJetId(fj.sd.pt, fj.sd.eta, fj.jetId)&GOOD)==GOOD
         fj['T'] = TVector2Array.from_polar(fj.pt, fj.phi)
         fj['msd_raw'] = (fj.subjets * (1 - fj.subjets.rawFactor)).sum().mass
         fj['msd_corr'] = fj.msd_raw * awkward.JaggedArray.fromoffsets(fj.array.offsets, np.maximum(1e-5, get_msd_weight(fj.sd.pt.flatten(),fj.sd.eta.flatten())))
@@ -426,8 +473,9 @@ class AnalysisProcessor(processor.ProcessorABC):
         fj_nclean = fj_clean.counts
 
         j = events.Jet
-        j['isgood'] = isGoodJet(j.pt, j.eta, j.jetId, j.puId, j.neHEF, j.chHEF)
-        j['isHEM'] = isHEMJet(j.pt, j.eta, j.phi)
+        j['idmask'] = jetId(j.pt, j.eta, j.phi, j.jetId, j.puId, j.neHEF, j.chHEF)
+        j['isgood'] = (j.idmask&GOOD)==GOOD
+        j['isHEM'] = (j.idmask&HEM)==HEM
         j['isclean'] = ~match(j,e_loose,0.4)&~match(j,mu_loose,0.4)&~match(j,pho_loose,0.4)
         j['isiso'] = ~match(j,fj_clean[fj_clean.pt.argmax()],1.5)
         j['isdcsvL'] = (j.btagDeepB>deepcsvWPs['loose'])
@@ -458,26 +506,28 @@ class AnalysisProcessor(processor.ProcessorABC):
         # Calculate recoil and transverse mass
         ###
 
-        u = {
-            'sr'    : met.T,
-            'wecr'  : met.T+leading_e.T.sum(),
-            'tecr'  : met.T+leading_e.T.sum(),
-            'wmcr'  : met.T+leading_mu.T.sum(),
-            'tmcr'  : met.T+leading_mu.T.sum(),
-        }
+        u = LazyDict({
+            'sr'    : lambda: met.T,
+            'wecr'  : lambda: met.T+leading_e.T.sum(),
+            'tecr'  : lambda: met.T+leading_e.T.sum(),
+            'wmcr'  : lambda: met.T+leading_mu.T.sum(),
+            'tmcr'  : lambda: met.T+leading_mu.T.sum(),
+        })
 
-        mT = {
-            'wecr'  : np.sqrt(2*leading_e.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_e.T.sum())))),
-            'tecr'  : np.sqrt(2*leading_e.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_e.T.sum())))),
-            'wmcr'  : np.sqrt(2*leading_mu.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_mu.T.sum())))),
-            'tmcr'  : np.sqrt(2*leading_mu.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_mu.T.sum())))) 
-        }
+        mT = LazyDict({
+            'wecr'  : lambda: np.sqrt(2*leading_e.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_e.T.sum())))),
+            'tecr'  : lambda: np.sqrt(2*leading_e.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_e.T.sum())))),
+            'wmcr'  : lambda: np.sqrt(2*leading_mu.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_mu.T.sum())))),
+            'tmcr'  : lambda: np.sqrt(2*leading_mu.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_mu.T.sum()))))
+        })
 
+        profile.start('weights')
         ###
         #Calculating weights
         ###
         if not isData:
             
+            profile.start('genmatching')
             gen = events.GenPart
 
             gen['isb'] = (abs(gen.pdgId)==5)&gen.hasFlags(['fromHardProcess', 'isLastCopy'])
@@ -495,6 +545,7 @@ class AnalysisProcessor(processor.ProcessorABC):
             genZs = gen[gen.isZ]
             genDYs = gen[gen.isZ&(gen.mass>30)]
             
+            profile.start('weights')
             nnlo_nlo = {}
             nlo_qcd = np.ones(events.size)
             nlo_ewk = np.ones(events.size)
@@ -523,32 +574,42 @@ class AnalysisProcessor(processor.ProcessorABC):
 
             pu = get_pu_weight(events.Pileup.nTrueInt)
 
+            ###
+            # Electron and muon SFs, all the ones of a lepton from a single lookup
+            ###
+
+            mueta = abs(leading_mu.eta.sum())
+            if self._year=='2016':
+                mueta=leading_mu.eta.sum()
+
+            lepton_sf = LazyDict({
+                'e':   lambda: get_ele_sf(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(), leading_e.pt.sum()),
+                'mu':  lambda: get_mu_sf(mueta, leading_mu.pt.sum())
+            })
+
             ###
             # Trigger efficiency weight
             ###
 
-            trig = {
-                'sr':   get_met_trig_weight(met.pt),
-                'wmcr': get_met_trig_weight(u['wmcr'].mag),
-                'tmcr': get_met_trig_weight(u['tmcr'].mag),
-                'wecr': get_ele_trig_weight(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(), leading_e.pt.sum()),
-                'tecr': get_ele_trig_weight(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(), leading_e.pt.sum()),
-            }
+            trig = LazyDict({
+                'sr':   lambda: get_met_trig_weight(met.pt),
+                'wmcr': lambda: get_met_trig_weight(u['wmcr'].mag),
+                'tmcr': lambda: get_met_trig_weight(u['tmcr'].mag),
+                'wecr': lambda: lepton_sf['e']['trig'],
+                'tecr': lambda: lepton_sf['e']['trig'],
+            })
 
             ### 
             # Calculating electron and muon ID weights
             ###
 
-            mueta = abs(leading_mu.eta.sum())
-            if self._year=='2016':
-                mueta=leading_mu.eta.sum()
-            ids ={
-                'sr':  np.ones(events.size),
-                'wmcr': get_mu_tight_id_sf(mueta,leading_mu.pt.sum()),
-                'tmcr': get_mu_tight_id_sf(mueta,leading_mu.pt.sum()),
-                'wecr': get_ele_tight_id_sf(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(),leading_e.pt.sum()),
-                'tecr': get_ele_tight_id_sf(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(),leading_e.pt.sum()),
-            }
+            ids = LazyDict({
+                'sr':  lambda: np.ones(events.size),
+                'wmcr': lambda: lepton_sf['mu']['tight_id'],
+                'tmcr': lambda: lepton_sf['mu']['tight_id'],
+                'wecr': lambda: lepton_sf['e']['tight_id'],
+                'tecr': lambda: lepton_sf['e']['tight_id'],
+            })
 
             ###
             # Reconstruction weights for electrons
@@ -557,30 +618,25 @@ class AnalysisProcessor(processor.ProcessorABC):
             def ele_reco_sf(pt, eta):#2017 has separate weights for low/high pT (threshold at 20 GeV)
                 return get_ele_reco_sf(eta, pt)*(pt>20).astype(np.int) + get_ele_reco_lowet_sf(eta, pt)*(~(pt>20)).astype(np.int)
 
-            if self._year == '2017':
-                sf = ele_reco_sf
-            else:
-                sf = get_ele_reco_sf
-
-            reco = {
-                'sr': np.ones(events.size),
-                'wmcr': np.ones(events.size),
-                'tmcr': np.ones(events.size),
-                'wecr': sf(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(),leading_e.pt.sum()),
-                'tecr': sf(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(),leading_e.pt.sum()),
-            }
+            reco = LazyDict({
+                'sr': lambda: np.ones(events.size),
+                'wmcr': lambda: np.ones(events.size),
+                'tmcr': lambda: np.ones(events.size),
+                'wecr': lambda: lepton_sf['e']['reco'] if self._year != '2017' else ele_reco_sf(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(),leading_e.pt.sum()),
+                'tecr': lambda: lepton_sf['e']['reco'] if self._year != '2017' else ele_reco_sf(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(),leading_e.pt.sum()),
+            })
 
             ###
             # Isolation weights for muons
             ###
 
-            isolation = {
-                'sr'  : np.ones(events.size),
-                'wmcr': get_mu_tight_iso_sf(mueta,leading_mu.pt.sum()),
-                'tmcr': get_mu_tight_iso_sf(mueta,leading_mu.pt.sum()),
-                'wecr': np.ones(events.size),
-                'tecr': np.ones(events.size),
-            }
+            isolation = LazyDict({
+                'sr'  : lambda: np.ones(events.size),
+                'wmcr': lambda: lepton_sf['mu']['tight_iso'],
+                'tmcr': lambda: lepton_sf['mu']['tight_iso'],
+                'wecr': lambda: np.ones(events.size),
+                'tecr': lambda: np.ones(events.size),
+            })
 
             ###
             # AK4 b-tagging weights
@@ -589,12 +645,14 @@ class AnalysisProcessor(processor.ProcessorABC):
             btag = {}
             btagUp = {}
             btagDown = {}
-            btag['sr'],   btagUp['sr'],   btagDown['sr']   = get_deepflav_weight['loose'](j_iso.pt,j_iso.eta,j_iso.hadronFlavour,'0')
-            btag['wmcr'], btagUp['wmcr'], btagDown['wmcr'] = get_deepflav_weight['loose'](j_iso.pt,j_iso.eta,j_iso.hadronFlavour,'0')
-            btag['tmcr'], btagUp['tmcr'], btagDown['tmcr'] = get_deepflav_weight['loose'](j_iso.pt,j_iso.eta,j_iso.hadronFlavour,'-1')
-            btag['wecr'], btagUp['wecr'], btagDown['wecr'] = get_deepflav_weight['loose'](j_iso.pt,j_iso.eta,j_iso.hadronFlavour,'0')
-            btag['tecr'], btagUp['tecr'], btagDown['tecr'] = get_deepflav_weight['loose'](j_iso.pt,j_iso.eta,j_iso.hadronFlavour,'-1')
-
+            btag_weights = get_deepflav_weight['loose'](j_iso.pt,j_iso.eta,j_iso.hadronFlavour)
+            btag['sr'],   btagUp['sr'],   btagDown['sr']   = btag_weights['0']
+            btag['wmcr'], btagUp['wmcr'], btagDown['wmcr'] = btag_weights['0']
+            btag['tmcr'], btagUp['tmcr'], btagDown['tmcr'] = btag_weights['-1']
+            btag['wecr'], btagUp['wecr'], btagDown['wecr'] = btag_weights['0']
+            btag['tecr'], btagUp['tecr'], btagDown['tecr'] = btag_weights['-1']
+
+        profile.start('selection')
         ###
         # Selections
         ###
@@ -649,33 +707,53 @@ class AnalysisProcessor(processor.ProcessorABC):
             'tecr': ['msd40','isoneE','fatjet','extrab','noHEMj','met_filters','singleelectron_triggers','met100'],
         }
 
-        isFilled = False
+        cache = ChunkCache()
+        fjmass = cache.get('fjmass', leading_fj.msd_corr.sum)
+        ZHbbvsQCD = cache.get('ZHbbvsQCD', leading_fj.ZHbbvsQCD.sum)
+        mindphimet = cache.get('mindphimet', lambda: abs(met.T.delta_phi(j_clean.T)).min())
+        minDphimet = cache.get('minDphimet', lambda: abs(met.T.delta_phi(fj_clean.T)).min())
 
-        #for region in selected_regions: 
-        for region, cuts in regions.items():
-            if region not in selected_regions: continue
+        isFilled = False
 
-            ###
-            # Adding recoil and minDPhi requirements
-            ###
+        ###
+        # Adding recoil and minDPhi requirements
+        ###
 
-            selection.add('recoil_'+region, (u[region].mag>250))
-            selection.add('mindphi_'+region, (abs(u[region].delta_phi(j_clean.T)).min()>0.5))
-            selection.add('minDphi_'+region, (abs(u[region].delta_phi(fj_clean.T)).min()>1.5))
-            selection.add('calo_'+region, ( (abs(calomet.pt - met.pt) / u[region].mag) < 0.5))
+        for region in regions:
+            if region not in selected_regions: continue
+            recoil = cache.get('recoil', lambda: u[region].mag, region)
+            mindphirecoil = cache.get('mindphirecoil', lambda: abs(u[region].delta_phi(j_clean.T)).min(), region)
+            minDphirecoil = cache.get('minDphirecoil', lambda: abs(u[region].delta_phi(fj_clean.T)).min(), region)
+            caloMinusPfOverRecoil = cache.get('CaloMinusPfOverRecoil', lambda: abs(calomet.pt - met.pt) / recoil, region)
+            selection.add('recoil_'+region, (recoil>250))
+            selection.add('mindphi_'+region, (mindphirecoil>0.5))
+            selection.add('minDphi_'+region, (minDphirecoil>1.5))
+            selection.add('calo_'+region, (caloMinusPfOverRecoil < 0.5))
             #regions[region].update({'recoil_'+region,'mindphi_'+region})
             regions[region].insert(0, 'recoil_'+region)
             regions[region].insert(3, 'mindphi_'+region)
             regions[region].insert(4, 'minDphi_'+region)
             regions[region].insert(5, 'calo_'+region)
+        region_masks = RegionMasks(selection, {region: regions[region] for region in regions if region in selected_regions})
+
+        profile.start('fills')
+        #for region in selected_regions: 
+        for region, cuts in regions.items():
+            if region not in selected_regions: continue
+
+            recoil = cache.get('recoil', lambda: u[region].mag, region)
+            mindphirecoil = cache.get('mindphirecoil', lambda: abs(u[region].delta_phi(j_clean.T)).min(), region)
+            minDphirecoil = cache.get('minDphirecoil', lambda: abs(u[region].delta_phi(fj_clean.T)).min(), region)
+            caloMinusPfOverRecoil = cache.get('CaloMinusPfOverRecoil', lambda: abs(calomet.pt - met.pt) / recoil, region)
+            masks = region_masks.cumulative(region)
             variables = {
-                'mindphirecoil':          abs(u[region].delta_phi(j_clean.T)).min(),
-                'minDphirecoil':          abs(u[region].delta_phi(fj_clean.T)).min(),
-                'CaloMinusPfOverRecoil':  abs(calomet.pt - met.pt) / u[region].mag,
+                'mindphirecoil':          mindphirecoil,
+                'minDphirecoil':          minDphirecoil,
+                'CaloMinusPfOverRecoil':  caloMinusPfOverRecoil,
                 'met':                    met.pt.flatten(),
                 'metphi':                 met.phi.flatten(),
-                'mindphimet':             abs(met.T.delta_phi(j_clean.T)).min(),
-                'minDphimet':             abs(met.T.delta_phi(fj_clean.T)).min(),
+                'mindphimet':             mindphimet,
+                'minDphimet':             minDphimet,
                 'j1pt':                   leading_j.pt.sum(),
                 'j1eta':                  leading_j.eta.sum(),
                 'j1phi':                  leading_j.phi.sum(),
@@ -697,6 +775,8 @@ class AnalysisProcessor(processor.ProcessorABC):
                 variables['l1phi']     = leading_mu.phi.sum()
                 variables['l1eta']     = leading_mu.eta.sum()
 
+            skim.variables(region, dict(variables, recoil=recoil, fjmass=fjmass, ZHbbvsQCD=ZHbbvsQCD))
+
             def fill(dataset, weight, cut):
                 for histname, h in hout.items():
                     if not isinstance(h, hist.Hist):
@@ -707,28 +787,28 @@ class AnalysisProcessor(processor.ProcessorABC):
                     h.fill(dataset=dataset, 
                            region=region, 
                            **flat_variable, 
-                           ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
+                           ZHbbvsQCD=ZHbbvsQCD,
                            weight=weight*cut)
 
             if isData:
                 if not isFilled:
                     hout['sumw'].fill(dataset=dataset, sumw=1, weight=1)
                     isFilled=True
-                cut = selection.all(*regions[region])
+                cut = masks[-1]
                 hout['template'].fill(dataset=dataset,
                                       region=region,
                                       systematic='nominal',
-                                      recoil=u[region].mag,
-                                      fjmass=leading_fj.msd_corr.sum(),
-                                      ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
+                                      recoil=recoil,
+                                      fjmass=fjmass,
+                                      ZHbbvsQCD=ZHbbvsQCD,
                                       weight=np.ones(events.size)*cut)
                 hout['ZHbbvsQCD'].fill(dataset=dataset,
                                       region=region,
-                                      ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
+                                      ZHbbvsQCD=ZHbbvsQCD,
                                       weight=np.ones(events.size)*cut)
                 fill(dataset, np.ones(events.size), cut)
             else:
-                weights = processor.Weights(len(events))
+                weights = processor.Weights(len(events), storeIndividual=self._skim)
                 if 'L1PreFiringWeight' in events.columns: weights.add('prefiring',events.L1PreFiringWeight.Nom)
                 weights.add('genw',events.genWeight)
                 weights.add('nlo_qcd',nlo_qcd)
@@ -754,6 +834,8 @@ class AnalysisProcessor(processor.ProcessorABC):
                 weights.add('reco', reco[region])
                 weights.add('isolation', isolation[region])
                 weights.add('btag',btag[region], btagUp[region], btagDown[region])
+                wnom = cache.get('weight', weights.weight, region)
+                skim.weights(region, weights)
 
                 if 'WJets' in dataset or 'ZJets' in dataset or 'DY' in dataset:
                     if not isFilled:
@@ -762,104 +844,70 @@ class AnalysisProcessor(processor.ProcessorABC):
                         isFilled=True
                     whf = ((gen[gen.isb].counts>0)|(gen[gen.isc].counts>0)).astype(np.int)
                     wlf = (~(whf.astype(np.bool))).astype(np.int)
-                    cut = selection.all(*regions[region])
-                    systematics = [None,
-                                   'btagUp',
-                                   'btagDown',
-                                   'qcd1Up',
-                                   'qcd1Down',
-                                   'qcd2Up',
-                                   'qcd2Down',
-                                   'qcd3Up',
-                                   'qcd3Down',
-                                   'muFUp',
-                                   'muFDown',
-                                   'muRUp',
-                                   'muRDown',
-                                   'ew1Up',
-                                   'ew1Down',
-                                   'ew2GUp',
-                                   'ew2GDown',
-                                   'ew2WUp',
-                                   'ew2WDown',
-                                   'ew2ZUp',
-                                   'ew2ZDown',
-                                   'ew3GUp',
-                                   'ew3GDown',
-                                   'ew3WUp',
-                                   'ew3WDown',
-                                   'ew3ZUp',
-                                   'ew3ZDown',
-                                   'mixUp',
-                                   'mixDown']
-                    for systematic in systematics:
-                        sname = 'nominal' if systematic is None else systematic
-                        hout['template'].fill(dataset='HF--'+dataset,
-                                              region=region,
-                                              systematic=sname,
-                                              recoil=u[region].mag,
-                                              fjmass=leading_fj.msd_corr.sum(),
-                                              ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
-                                              weight=weights.weight(modifier=systematic)*whf*cut)
-                        hout['template'].fill(dataset='LF--'+dataset,
-                                              region=region,
-                                              systematic=sname,
-                                              recoil=u[region].mag,
-                                              fjmass=leading_fj.msd_corr.sum(),
-                                              ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
-                                              weight=weights.weight(modifier=systematic)*wlf*cut)
+                    skim.add('hf', whf)
+                    cut = masks[-1]
+                    sel = cut.astype(np.bool)
+                    systematics = ['nominal' if systematic is None else systematic for systematic in self._systematics]
+                    index = hout['template'].index(recoil=recoil[sel],
+                                                   fjmass=fjmass[sel],
+                                                   ZHbbvsQCD=ZHbbvsQCD[sel])
+                    wsys = np.stack([weights.weight(modifier=systematic)[sel] for systematic in self._systematics])
+                    ishf = whf[sel].astype(np.bool)
+                    hout['template'].fill_systematics('systematic', systematics, wsys[:,ishf], index=index[ishf],
+                                                      dataset='HF--'+dataset, region=region)
+                    hout['template'].fill_systematics('systematic', systematics, wsys[:,~ishf], index=index[~ishf],
+                                                      dataset='LF--'+dataset, region=region)
                     ## Cutflow loop
                     vcut=np.zeros(events.size, dtype=np.int)
-                    hout['cutflow'].fill(dataset='HF--'+dataset, region=region, cut=vcut, ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(), weight=weights.weight()*whf)
-                    hout['cutflow'].fill(dataset='LF--'+dataset, region=region, cut=vcut, ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(), weight=weights.weight()*wlf)
-                    allcuts = set()
-                    for i, icut in enumerate(cuts):
-                        allcuts.add(icut)
-                        jcut = selection.all(*allcuts)
+                    hout['cutflow'].fill(dataset='HF--'+dataset, region=region, cut=vcut, ZHbbvsQCD=ZHbbvsQCD, weight=wnom*whf)
+                    hout['cutflow'].fill(dataset='LF--'+dataset, region=region, cut=vcut, ZHbbvsQCD=ZHbbvsQCD, weight=wnom*wlf)
+                    for i, jcut in enumerate(masks):
                         vcut = (i+1)*jcut
-                        hout['cutflow'].fill(dataset='HF--'+dataset, region=region, cut=vcut, ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(), weight=weights.weight()*jcut*whf)
-                        hout['cutflow'].fill(dataset='LF--'+dataset, region=region, cut=vcut, ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(), weight=weights.weight()*jcut*wlf)
+                        hout['cutflow'].fill(dataset='HF--'+dataset, region=region, cut=vcut, ZHbbvsQCD=ZHbbvsQCD, weight=wnom*jcut*whf)
+                        hout['cutflow'].fill(dataset='LF--'+dataset, region=region, cut=vcut, ZHbbvsQCD=ZHbbvsQCD, weight=wnom*jcut*wlf)
 
                     hout['ZHbbvsQCD'].fill(dataset='HF--'+dataset,
                                            region=region,
-                                           ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
-                                           weight=weights.weight()*whf*cut)
+                                           ZHbbvsQCD=ZHbbvsQCD,
+                                           weight=wnom*whf*cut)
                     hout['ZHbbvsQCD'].fill(dataset='LF--'+dataset,
                                            region=region,
-                                           ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
-                                           weight=weights.weight()*wlf*cut)
-                    fill('HF--'+dataset, weights.weight()*whf, cut)
-                    fill('LF--'+dataset, weights.weight()*wlf, cut)
+                                           ZHbbvsQCD=ZHbbvsQCD,
+                                           weight=wnom*wlf*cut)
+                    fill('HF--'+dataset, wnom*whf, cut)
+                    fill('LF--'+dataset, wnom*wlf, cut)
                 else:
                     if not isFilled:
                         hout['sumw'].fill(dataset=dataset, sumw=1, weight=events.genWeight.sum())
                         isFilled=True
-                    cut = selection.all(*regions[region])
-                    for systematic in [None, 'btagUp', 'btagDown']:
-                        sname = 'nominal' if systematic is None else systematic
-                        hout['template'].fill(dataset=dataset,
-                                              region=region,
-                                              systematic=sname,
-                                              recoil=u[region].mag,
-                                              fjmass=leading_fj.msd_corr.sum(),
-                                              ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
-                                              weight=weights.weight(modifier=systematic)*cut)
+                    cut = masks[-1]
+                    sel = cut.astype(np.bool)
+                    index = hout['template'].index(recoil=recoil[sel],
+                                                   fjmass=fjmass[sel],
+                                                   ZHbbvsQCD=ZHbbvsQCD[sel])
+                    wsys = np.stack([weights.weight(modifier=systematic)[sel] for systematic in [None, 'btagUp', 'btagDown']])
+                    hout['template'].fill_systematics('systematic', ['nominal', 'btagUp', 'btagDown'], wsys, index=index,
+                                                      dataset=dataset, region=region)
                     ## Cutflow loop
                     vcut=np.zeros(events.size, dtype=np.int)
-                    hout['cutflow'].fill(dataset=dataset, region=region, cut=vcut, ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(), weight=weights.weight())
-                    allcuts = set()
-                    for i, icut in enumerate(cuts):
-                        allcuts.add(icut)
-                        jcut = selection.all(*allcuts)
+                    hout['cutflow'].fill(dataset=dataset, region=region, cut=vcut, ZHbbvsQCD=ZHbbvsQCD, weight=wnom)
+                    for i, jcut in enumerate(masks):
                         vcut = (i+1)*jcut
-                        hout['cutflow'].fill(dataset=dataset, region=region, cut=vcut, ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(), weight=weights.weight()*jcut)
+                        hout['cutflow'].fill(dataset=dataset, region=region, cut=vcut, ZHbbvsQCD=ZHbbvsQCD, weight=wnom*jcut)
 
                     hout['ZHbbvsQCD'].fill(dataset=dataset,
                                            region=region,
-                                           ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
-                                           weight=weights.weight()*cut)
-                    fill(dataset, weights.weight(), cut)
+                                           ZHbbvsQCD=ZHbbvsQCD,
+                                           weight=wnom*cut)
+                    fill(dataset, wnom, cut)
+
+        if self._skim:
+            keep = np.zeros(events.size, dtype=np.bool)
+            for region in selected_regions:
+                keep |= selection.all('fatjet', 'recoil_'+region)
+            skim.fill(keep, selection, {region: regions[region] for region in selected_regions}, 1 if isData else events.genWeight.sum())
 
+        profile.stop()
         return hout
 
     def postprocess(self, accumulator):
@@ -874,7 +922,7 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         for histname, h in accumulator.items():
             if histname == 'sumw': continue
-            if isinstance(h, hist.Hist):
+            if isinstance(h, (hist.Hist, DenseHist)):
                 h.scale(scale, axis='dataset')
 
         return accumulator
@@ -890,7 +938,7 @@ if __name__ == '__main__':
         samplefiles = json.load(fin)
         xsec = {k: v['xs'] for k,v in samplefiles.items()}
 
-    corrections = load('data/corrections.coffea')
+    corrections = LazyCorrections('data/corrections', options.year)
     ids         = load('data/ids.coffea')
     common      = load('data/common.coffea')
 
@@ -10,6 +10,9 @@ np.seterr(divide='ignore', invalid='ignore', over='ignore')
 from coffea.arrays import Initialize
 from coffea import hist, processor
 from coffea.util import load, save
+from helpers.ids import GOOD
+from helpers.profile import Profiler
+from helpers.corrections import LazyCorrections
 from optparse import OptionParser
 from uproot_methods import TVector2Array, TLorentzVectorArray
 
@@ -49,6 +52,9 @@ class AnalysisProcessor(processor.ProcessorABC):
 
     def __init__(self, year, xsec, corrections, ids, common):
 
+        self._columns = set() # frozen by python run.py --columns, see helpers/columns.py
+        self._profile = None # set by python run.py --profile=time|memory, see helpers/profile.py
+
         self._year = year
         self._lumi = 1000.*float(AnalysisProcessor.lumis[year])
         self._xsec = xsec
@@ -90,6 +96,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         self._common = common
 
         self._accumulator = processor.dict_accumulator({
+            'profile': processor.defaultdict_accumulator(float),
             'sumw': hist.Hist(
                 'sumw',
                 hist.Cat('dataset', 'Dataset'),
@@ -174,19 +181,20 @@ class AnalysisProcessor(processor.ProcessorABC):
         isData = 'genWeight' not in events.columns
         selection = processor.PackedSelection()
         hout = self.accumulator.identity()
+        profile = Profiler(hout['profile'], dataset, events.size, mode=self._profile)
 
+        profile.start('corrections')
         ###
         #Getting ids from .coffea files
         ###
 
         get_msd_weight  = self._corrections['get_msd_weight']
         get_pu_weight   = self._corrections['get_pu_weight'][self._year]  
-        isLooseMuon     = self._ids['isLooseMuon']
-        isTightMuon     = self._ids['isTightMuon']
-        isGoodFatJet    = self._ids['isGoodFatJet']
+        fatJetId        = self._ids['fatJetId']
 
         match = self._common['match']
 
+        profile.start('objects')
         ###
         #Initialize physics objects
         ###
@@ -196,7 +204,7 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         fj = events.AK15Puppi
         fj['sd'] = fj.subjets.sum()
-        fj['isgood'] = isGoodFatJet(fj.sd.pt, fj.sd.eta, fj.jetId)
+        fj['isgood'] = (fatJetId(fj.sd.pt, fj.sd.eta, fj.jetId)&GOOD)==GOOD
         fj['T'] = TVector2Array.from_polar(fj.pt, fj.phi)
         fj['msd_raw'] = (fj.subjets * (1 - fj.subjets.rawFactor)).sum().mass
         fj['msd_corr'] = fj.msd_raw * awkward.JaggedArray.fromoffsets(fj.array.offsets, np.maximum(1e-5, get_msd_weight(fj.sd.pt.flatten(),fj.sd.eta.flatten())))
@@ -207,6 +215,7 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         SV = events.SV
 
+        profile.start('weights')
         ###
         # Calculating weights
         ###
@@ -255,6 +264,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         ##### fatjet with two subjets matched with muons
         fj['withmu'] = step3.sum() == 2
 
+        profile.start('selection')
         ###
         # Selections
         ###
@@ -314,6 +324,7 @@ class AnalysisProcessor(processor.ProcessorABC):
                            gentype=gentype, 
                            **flat_variable, 
                            weight=weight*cut)
+        profile.start('fills')
         isFilled = False
         if isData:
             if not isFilled:
@@ -421,6 +432,7 @@ class AnalysisProcessor(processor.ProcessorABC):
                         weight=weights.weight()
                         )
 
+        profile.stop()
         return hout
 
     def postprocess(self, accumulator):
@@ -451,7 +463,7 @@ if __name__ == '__main__':
         samplefiles = json.load(fin)
         xsec = {k: v['xs'] for k,v in samplefiles.items()}
 
-    corrections = load('data/corrections.coffea')
+    corrections = LazyCorrections('data/corrections', options.year)
     ids         = load('data/ids.coffea')
     common      = load('data/common.coffea')
 
@@ -10,6 +10,14 @@ np.seterr(divide='ignore', invalid='ignore', over='ignore')
 from coffea.arrays import Initialize
 from coffea import hist, processor
 from coffea.util import load, save
+from helpers.dense import DenseHist
+from helpers.cache import ChunkCache, LazyDict
+from helpers.selection import RegionMasks
+from helpers.ids import LOOSE, TIGHT, GOOD, HEM
+from helpers.gentruth import gentype, dynamic_isolation
+from helpers.profile import Profiler
+from helpers.skim import Skim
+from helpers.corrections import LazyCorrections
 from coffea.jetmet_tools import FactorizedJetCorrector, JetCorrectionUncertainty, JetTransformer, JetResolution, JetResolutionScaleFactor
 from optparse import OptionParser
 from uproot_methods import TVector2Array, TLorentzVectorArray
@@ -54,94 +62,9 @@ class AnalysisProcessor(processor.ProcessorABC):
             
     def __init__(self, year, xsec, corrections, ids, common):
 
-        self._columns = """                                                                                                                    
-        AK15PuppiSubJet_eta
-        AK15PuppiSubJet_mass
-        AK15PuppiSubJet_phi
-        AK15PuppiSubJet_pt
-        AK15Puppi_eta
-        AK15Puppi_jetId
-        AK15Puppi_msoftdrop
-        AK15Puppi_phi
-        AK15Puppi_probHbb
-        AK15Puppi_probQCDb
-        AK15Puppi_probQCDbb
-        AK15Puppi_probQCDc
-        AK15Puppi_probQCDcc
-        AK15Puppi_probQCDothers
-        AK15Puppi_probZbb
-        AK15Puppi_pt
-        AK15Puppi_subJetIdx1
-        AK15Puppi_subJetIdx2
-        CaloMET_pt
-        CaloMET_phi
-        Electron_charge
-        Electron_cutBased
-        Electron_dxy
-        Electron_dz
-        Electron_eta
-        Electron_mass
-        Electron_phi
-        Electron_pt
-        Flag_BadPFMuonFilter
-        Flag_EcalDeadCellTriggerPrimitiveFilter
-        Flag_HBHENoiseFilter
-        Flag_HBHENoiseIsoFilter
-        Flag_globalSuperTightHalo2016Filter
-        Flag_goodVertices
-        GenPart_eta
-        GenPart_genPartIdxMother
-        GenPart_pdgIdGenPart_phi
-        GenPart_pt
-        GenPart_statusFlags
-        HLT_Ele115_CaloIdVT_GsfTrkIdT
-        HLT_Ele32_WPTight_Gsf
-        HLT_PFMETNoMu120_PFMHTNoMu120_IDTight
-        HLT_PFMETNoMu120_PFMHTNoMu120_IDTight_PFHT60
-        HLT_Photon200
-        Jet_btagDeepB
-        Jet_btagDeepFlavB
-        Jet_chEmEF
-        Jet_chHEF
-        Jet_eta
-        Jet_hadronFlavour
-        Jet_jetId
-        Jet_mass
-        Jet_neEmEF
-        Jet_neHEF
-        Jet_phi
-        Jet_pt
-        Jet_rawFactor
-        MET_phi
-        MET_pt
-        Muon_charge
-        Muon_eta
-        Muon_looseId
-        Muon_mass
-        Muon_pfRelIso04_all
-        Muon_phi
-        Muon_pt
-        Muon_tightId
-        PV_npvs
-        Photon_eta
-        Photon_phi
-        Photon_pt
-        Tau_eta
-        Tau_idDecayMode
-        Tau_idMVAoldDM2017v2
-        Tau_phi
-        Tau_pt
-        fixedGridRhoFastjetAll
-        genWeight
-        nAK15Puppi
-        nAK15PuppiSubJet
-        nElectron
-        nGenPart
-        nJet
-        nMuon
-        nPhoton
-        nTau
-        """.split()
+        self._columns = set() # frozen by python run.py --columns, see helpers/columns.py
+        self._profile = None # set by python run.py --profile=time|memory, see helpers/profile.py
+        self._skim = False # set by python run.py --skim, see helpers/skim.py
         
         self._year = year
 
@@ -301,11 +224,43 @@ class AnalysisProcessor(processor.ProcessorABC):
             ]
         }
 
+        self._systematics = [None,
+                             'btagUp',
+                             'btagDown',
+                             'qcd1Up',
+                             'qcd1Down',
+                             'qcd2Up',
+                             'qcd2Down',
+                             'qcd3Up',
+                             'qcd3Down',
+                             'muFUp',
+                             'muFDown',
+                             'muRUp',
+                             'muRDown',
+                             'ew1Up',
+                             'ew1Down',
+                             'ew2GUp',
+                             'ew2GDown',
+                             'ew2WUp',
+                             'ew2WDown',
+                             'ew2ZUp',
+                             'ew2ZDown',
+                             'ew3GUp',
+                             'ew3GDown',
+                             'ew3WUp',
+                             'ew3WDown',
+                             'ew3ZUp',
+                             'ew3ZDown',
+                             'mixUp',
+                             'mixDown']
+
         self._corrections = corrections
         self._ids = ids
         self._common = common
 
         self._accumulator = processor.dict_accumulator({
+            'profile': processor.defaultdict_accumulator(float),
+            'skim': processor.dict_accumulator({}),
             'sumw': hist.Hist(
                 'sumw', 
                 hist.Cat('dataset', 'Dataset'), 
@@ -318,15 +273,14 @@ class AnalysisProcessor(processor.ProcessorABC):
                 #hist.Bin('cut', 'Cut index', 11, 0, 11),
                 hist.Bin('cut', 'Cut index', [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]),
             ),
-            'template': hist.Hist(
+            'template': DenseHist(
                 'Events',
-                hist.Cat('dataset', 'Dataset'),
-                hist.Cat('region', 'Region'),
-                hist.Cat('systematic', 'Systematic'),
-                hist.Bin('gentype', 'Gen Type', [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13]),
-                hist.Bin('recoil','Hadronic Recoil',[250,310,370,470,590,840,1020,1250,3000]),
-                hist.Bin('fjmass','AK15 Jet Mass', [0,40,50,60,70,80,90,100,110,120,130,150,160,180,200,220,240,300]),#[0, 30, 60, 80, 120, 300]),
-                hist.Bin('ZHbbvsQCD','ZHbbvsQCD', [0, self._ZHbbvsQCDwp[self._year], 1])
+                [('region', 'Region', self._samples.keys()),
+                 ('systematic', 'Systematic', ['nominal' if s is None else s for s in self._systematics])],
+                [hist.Bin('gentype', 'Gen Type', [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13]),
+                 hist.Bin('recoil','Hadronic Recoil',[250,310,370,470,590,840,1020,1250,3000]),
+                 hist.Bin('fjmass','AK15 Jet Mass', [0,40,50,60,70,80,90,100,110,120,130,150,160,180,200,220,240,300]),#[0, 30, 60, 80, 120, 300]),
+                 hist.Bin('ZHbbvsQCD','ZHbbvsQCD', [0, self._ZHbbvsQCDwp[self._year], 1])]
             ),
             'recoil': hist.Hist(
                 'Events',
@@ -533,7 +487,10 @@ class AnalysisProcessor(processor.ProcessorABC):
         isData = 'genWeight' not in events.columns
         selection = processor.PackedSelection()
         hout = self.accumulator.identity()
+        profile = Profiler(hout['profile'], dataset, events.size, mode=self._profile)
+        skim = Skim(hout['skim'], enabled=self._skim)
 
+        profile.start('corrections')
         ###
         #Getting corrections, ids from .coffea files
         ###
@@ -558,20 +515,18 @@ class AnalysisProcessor(processor.ProcessorABC):
         get_ele_reco_lowet_sf   = self._corrections['get_ele_reco_lowet_sf']
         get_mu_tight_iso_sf     = self._corrections['get_mu_tight_iso_sf'][self._year]
         get_mu_loose_iso_sf     = self._corrections['get_mu_loose_iso_sf'][self._year]
+        get_ele_sf              = self._corrections['get_ele_sf'][self._year]
+        get_mu_sf               = self._corrections['get_mu_sf'][self._year]
         get_ecal_bad_calib      = self._corrections['get_ecal_bad_calib']
         get_deepflav_weight     = self._corrections['get_btag_weight']['deepflav'][self._year]
         Jetevaluator            = self._corrections['Jetevaluator']
         
-        isLooseElectron = self._ids['isLooseElectron'] 
-        isTightElectron = self._ids['isTightElectron'] 
-        isLooseMuon     = self._ids['isLooseMuon']     
-        isTightMuon     = self._ids['isTightMuon']     
-        isLooseTau      = self._ids['isLooseTau']      
-        isLoosePhoton   = self._ids['isLoosePhoton']   
-        isTightPhoton   = self._ids['isTightPhoton']   
-        isGoodJet       = self._ids['isGoodJet']       
-        isGoodFatJet    = self._ids['isGoodFatJet']    
-        isHEMJet        = self._ids['isHEMJet']        
+        electronId      = self._ids['electronId'][self._year]
+        muonId          = self._ids['muonId'][self._year]
+        tauId           = self._ids['tauId'][self._year]
+        photonId        = self._ids['photonId'][self._year]
+        jetId           = self._ids['jetId']
+        fatJetId        = self._ids['fatJetId']
         
         match = self._common['match']
         sigmoid = self._common['sigmoid'] #to calculate photon trigger efficiency
@@ -588,6 +543,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         JERsf = JetResolutionScaleFactor(**{name:Jetevaluator[name] for name in self._jersf[self._year]})
         Jet_transformer = JetTransformer(jec=JECcorrector,junc=JECuncertainties, jer = JER, jersf = JERsf)
         
+        profile.start('objects')
         ###
         #Initialize global quantities (MET ecc.)
         ###
@@ -603,8 +559,9 @@ class AnalysisProcessor(processor.ProcessorABC):
         ###
 
         mu = events.Muon
-        mu['isloose'] = isLooseMuon(mu.pt,mu.eta,mu.pfRelIso04_all,mu.looseId,self._year)
-        mu['istight'] = isTightMuon(mu.pt,mu.eta,mu.pfRelIso04_all,mu.tightId,self._year)
+        mu['idmask'] = muonId(mu.pt,mu.eta,mu.pfRelIso04_all,mu.looseId,mu.tightId)
+        mu['isloose'] = (mu.idmask&LOOSE)==LOOSE
+        mu['istight'] = (mu.idmask&TIGHT)==TIGHT
         mu['T'] = TVector2Array.from_polar(mu.pt, mu.phi)
         mu_loose=mu[mu.isloose.astype(np.bool)]
         mu_tight=mu[mu.istight.astype(np.bool)]
@@ -616,8 +573,9 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         e = events.Electron
         e['isclean'] = ~match(e,mu_loose,0.3) 
-        e['isloose'] = isLooseElectron(e.pt,e.eta+e.deltaEtaSC,e.dxy,e.dz,e.cutBased,self._year)
-        e['istight'] = isTightElectron(e.pt,e.eta+e.deltaEtaSC,e.dxy,e.dz,e.cutBased,self._year)
+        e['idmask'] = electronId(e.pt,e.eta+e.deltaEtaSC,e.dxy,e.dz,e.cutBased)
+        e['isloose'] = (e.idmask&LOOSE)==LOOSE
+        e['istight'] = (e.idmask&TIGHT)==TIGHT
         e['T'] = TVector2Array.from_polar(e.pt, e.phi)
         e_clean = e[e.isclean.astype(np.bool)]
         e_loose = e_clean[e_clean.isloose.astype(np.bool)]
@@ -631,7 +589,7 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         tau = events.Tau
         tau['isclean']=~match(tau,mu_loose,0.4)&~match(tau,e_loose,0.4)
-        tau['isloose']=isLooseTau(tau.pt,tau.eta,tau.idDecayMode,tau.idMVAoldDM2017v2,self._year)
+        tau['isloose']=(tauId(tau.pt,tau.eta,tau.idDecayMode,tau.idMVAoldDM2017v2)&LOOSE)==LOOSE
         tau_clean=tau[tau.isclean.astype(np.bool)]
         tau_loose=tau_clean[tau_clean.isloose.astype(np.bool)]
         tau_ntot=tau.counts
@@ -642,8 +600,9 @@ class AnalysisProcessor(processor.ProcessorABC):
         _id = 'cutBasedBitmap'
         if self._year=='2016': 
             _id = 'cutBased'
-        pho['isloose']=isLoosePhoton(pho.pt,pho.eta,pho[_id],self._year)&(pho.electronVeto) #added electron veto flag
-        pho['istight']=isTightPhoton(pho.pt,pho[_id],self._year)&(pho.isScEtaEB)&(pho.electronVeto) #tight photons are barrel only
+        pho['idmask']=photonId(pho.pt,pho.eta,pho[_id],pho.electronVeto,pho.isScEtaEB) #electron veto on both, tight photons are barrel only
+        pho['isloose']=(pho.idmask&LOOSE)==LOOSE
+        pho['istight']=(pho.idmask&TIGHT)==TIGHT
         pho['T'] = TVector2Array.from_polar(pho.pt, pho.phi)
         pho_clean=pho[pho.isclean.astype(np.bool)]
         pho_loose=pho_clean[pho_clean.isloose.astype(np.bool)]
@@ -658,7 +617,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         fj = events.AK15Puppi
         fj['sd'] = fj.subjets.sum()
         fj['isclean'] =~match(fj.sd,pho_loose,1.5)&~match(fj.sd,mu_loose,1.5)&~match(fj.sd,e_loose,1.5)
-        fj['isgood'] = isGoodFatJet(fj.sd.pt, fj.sd.eta, fj.jetId)
+        fj['isgood'] = (fatJetId(fj.sd.pt, fj.sd.eta, fj.jetId)&GOOD)==GOOD
         fj['T'] = TVector2Array.from_polar(fj.pt, fj.phi)
         fj['msd_raw'] = (fj.subjets * (1 - fj.subjets.rawFactor)).sum().mass
         fj['msd_corr'] = fj.msd_raw * awkward.JaggedArray.fromoffsets(fj.array.offsets, np.maximum(1e-5, get_msd_weight(fj.sd.pt.flatten(),fj.sd.eta.flatten())))
@@ -678,8 +637,9 @@ class AnalysisProcessor(processor.ProcessorABC):
         fj_nclean = fj_clean.counts
 
         j = events.Jet
-        j['isgood'] = isGoodJet(j.pt, j.eta, j.jetId, j.puId, j.neHEF, j.chHEF)
-        j['isHEM'] = isHEMJet(j.pt, j.eta, j.phi)
+        j['idmask'] = jetId(j.pt, j.eta, j.phi, j.jetId, j.puId, j.neHEF, j.chHEF)
+        j['isgood'] = (j.idmask&GOOD)==GOOD
+        j['isHEM'] = (j.idmask&HEM)==HEM
         j['isclean'] = ~match(j,e_loose,0.4)&~match(j,mu_loose,0.4)&~match(j,pho_loose,0.4)
         j['isiso'] = ~match(j,fj_clean[fj_clean.pt.argmax()],1.5)
         j['isdcsvL'] = (j.btagDeepB>deepcsvWPs['loose'])
@@ -726,24 +686,25 @@ class AnalysisProcessor(processor.ProcessorABC):
         # Calculate recoil and transverse mass
         ###
 
-        u = {
-            'sr'    : met.T,
-            'wecr'  : met.T+leading_e.T.sum(),
-            'tecr'  : met.T+leading_e.T.sum(),
-            'wmcr'  : met.T+leading_mu.T.sum(),
-            'tmcr'  : met.T+leading_mu.T.sum(),
-            'zecr'  : met.T+leading_diele.T.sum(),
-            'zmcr'  : met.T+leading_dimu.T.sum(),
-            'gcr'   : met.T+leading_pho.T.sum()
-        }
+        u = LazyDict({
+            'sr'    : lambda: met.T,
+            'wecr'  : lambda: met.T+leading_e.T.sum(),
+            'tecr'  : lambda: met.T+leading_e.T.sum(),
+            'wmcr'  : lambda: met.T+leading_mu.T.sum(),
+            'tmcr'  : lambda: met.T+leading_mu.T.sum(),
+            'zecr'  : lambda: met.T+leading_diele.T.sum(),
+            'zmcr'  : lambda: met.T+leading_dimu.T.sum(),
+            'gcr'   : lambda: met.T+leading_pho.T.sum()
+        })
 
-        mT = {
-            'wecr'  : np.sqrt(2*leading_e.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_e.T.sum())))),
-            'tecr'  : np.sqrt(2*leading_e.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_e.T.sum())))),
-            'wmcr'  : np.sqrt(2*leading_mu.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_mu.T.sum())))),
-            'tmcr'  : np.sqrt(2*leading_mu.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_mu.T.sum())))) 
-        }
+        mT = LazyDict({
+            'wecr'  : lambda: np.sqrt(2*leading_e.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_e.T.sum())))),
+            'tecr'  : lambda: np.sqrt(2*leading_e.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_e.T.sum())))),
+            'wmcr'  : lambda: np.sqrt(2*leading_mu.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_mu.T.sum())))),
+            'tmcr'  : lambda: np.sqrt(2*leading_mu.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_mu.T.sum()))))
+        })
 
+        profile.start('weights')
         ###
         #Calculating weights
         ###
@@ -756,212 +717,18 @@ class AnalysisProcessor(processor.ProcessorABC):
             #j['ptGenJet'] = j.matched_gen.pt
             #Jet_transformer.transform(j)
 
+            profile.start('genmatching')
             gen = events.GenPart
 
-            ###
-            # Fat-jet top matching at decay level
-            ###
-
-            qFromW = gen[
-                (abs(gen.pdgId) < 4) &
-                gen.hasFlags(['fromHardProcess', 'isFirstCopy']) &
-                (abs(gen.distinctParent.pdgId) == 24)
-            ]
-            cFromW = gen[
-                (abs(gen.pdgId) == 4) &
-                gen.hasFlags(['fromHardProcess', 'isFirstCopy']) &
-                (abs(gen.distinctParent.pdgId) == 24)
-            ]
-
-            def tbqqmatch(topid, dR=1.5):
-                qFromWFromTop = qFromW[qFromW.distinctParent.distinctParent.pdgId == topid]
-                bFromTop = gen[
-                    (abs(gen.pdgId) == 5) &
-                    gen.hasFlags(['fromHardProcess', 'isFirstCopy']) &
-                    (gen.distinctParent.pdgId == topid)
-                ]
-                jetgenWq = fj.sd.cross(qFromWFromTop, nested=True)
-                jetgenb = fj.sd.cross(bFromTop, nested=True)
-                qWmatch = ((jetgenWq.i0.delta_r(jetgenWq.i1) < dR).sum()==2) & (qFromWFromTop.counts>0)
-                bmatch = ((jetgenb.i0.delta_r(jetgenb.i1) < dR).sum()==1) & (bFromTop.counts>0)
-                return qWmatch & bmatch
-            fj['isTbqq'] = tbqqmatch(6)|tbqqmatch(-6)
-
-            def tbcqmatch(topid, dR=1.5):
-                qFromWFromTop = qFromW[qFromW.distinctParent.distinctParent.pdgId == topid]
-                cFromWFromTop = cFromW[cFromW.distinctParent.distinctParent.pdgId == topid]
-                bFromTop = gen[
-                    (abs(gen.pdgId) == 5) &
-                    gen.hasFlags(['fromHardProcess', 'isFirstCopy']) &
-                    (gen.distinctParent.pdgId == topid)
-                ]
-                jetgenWq = fj.sd.cross(qFromWFromTop, nested=True)
-                jetgenWc = fj.sd.cross(cFromWFromTop, nested=True)
-                jetgenb = fj.sd.cross(bFromTop, nested=True)
-                qWmatch = ((jetgenWq.i0.delta_r(jetgenWq.i1) < dR).sum()==1) & (qFromWFromTop.counts>0)
-                cWmatch = ((jetgenWc.i0.delta_r(jetgenWc.i1) < dR).sum()==1) & (cFromWFromTop.counts>0)
-                bmatch =  ((jetgenb.i0.delta_r(jetgenb.i1) < dR).sum()==1)   & (bFromTop.counts>0)
-                return cWmatch & qWmatch & bmatch
-            fj['isTbcq'] = tbcqmatch(6)|tbcqmatch(-6)
-
-            def tqqmatch(topid, dR=1.5):
-                qFromWFromTop = qFromW[qFromW.distinctParent.distinctParent.pdgId == topid]
-                jetgenWq = fj.sd.cross(qFromWFromTop, nested=True)
-                qWmatch = ((jetgenWq.i0.delta_r(jetgenWq.i1) < dR).sum()==2) & (qFromWFromTop.counts>0)
-                return qWmatch
-            fj['isTqq'] = tqqmatch(6)|tqqmatch(-6)
-
-            def tcqmatch(topid, dR=1.5):
-                qFromWFromTop = qFromW[qFromW.distinctParent.distinctParent.pdgId == topid]
-                cFromWFromTop = cFromW[cFromW.distinctParent.distinctParent.pdgId == topid]
-                jetgenWq = fj.sd.cross(qFromWFromTop, nested=True)
-                jetgenWc = fj.sd.cross(cFromWFromTop, nested=True)
-                qWmatch = ((jetgenWq.i0.delta_r(jetgenWq.i1) < dR).sum()==1) & (qFromWFromTop.counts>0)
-                cWmatch = ((jetgenWc.i0.delta_r(jetgenWc.i1) < dR).sum()==1) & (cFromWFromTop.counts>0)
-                return cWmatch & qWmatch
-            fj['isTcq'] = tcqmatch(6)|tcqmatch(-6)
-
-            def tbqmatch(topid, dR=1.5):
-                qFromWFromTop = qFromW[qFromW.distinctParent.distinctParent.pdgId == topid]
-                bFromTop = gen[
-                    (abs(gen.pdgId) == 5) &
-                    gen.hasFlags(['fromHardProcess', 'isFirstCopy']) &
-                    (gen.distinctParent.pdgId == topid)
-                ]
-                jetgenWq = fj.sd.cross(qFromWFromTop, nested=True)
-                jetgenb = fj.sd.cross(bFromTop, nested=True)
-                qWmatch = ((jetgenWq.i0.delta_r(jetgenWq.i1) < dR).sum()==1) & (qFromWFromTop.counts>0)
-                bmatch =  ((jetgenb.i0.delta_r(jetgenb.i1) < dR).sum()==1)   & (bFromTop.counts>0)
-                return qWmatch & bmatch
-            fj['isTbq'] = tbqmatch(6)|tbqmatch(-6)
-
-            def tbcmatch(topid, dR=1.5):
-                cFromWFromTop = cFromW[cFromW.distinctParent.distinctParent.pdgId == topid]
-                bFromTop = gen[
-                    (abs(gen.pdgId) == 5) &
-                    gen.hasFlags(['fromHardProcess', 'isFirstCopy']) &
-                    (gen.distinctParent.pdgId == topid)
-                ]
-                jetgenWc = fj.sd.cross(cFromWFromTop, nested=True)
-                jetgenb = fj.sd.cross(bFromTop, nested=True)
-                cWmatch = ((jetgenWc.i0.delta_r(jetgenWc.i1) < dR).sum()==1) & (cFromWFromTop.counts>0)
-                bmatch =  ((jetgenb.i0.delta_r(jetgenb.i1) < dR).sum()==1)   & (bFromTop.counts>0)
-                return cWmatch & bmatch
-            fj['isTbc'] = tbcmatch(6)|tbcmatch(-6)
-
-            ###
-            # Fat-jet W->qq matching at decay level
-            ###
-            def wqqmatch(wid, dR=1.5):
-                qFromSameW = qFromW[qFromW.distinctParent.pdgId == wid]
-                jetgenq = fj.sd.cross(qFromSameW, nested=True)
-                qqmatch = ((jetgenq.i0.delta_r(jetgenq.i1) < dR).sum()==2) & (qFromSameW.counts>0)
-                return qqmatch
-            fj['isWqq']  = wqqmatch(24)|wqqmatch(-24)
-
-            ###
-            # Fat-jet W->cq matching at decay level
-            ###
-            def wcqmatch(wid, dR=1.5):
-                qFromSameW = qFromW[qFromW.distinctParent.pdgId == wid]
-                cFromSameW = cFromW[cFromW.distinctParent.pdgId == wid]
-                jetgenq = fj.sd.cross(qFromSameW, nested=True)
-                jetgenc = fj.sd.cross(cFromSameW, nested=True)
-                qmatch = ((jetgenq.i0.delta_r(jetgenq.i1) < dR).sum()==1) & (qFromSameW.counts>0)
-                cmatch = ((jetgenc.i0.delta_r(jetgenc.i1) < dR).sum()==1) & (cFromSameW.counts>0)
-                return qmatch & cmatch
-            fj['isWcq']  = wcqmatch(24)|wcqmatch(-24)
-
-            ###
-            # Fat-jet Z->bb matching at decay level
-            ###
-            bFromZ = gen[
-                (abs(gen.pdgId) == 5) &
-                gen.hasFlags(['fromHardProcess', 'isFirstCopy']) &
-                (abs(gen.distinctParent.pdgId) == 23)
-            ]
-            def zbbmatch(zid, dR=1.5):
-                bFromSameZ = bFromZ[bFromZ.distinctParent.pdgId == zid]
-                jetgenb = fj.sd.cross(bFromSameZ, nested=True)
-                bbmatch = ((jetgenb.i0.delta_r(jetgenb.i1) < dR).sum()==2) & (bFromSameZ.counts>0)
-                return bbmatch
-            fj['isZbb']  = zbbmatch(23)|zbbmatch(-23)
-
-            ###
-            # Fat-jet Z->cc matching at decay level
-            ###
-            cFromZ = gen[
-                (abs(gen.pdgId) == 4) &
-                gen.hasFlags(['fromHardProcess', 'isFirstCopy']) &
-                (abs(gen.distinctParent.pdgId) == 23)
-            ]
-            def zccmatch(zid, dR=1.5):
-                cFromSameZ = cFromZ[cFromZ.distinctParent.pdgId == zid]
-                jetgenc = fj.sd.cross(cFromSameZ, nested=True)
-                ccmatch = ((jetgenc.i0.delta_r(jetgenc.i1) < dR).sum()==2) & (cFromSameZ.counts>0)
-                return ccmatch
-            fj['isZcc']  = zccmatch(23)|zccmatch(-23)
-
-            ###
-            # Fat-jet Z->qq matching at decay level
-            ###
-            qFromZ = gen[
-                (abs(gen.pdgId) < 4) &
-                gen.hasFlags(['fromHardProcess', 'isFirstCopy']) &
-                (abs(gen.distinctParent.pdgId) == 23)
-            ]
-            def zqqmatch(zid, dR=1.5):
-                qFromSameZ = qFromZ[qFromZ.distinctParent.pdgId == zid]
-                jetgenq = fj.sd.cross(qFromSameZ, nested=True)
-                qqmatch = ((jetgenq.i0.delta_r(jetgenq.i1) < dR).sum()==2) & (qFromSameZ.counts>0)
-                return qqmatch
-            fj['isZqq']  = zqqmatch(23)|zqqmatch(-23)
-
-            ###
-            # Fat-jet H->bb matching at decay level
-            ###
-            bFromH = gen[
-                (abs(gen.pdgId) == 5) &
-                gen.hasFlags(['fromHardProcess', 'isFirstCopy']) &
-                (abs(gen.distinctParent.pdgId) == 25)
-            ]
-            def hbbmatch(hid, dR=1.5):
-                bFromSameH = bFromH[bFromH.distinctParent.pdgId == hid]
-                jetgenb = fj.sd.cross(bFromSameH, nested=True)
-                bbmatch = ((jetgenb.i0.delta_r(jetgenb.i1) < dR).sum()==2) & (bFromSameH.counts>0)
-                return bbmatch
-            fj['isHbb']  = hbbmatch(25)|hbbmatch(-25)
+            gen['isb'] = (abs(gen.pdgId)==5)&gen.hasFlags(['fromHardProcess', 'isLastCopy'])
+            gen['isc'] = (abs(gen.pdgId)==4)&gen.hasFlags(['fromHardProcess', 'isLastCopy'])
 
             ###
-            # Fat-jet dark H->bb matching at decay level
+            # Fat-jet generator-level labelling, one parentage walk and one
+            # fat-jet x quark delta R pass for all the categories
             ###
-            bFromHs = gen[
-                (abs(gen.pdgId) == 5) &
-                gen.hasFlags(['fromHardProcess', 'isFirstCopy']) &
-                (abs(gen.distinctParent.pdgId) == 54)
-            ]
-            def hsbbmatch(hid, dR=1.5):
-                bFromSameHs = bFromHs[bFromHs.distinctParent.pdgId == hid]
-                jetgenb = fj.sd.cross(bFromSameHs, nested=True)
-                bbmatch = ((jetgenb.i0.delta_r(jetgenb.i1) < dR).sum()==2) & (bFromSameHs.counts>0)
-                return bbmatch
-            fj['isHsbb']  = hsbbmatch(54)|hsbbmatch(-54)
-
-            gen['isb'] = (abs(gen.pdgId)==5)&gen.hasFlags(['fromHardProcess', 'isLastCopy'])
-            jetgenb = fj.sd.cross(gen[gen.isb], nested=True)
-            bmatch = ((jetgenb.i0.delta_r(jetgenb.i1) < 1.5).sum()==1)&(gen[gen.isb].counts>0)
-            fj['isb']  = bmatch
-        
-            bmatch = ((jetgenb.i0.delta_r(jetgenb.i1) < 1.5).sum()==2)&(gen[gen.isb].counts>0)
-            fj['isbb']  = bmatch
-
-            gen['isc'] = (abs(gen.pdgId)==4)&gen.hasFlags(['fromHardProcess', 'isLastCopy'])
-            jetgenc = fj.sd.cross(gen[gen.isc], nested=True)
-            cmatch = ((jetgenc.i0.delta_r(jetgenc.i1) < 1.5).sum()==1)&(gen[gen.isc].counts>0)
-            fj['isc']  = cmatch
 
-            cmatch = ((jetgenc.i0.delta_r(jetgenc.i1) < 1.5).sum()==2)&(gen[gen.isc].counts>0)
-            fj['iscc']  = cmatch
+            fj['gentype'] = gentype(fj, gen, self._gentype_map)
 
             gen['isTop'] = (abs(gen.pdgId)==6)&gen.hasFlags(['fromHardProcess', 'isLastCopy'])
             genTops = gen[gen.isTop]
@@ -982,20 +749,11 @@ class AnalysisProcessor(processor.ProcessorABC):
             gen['R_dyn'] = (91.1876/(gen.pt * np.sqrt(epsilon_0_dyn)))*(gen.isA).astype(np.int) + (-999)*(~gen.isA).astype(np.int)
             gen['R_0_dyn'] = gen.R_dyn*(gen.R_dyn<1.0).astype(np.int) + (gen.R_dyn>=1.0).astype(np.int)
 
-            def isolation(R):
-                hadrons = gen[ #Stable hadrons not in NanoAOD, using quarks/glouns instead
-                    ((abs(gen.pdgId)<=5)|(abs(gen.pdgId)==21)) &
-                    gen.hasFlags(['fromHardProcess', 'isFirstCopy'])
-                ]
-                genhadrons = gen.cross(hadrons, nested=True)
-                hadronic_et = genhadrons.i1[(genhadrons.i0.delta_r(genhadrons.i1) <= R)].pt.sum()
-                return (hadronic_et<=(epsilon_0_dyn * gen.pt * np.power((1 - np.cos(R)) / (1 - np.cos(gen.R_0_dyn)), n_dyn))) | (hadrons.counts==0)
-
-            isIsoA=gen.isA
-            iterations = 5.
-            for i in range(1, int(iterations) + 1):
-                isIsoA=isIsoA&isolation(gen.R_0_dyn*i/iterations)
-            gen['isIsoA']=isIsoA
+            hadrons = ( #Stable hadrons not in NanoAOD, using quarks/glouns instead
+                ((abs(gen.pdgId)<=5)|(abs(gen.pdgId)==21)) &
+                gen.hasFlags(['fromHardProcess', 'isFirstCopy'])
+            )
+            gen['isIsoA'] = dynamic_isolation(gen, gen.isA, hadrons, gen.R_0_dyn, epsilon_0_dyn, n_dyn, iterations=5)
 
             #genWs = gen[gen.isW&(gen.pt>=100)]
             genWs = gen[gen.isW] 
@@ -1003,6 +761,7 @@ class AnalysisProcessor(processor.ProcessorABC):
             genDYs = gen[gen.isZ&(gen.mass>30)]
             genIsoAs = gen[gen.isIsoA] 
 
+            profile.start('weights')
             nnlo_nlo = {}
             nlo_qcd = np.ones(events.size)
             nlo_ewk = np.ones(events.size)
@@ -1040,34 +799,7 @@ class AnalysisProcessor(processor.ProcessorABC):
             pu = get_pu_weight(events.Pileup.nTrueInt)
 
             ###
-            # Trigger efficiency weight
-            ###
-
-            e1sf = get_ele_trig_weight(leading_ele_pair.i0.eta.sum()+leading_ele_pair.i0.deltaEtaSC.sum(),leading_ele_pair.i0.pt.sum())*(leading_ele_pair.i0.pt.sum()>40).astype(np.int)
-            e2sf = get_ele_trig_weight(leading_ele_pair.i1.eta.sum()+leading_ele_pair.i1.deltaEtaSC.sum(),leading_ele_pair.i1.pt.sum())*(leading_ele_pair.i1.pt.sum()>40).astype(np.int)
-
-            if self._year == '2016':
-                sf =  get_pho_trig_weight(leading_pho.pt.sum())
-            elif self._year == '2017': #Sigmoid used for 2017 and 2018, values from monojet
-                sf = sigmoid(leading_pho.pt.sum(),0.335,217.91,0.065,0.996) / sigmoid(leading_pho.pt.sum(),0.244,212.34,0.050,1.000)
-                sf[np.isnan(sf) | np.isinf(sf)] == 1
-            elif self._year == '2018':
-                sf = sigmoid(leading_pho.pt.sum(),1.022, 218.39, 0.086, 0.999) / sigmoid(leading_pho.pt.sum(), 0.301,212.83,0.062,1.000)
-                sf[np.isnan(sf) | np.isinf(sf)] == 1
-
-            trig = {
-                'sr':   get_met_trig_weight(met.pt),
-                'wmcr': get_met_trig_weight(u['wmcr'].mag),
-                'tmcr': get_met_trig_weight(u['tmcr'].mag),
-                'zmcr': get_met_zmm_trig_weight(u['zmcr'].mag),
-                'wecr': get_ele_trig_weight(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(), leading_e.pt.sum()),
-                'tecr': get_ele_trig_weight(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(), leading_e.pt.sum()),
-                'zecr': 1 - (1 - e1sf)*(1 - e2sf),
-                'gcr':  sf
-            }
-
-            ### 
-            # Calculating electron and muon ID weights
+            # Electron and muon SFs, all the ones of a lepton from a single lookup
             ###
 
             mueta = abs(leading_mu.eta.sum())
@@ -1077,21 +809,68 @@ class AnalysisProcessor(processor.ProcessorABC):
                 mueta=leading_mu.eta.sum()
                 mu1eta=leading_mu_pair.i0.eta.sum()
                 mu2eta=leading_mu_pair.i1.eta.sum()
-            if self._year=='2016':
-                sf = get_pho_tight_id_sf(leading_pho.eta.sum(),leading_pho.pt.sum())
-            else: #2017/2018 monojet measurement depends only on abs(eta)
-                sf = get_pho_tight_id_sf(abs(leading_pho.eta.sum()))
-
-            ids ={
-                'sr':  np.ones(events.size),
-                'wmcr': get_mu_tight_id_sf(mueta,leading_mu.pt.sum()),
-                'tmcr': get_mu_tight_id_sf(mueta,leading_mu.pt.sum()),
-                'zmcr': get_mu_loose_id_sf(mu1eta,leading_mu_pair.i0.pt.sum()) * get_mu_loose_id_sf(mu2eta,leading_mu_pair.i1.pt.sum()),
-                'wecr': get_ele_tight_id_sf(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(),leading_e.pt.sum()),
-                'tecr': get_ele_tight_id_sf(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(),leading_e.pt.sum()),
-                'zecr': get_ele_loose_id_sf(leading_ele_pair.i0.eta.sum()+leading_ele_pair.i0.deltaEtaSC.sum(),leading_ele_pair.i0.pt.sum()) * get_ele_loose_id_sf(leading_ele_pair.i1.eta.sum()+leading_ele_pair.i1.deltaEtaSC.sum(),leading_ele_pair.i1.pt.sum()),
-                'gcr':  sf
-            }
+
+            lepton_sf = LazyDict({
+                'e':   lambda: get_ele_sf(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(), leading_e.pt.sum()),
+                'e1':  lambda: get_ele_sf(leading_ele_pair.i0.eta.sum()+leading_ele_pair.i0.deltaEtaSC.sum(), leading_ele_pair.i0.pt.sum()),
+                'e2':  lambda: get_ele_sf(leading_ele_pair.i1.eta.sum()+leading_ele_pair.i1.deltaEtaSC.sum(), leading_ele_pair.i1.pt.sum()),
+                'mu':  lambda: get_mu_sf(mueta, leading_mu.pt.sum()),
+                'mu1': lambda: get_mu_sf(mu1eta, leading_mu_pair.i0.pt.sum()),
+                'mu2': lambda: get_mu_sf(mu2eta, leading_mu_pair.i1.pt.sum())
+            })
+
+            ###
+            # Trigger efficiency weight
+            ###
+
+            def zecr_trig():
+                e1sf = lepton_sf['e1']['trig']*(leading_ele_pair.i0.pt.sum()>40).astype(np.int)
+                e2sf = lepton_sf['e2']['trig']*(leading_ele_pair.i1.pt.sum()>40).astype(np.int)
+                return 1 - (1 - e1sf)*(1 - e2sf)
+
+            def gcr_trig():
+                if self._year == '2016':
+                    sf =  get_pho_trig_weight(leading_pho.pt.sum())
+                elif self._year == '2017': #Sigmoid used for 2017 and 2018, values from monojet
+                    sf = sigmoid(leading_pho.pt.sum(),0.335,217.91,0.065,0.996) / sigmoid(leading_pho.pt.sum(),0.244,212.34,0.050,1.000)
+                    sf[np.isnan(sf) | np.isinf(sf)] == 1
+                elif self._year == '2018':
+                    sf = sigmoid(leading_pho.pt.sum(),1.022, 218.39, 0.086, 0.999) / sigmoid(leading_pho.pt.sum(), 0.301,212.83,0.062,1.000)
+                    sf[np.isnan(sf) | np.isinf(sf)] == 1
+                return sf
+
+            trig = LazyDict({
+                'sr':   lambda: get_met_trig_weight(met.pt),
+                'wmcr': lambda: get_met_trig_weight(u['wmcr'].mag),
+                'tmcr': lambda: get_met_trig_weight(u['tmcr'].mag),
+                'zmcr': lambda: get_met_zmm_trig_weight(u['zmcr'].mag),
+                'wecr': lambda: lepton_sf['e']['trig'],
+                'tecr': lambda: lepton_sf['e']['trig'],
+                'zecr': zecr_trig,
+                'gcr':  gcr_trig
+            })
+
+            ### 
+            # Calculating electron and muon ID weights
+            ###
+
+
+            def gcr_id():
+                if self._year=='2016':
+                    return get_pho_tight_id_sf(leading_pho.eta.sum(),leading_pho.pt.sum())
+                else: #2017/2018 monojet measurement depends only on abs(eta)
+                    return get_pho_tight_id_sf(abs(leading_pho.eta.sum()))
+
+            ids = LazyDict({
+                'sr':  lambda: np.ones(events.size),
+                'wmcr': lambda: lepton_sf['mu']['tight_id'],
+                'tmcr': lambda: lepton_sf['mu']['tight_id'],
+                'zmcr': lambda: lepton_sf['mu1']['loose_id'] * lepton_sf['mu2']['loose_id'],
+                'wecr': lambda: lepton_sf['e']['tight_id'],
+                'tecr': lambda: lepton_sf['e']['tight_id'],
+                'zecr': lambda: lepton_sf['e1']['loose_id'] * lepton_sf['e2']['loose_id'],
+                'gcr':  gcr_id
+            })
 
             ###
             # Reconstruction weights for electrons
@@ -1100,60 +879,57 @@ class AnalysisProcessor(processor.ProcessorABC):
             def ele_reco_sf(pt, eta):#2017 has separate weights for low/high pT (threshold at 20 GeV)
                 return get_ele_reco_sf(eta, pt)*(pt>20).astype(np.int) + get_ele_reco_lowet_sf(eta, pt)*(~(pt>20)).astype(np.int)
 
-            if self._year == '2017':
-                sf = ele_reco_sf
-            else:
-                sf = get_ele_reco_sf
-
-            reco = {
-                'sr': np.ones(events.size),
-                'wmcr': np.ones(events.size),
-                'tmcr': np.ones(events.size),
-                'zmcr': np.ones(events.size),
-                'wecr': sf(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(),leading_e.pt.sum()),
-                'tecr': sf(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(),leading_e.pt.sum()),
-                'zecr': sf(leading_ele_pair.i0.eta.sum()+leading_ele_pair.i0.deltaEtaSC.sum(),leading_ele_pair.i0.pt.sum()) * sf(leading_ele_pair.i1.eta.sum()+leading_ele_pair.i1.deltaEtaSC.sum(),leading_ele_pair.i1.pt.sum()),
-                'gcr': np.ones(events.size)
-            }
+            reco = LazyDict({
+                'sr': lambda: np.ones(events.size),
+                'wmcr': lambda: np.ones(events.size),
+                'tmcr': lambda: np.ones(events.size),
+                'zmcr': lambda: np.ones(events.size),
+                'wecr': lambda: lepton_sf['e']['reco'] if self._year != '2017' else ele_reco_sf(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(),leading_e.pt.sum()),
+                'tecr': lambda: lepton_sf['e']['reco'] if self._year != '2017' else ele_reco_sf(leading_e.eta.sum()+leading_e.deltaEtaSC.sum(),leading_e.pt.sum()),
+                'zecr': lambda: lepton_sf['e1']['reco'] * lepton_sf['e2']['reco'] if self._year != '2017' else ele_reco_sf(leading_ele_pair.i0.eta.sum()+leading_ele_pair.i0.deltaEtaSC.sum(),leading_ele_pair.i0.pt.sum()) * ele_reco_sf(leading_ele_pair.i1.eta.sum()+leading_ele_pair.i1.deltaEtaSC.sum(),leading_ele_pair.i1.pt.sum()),
+                'gcr': lambda: np.ones(events.size)
+            })
 
             ###
             # Isolation weights for muons
             ###
 
-            isolation = {
-                'sr'  : np.ones(events.size),
-                'wmcr': get_mu_tight_iso_sf(mueta,leading_mu.pt.sum()),
-                'tmcr': get_mu_tight_iso_sf(mueta,leading_mu.pt.sum()),
-                'zmcr': get_mu_loose_iso_sf(mu1eta,leading_mu_pair.i0.pt.sum()) * get_mu_loose_iso_sf(mu2eta,leading_mu_pair.i1.pt.sum()),
-                'wecr': np.ones(events.size),
-                'tecr': np.ones(events.size),
-                'zecr': np.ones(events.size),
-                'gcr':  np.ones(events.size)
-            }
+            isolation = LazyDict({
+                'sr'  : lambda: np.ones(events.size),
+                'wmcr': lambda: lepton_sf['mu']['tight_iso'],
+                'tmcr': lambda: lepton_sf['mu']['tight_iso'],
+                'zmcr': lambda: lepton_sf['mu1']['loose_iso'] * lepton_sf['mu2']['loose_iso'],
+                'wecr': lambda: np.ones(events.size),
+                'tecr': lambda: np.ones(events.size),
+                'zecr': lambda: np.ones(events.size),
+                'gcr':  lambda: np.ones(events.size)
+            })
 
             ###
             # CSEV weight for photons: https://twiki.cern.ch/twiki/bin/view/CMS/EgammaIDRecipesRun2#Electron_Veto_CSEV_or_pixel_seed
             ###
 
-            if self._year == '2016':
-                csev_weight = get_pho_csev_sf(abs(leading_pho.eta.sum()), leading_pho.pt.sum())
-            elif self._year == '2017':
-                csev_sf_index = 0.5*(leading_pho.isScEtaEB.sum()).astype(np.int)+3.5*(~(leading_pho.isScEtaEB.sum())).astype(np.int)+1*(leading_pho.r9.sum()>0.94).astype(np.int)+2*(leading_pho.r9.sum()<=0.94).astype(np.int)
-                csev_weight = get_pho_csev_sf(csev_sf_index)
-            elif self._year == '2018':
-                csev_weight = get_pho_csev_sf(leading_pho.pt.sum(), abs(leading_pho.eta.sum()))
-            csev_weight[csev_weight==0] = 1
-
-            csev = {
-                'sr'  : np.ones(events.size),
-                'wmcr': np.ones(events.size),
-                'tmcr': np.ones(events.size),
-                'zmcr': np.ones(events.size),
-                'wecr': np.ones(events.size),
-                'tecr': np.ones(events.size),
-                'zecr': np.ones(events.size),
-                'gcr':  csev_weight
-            }
+            def gcr_csev():
+                if self._year == '2016':
+                    csev_weight = get_pho_csev_sf(abs(leading_pho.eta.sum()), leading_pho.pt.sum())
+                elif self._year == '2017':
+                    csev_sf_index = 0.5*(leading_pho.isScEtaEB.sum()).astype(np.int)+3.5*(~(leading_pho.isScEtaEB.sum())).astype(np.int)+1*(leading_pho.r9.sum()>0.94).astype(np.int)+2*(leading_pho.r9.sum()<=0.94).astype(np.int)
+                    csev_weight = get_pho_csev_sf(csev_sf_index)
+                elif self._year == '2018':
+                    csev_weight = get_pho_csev_sf(leading_pho.pt.sum(), abs(leading_pho.eta.sum()))
+                csev_weight[csev_weight==0] = 1
+                return csev_weight
+
+            csev = LazyDict({
+                'sr'  : lambda: np.ones(events.size),
+                'wmcr': lambda: np.ones(events.size),
+                'tmcr': lambda: np.ones(events.size),
+                'zmcr': lambda: np.ones(events.size),
+                'wecr': lambda: np.ones(events.size),
+                'tecr': lambda: np.ones(events.size),
+                'zecr': lambda: np.ones(events.size),
+                'gcr':  gcr_csev
+            })
 
             ###
             # AK4 b-tagging weights
@@ -1162,15 +938,17 @@ class AnalysisProcessor(processor.ProcessorABC):
             btag = {}
             btagUp = {}
             btagDown = {}
-            btag['sr'],   btagUp['sr'],   btagDown['sr']   = get_deepflav_weight['loose'](j_iso.pt,j_iso.eta,j_iso.hadronFlavour,'0')
-            btag['wmcr'], btagUp['wmcr'], btagDown['wmcr'] = get_deepflav_weight['loose'](j_iso.pt,j_iso.eta,j_iso.hadronFlavour,'0')
-            btag['tmcr'], btagUp['tmcr'], btagDown['tmcr'] = get_deepflav_weight['loose'](j_iso.pt,j_iso.eta,j_iso.hadronFlavour,'-1')
-            btag['wecr'], btagUp['wecr'], btagDown['wecr'] = get_deepflav_weight['loose'](j_iso.pt,j_iso.eta,j_iso.hadronFlavour,'0')
-            btag['tecr'], btagUp['tecr'], btagDown['tecr'] = get_deepflav_weight['loose'](j_iso.pt,j_iso.eta,j_iso.hadronFlavour,'-1')
+            btag_weights = get_deepflav_weight['loose'](j_iso.pt,j_iso.eta,j_iso.hadronFlavour)
+            btag['sr'],   btagUp['sr'],   btagDown['sr']   = btag_weights['0']
+            btag['wmcr'], btagUp['wmcr'], btagDown['wmcr'] = btag_weights['0']
+            btag['tmcr'], btagUp['tmcr'], btagDown['tmcr'] = btag_weights['-1']
+            btag['wecr'], btagUp['wecr'], btagDown['wecr'] = btag_weights['0']
+            btag['tecr'], btagUp['tecr'], btagDown['tecr'] = btag_weights['-1']
             btag['zmcr'], btagUp['zmcr'], btagDown['zmcr'] = np.ones(events.size), np.ones(events.size), np.ones(events.size)
             btag['zecr'], btagUp['zecr'], btagDown['zecr'] = np.ones(events.size), np.ones(events.size), np.ones(events.size)
             btag['gcr'],  btagUp['gcr'],  btagDown['gcr']  = np.ones(events.size), np.ones(events.size), np.ones(events.size)
 
+        profile.start('selection')
         ###
         # Selections
         ###
@@ -1238,36 +1016,56 @@ class AnalysisProcessor(processor.ProcessorABC):
             'gcr': ['isoneA','fatjet','noHEMj','met_filters','singlephoton_triggers']
         }
 
-        isFilled = False
+        cache = ChunkCache()
+        fjmass = cache.get('fjmass', leading_fj.msd_corr.sum)
+        ZHbbvsQCD = cache.get('ZHbbvsQCD', leading_fj.ZHbbvsQCD.sum)
+        mindphimet = cache.get('mindphimet', lambda: abs(met.T.delta_phi(j_clean.T)).min())
+        minDphimet = cache.get('minDphimet', lambda: abs(met.T.delta_phi(fj_clean.T)).min())
 
-        #for region in selected_regions: 
-        for region, cuts in regions.items():
-            if region not in selected_regions: continue
-            print('Considering region:', region)
+        isFilled = False
 
-            ###
-            # Adding recoil and minDPhi requirements
-            ###
+        ###
+        # Adding recoil and minDPhi requirements
+        ###
 
-            selection.add('recoil_'+region, (u[region].mag>250))
-            selection.add('mindphi_'+region, (abs(u[region].delta_phi(j_clean.T)).min()>0.5))
-            selection.add('minDphi_'+region, (abs(u[region].delta_phi(fj_clean.T)).min()>1.5))
-            selection.add('calo_'+region, ( (abs(calomet.pt - met.pt) / u[region].mag) < 0.5))
+        for region in regions:
+            if region not in selected_regions: continue
+            recoil = cache.get('recoil', lambda: u[region].mag, region)
+            mindphirecoil = cache.get('mindphirecoil', lambda: abs(u[region].delta_phi(j_clean.T)).min(), region)
+            minDphirecoil = cache.get('minDphirecoil', lambda: abs(u[region].delta_phi(fj_clean.T)).min(), region)
+            caloMinusPfOverRecoil = cache.get('CaloMinusPfOverRecoil', lambda: abs(calomet.pt - met.pt) / recoil, region)
+            selection.add('recoil_'+region, (recoil>250))
+            selection.add('mindphi_'+region, (mindphirecoil>0.5))
+            selection.add('minDphi_'+region, (minDphirecoil>1.5))
+            selection.add('calo_'+region, (caloMinusPfOverRecoil < 0.5))
             #regions[region].update({'recoil_'+region,'mindphi_'+region})
             regions[region].insert(0, 'recoil_'+region)
             regions[region].insert(3, 'mindphi_'+region)
             regions[region].insert(4, 'minDphi_'+region)
             regions[region].insert(5, 'calo_'+region)
+        region_masks = RegionMasks(selection, {region: regions[region] for region in regions if region in selected_regions})
+
+        profile.start('fills')
+        #for region in selected_regions: 
+        for region, cuts in regions.items():
+            if region not in selected_regions: continue
+            print('Considering region:', region)
+
+            recoil = cache.get('recoil', lambda: u[region].mag, region)
+            mindphirecoil = cache.get('mindphirecoil', lambda: abs(u[region].delta_phi(j_clean.T)).min(), region)
+            minDphirecoil = cache.get('minDphirecoil', lambda: abs(u[region].delta_phi(fj_clean.T)).min(), region)
+            caloMinusPfOverRecoil = cache.get('CaloMinusPfOverRecoil', lambda: abs(calomet.pt - met.pt) / recoil, region)
             print('Selection:',regions[region])
+            masks = region_masks.cumulative(region)
             variables = {
-                'recoil':                 u[region].mag,
-                'mindphirecoil':          abs(u[region].delta_phi(j_clean.T)).min(),
-                'minDphirecoil':          abs(u[region].delta_phi(fj_clean.T)).min(),
-                'CaloMinusPfOverRecoil':  abs(calomet.pt - met.pt) / u[region].mag,
+                'recoil':                 recoil,
+                'mindphirecoil':          mindphirecoil,
+                'minDphirecoil':          minDphirecoil,
+                'CaloMinusPfOverRecoil':  caloMinusPfOverRecoil,
                 'met':                    met.pt,
                 'metphi':                 met.phi,
-                'mindphimet':             abs(met.T.delta_phi(j_clean.T)).min(),
-                'minDphimet':             abs(met.T.delta_phi(fj_clean.T)).min(),
+                'mindphimet':             mindphimet,
+                'minDphimet':             minDphimet,
                 'j1pt':                   leading_j.pt,
                 'j1eta':                  leading_j.eta,
                 'j1phi':                  leading_j.phi,
@@ -1302,6 +1100,7 @@ class AnalysisProcessor(processor.ProcessorABC):
                 variables['l1phi']     = leading_pho.phi
                 variables['l1eta']     = leading_pho.eta
             print('Variables:',variables.keys())
+            skim.variables(region, variables)
 
             def fill(dataset, gentype, weight, cut):
 
@@ -1330,18 +1129,18 @@ class AnalysisProcessor(processor.ProcessorABC):
                 if not isFilled:
                     hout['sumw'].fill(dataset=dataset, sumw=1, weight=1)
                     isFilled=True
-                cut = selection.all(*regions[region])
+                cut = masks[-1]
                 hout['template'].fill(dataset=dataset,
                                       region=region,
                                       systematic='nominal',
                                       gentype=np.zeros(events.size, dtype=np.int),
-                                      recoil=u[region].mag,
-                                      fjmass=leading_fj.msd_corr.sum(),
-                                      ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
+                                      recoil=recoil,
+                                      fjmass=fjmass,
+                                      ZHbbvsQCD=ZHbbvsQCD,
                                       weight=np.ones(events.size)*cut)
                 fill(dataset, np.zeros(events.size, dtype=np.int), np.ones(events.size), cut)
             else:
-                weights = processor.Weights(len(events))
+                weights = processor.Weights(len(events), storeIndividual=self._skim)
                 if 'L1PreFiringWeight' in events.columns: weights.add('prefiring',events.L1PreFiringWeight.Nom)
                 weights.add('genw',events.genWeight)
                 weights.add('nlo_qcd',nlo_qcd)
@@ -1368,113 +1167,11 @@ class AnalysisProcessor(processor.ProcessorABC):
                 weights.add('isolation', isolation[region])
                 weights.add('csev', csev[region])
                 weights.add('btag',btag[region], btagUp[region], btagDown[region])
+                wnom = cache.get('weight', weights.weight, region)
+                skim.weights(region, weights)
 
-                wgentype = {
-                    'xbb' : (
-                        (leading_fj.isHsbb | leading_fj.isHbb | leading_fj.isZbb)
-                    ).sum(),
-                    'tbcq' : (
-                        ~(leading_fj.isHsbb |leading_fj.isHbb | leading_fj.isZbb)&
-                        leading_fj.isTbcq 
-                    ).sum(),
-                    'tbqq' : (
-                        ~(leading_fj.isHsbb |leading_fj.isHbb | leading_fj.isZbb)&
-                        ~leading_fj.isTbcq &
-                        leading_fj.isTbqq 
-                    ).sum(),
-                    'zcc' : (
-                        ~(leading_fj.isHsbb |leading_fj.isHbb | leading_fj.isZbb)&
-                        ~leading_fj.isTbcq &
-                        ~leading_fj.isTbqq &
-                        leading_fj.isZcc
-                    ).sum(),
-                    'wcq' : (
-                        ~(leading_fj.isHsbb |leading_fj.isHbb | leading_fj.isZbb)&
-                        ~leading_fj.isTbcq &
-                        ~leading_fj.isTbqq &
-                        ~leading_fj.isZcc &
-                        (leading_fj.isTcq | leading_fj.isWcq)
-                    ).sum(),
-                    'vqq' : (
-                        ~(leading_fj.isHsbb |leading_fj.isHbb | leading_fj.isZbb)&
-                        ~leading_fj.isTbcq &
-                        ~leading_fj.isTbqq &
-                        ~leading_fj.isZcc &
-                        ~(leading_fj.isTcq | leading_fj.isWcq) &
-                        (leading_fj.isWqq | leading_fj.isZqq | leading_fj.isTqq)
-                    ).sum(),
-                    'bb' : (
-                        ~(leading_fj.isHsbb | leading_fj.isHbb | leading_fj.isZbb)&
-                        ~leading_fj.isTbcq &
-                        ~leading_fj.isTbqq &
-                        ~leading_fj.isZcc &
-                        ~(leading_fj.isTcq | leading_fj.isWcq) &
-                        ~(leading_fj.isWqq | leading_fj.isZqq | leading_fj.isTqq) &
-                        leading_fj.isbb
-                    ).sum(),
-                    'bc' : (
-                        ~(leading_fj.isHsbb | leading_fj.isHbb | leading_fj.isZbb)&
-                        ~leading_fj.isTbcq &
-                        ~leading_fj.isTbqq &
-                        ~leading_fj.isZcc &
-                        ~(leading_fj.isTcq | leading_fj.isWcq) &
-                        ~(leading_fj.isWqq | leading_fj.isZqq | leading_fj.isTqq) &
-                        ~leading_fj.isbb &
-                        (leading_fj.isTbc | (leading_fj.isb & leading_fj.isc))
-                    ).sum(),
-                    'b' : (
-                        ~(leading_fj.isHsbb | leading_fj.isHbb | leading_fj.isZbb)&
-                        ~leading_fj.isTbcq &
-                        ~leading_fj.isTbqq &
-                        ~leading_fj.isZcc &
-                        ~(leading_fj.isTcq | leading_fj.isWcq) &
-                        ~(leading_fj.isWqq | leading_fj.isZqq | leading_fj.isTqq) &
-                        ~leading_fj.isbb &
-                        ~(leading_fj.isTbc | (leading_fj.isb & leading_fj.isc)) &
-                        (leading_fj.isTbq | leading_fj.isb)
-                    ).sum(),
-                    'cc' : (
-                        ~(leading_fj.isHsbb | leading_fj.isHbb | leading_fj.isZbb)&
-                        ~leading_fj.isTbcq &
-                        ~leading_fj.isTbqq &
-                        ~leading_fj.isZcc &
-                        ~(leading_fj.isTcq | leading_fj.isWcq) &
-                        ~(leading_fj.isWqq | leading_fj.isZqq | leading_fj.isTqq) &
-                        ~leading_fj.isbb &
-                        ~(leading_fj.isTbc | (leading_fj.isb & leading_fj.isc)) &
-                        ~(leading_fj.isTbq | leading_fj.isb) &
-                        leading_fj.iscc
-                    ).sum(),
-                    'c' : (
-                        ~(leading_fj.isHsbb | leading_fj.isHbb | leading_fj.isZbb)&
-                        ~leading_fj.isTbcq &
-                        ~leading_fj.isTbqq &
-                        ~leading_fj.isZcc &
-                        ~(leading_fj.isTcq | leading_fj.isWcq) &
-                        ~(leading_fj.isWqq | leading_fj.isZqq | leading_fj.isTqq) &
-                        ~leading_fj.isbb &
-                        ~(leading_fj.isTbc | (leading_fj.isb & leading_fj.isc)) &
-                        ~(leading_fj.isTbq | leading_fj.isb) &
-                        ~leading_fj.iscc &
-                        leading_fj.isc
-                    ).sum(),
-                    'other' : (
-                        ~(leading_fj.isHsbb | leading_fj.isHbb | leading_fj.isZbb)&
-                        ~leading_fj.isTbcq &
-                        ~leading_fj.isTbqq &
-                        ~leading_fj.isZcc &
-                        ~(leading_fj.isTcq | leading_fj.isWcq) &
-                        ~(leading_fj.isWqq | leading_fj.isZqq | leading_fj.isTqq) &
-                        ~leading_fj.isbb &
-                        ~(leading_fj.isTbc | (leading_fj.isb & leading_fj.isc)) &
-                        ~(leading_fj.isTbq | leading_fj.isb) &
-                        ~leading_fj.iscc &
-                        ~leading_fj.isc
-                    ).sum(),
-                }
-                vgentype=np.zeros(events.size, dtype=np.int)
-                for gentype in self._gentype_map.keys():
-                    vgentype += self._gentype_map[gentype]*wgentype[gentype]
+                vgentype = leading_fj.gentype.sum()
+                skim.add('gentype', vgentype)
 
                 if 'WJets' in dataset or 'ZJets' in dataset or 'DY' in dataset or 'GJets' in dataset:
                     if not isFilled:
@@ -1483,98 +1180,61 @@ class AnalysisProcessor(processor.ProcessorABC):
                         isFilled=True
                     whf = ((gen[gen.isb].counts>0)|(gen[gen.isc].counts>0)).astype(np.int)
                     wlf = (~(whf.astype(np.bool))).astype(np.int)
-                    cut = selection.all(*regions[region])
-                    systematics = [None,
-                                   'btagUp',
-                                   'btagDown',
-                                   'qcd1Up',
-                                   'qcd1Down',
-                                   'qcd2Up',
-                                   'qcd2Down',
-                                   'qcd3Up',
-                                   'qcd3Down',
-                                   'muFUp',
-                                   'muFDown',
-                                   'muRUp',
-                                   'muRDown',
-                                   'ew1Up',
-                                   'ew1Down',
-                                   'ew2GUp',
-                                   'ew2GDown',
-                                   'ew2WUp',
-                                   'ew2WDown',
-                                   'ew2ZUp',
-                                   'ew2ZDown',
-                                   'ew3GUp',
-                                   'ew3GDown',
-                                   'ew3WUp',
-                                   'ew3WDown',
-                                   'ew3ZUp',
-                                   'ew3ZDown',
-                                   'mixUp',
-                                   'mixDown']
-                    for systematic in systematics:
-                        sname = 'nominal' if systematic is None else systematic
-                        hout['template'].fill(dataset='HF--'+dataset,
-                                              region=region,
-                                              systematic=sname,
-                                              gentype=vgentype,
-                                              recoil=u[region].mag,
-                                              fjmass=leading_fj.msd_corr.sum(),
-                                              ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
-                                              weight=weights.weight(modifier=systematic)*whf*cut)
-                        hout['template'].fill(dataset='LF--'+dataset,
-                                              region=region,
-                                              systematic=sname,
-                                              gentype=vgentype,
-                                              recoil=u[region].mag,
-                                              fjmass=leading_fj.msd_corr.sum(),
-                                              ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
-                                              weight=weights.weight(modifier=systematic)*wlf*cut)
+                    skim.add('hf', whf)
+                    cut = masks[-1]
+                    sel = cut.astype(np.bool)
+                    systematics = ['nominal' if systematic is None else systematic for systematic in self._systematics]
+                    index = hout['template'].index(gentype=vgentype[sel],
+                                                   recoil=recoil[sel],
+                                                   fjmass=fjmass[sel],
+                                                   ZHbbvsQCD=ZHbbvsQCD[sel])
+                    wsys = np.stack([weights.weight(modifier=systematic)[sel] for systematic in self._systematics])
+                    ishf = whf[sel].astype(np.bool)
+                    hout['template'].fill_systematics('systematic', systematics, wsys[:,ishf], index=index[ishf],
+                                                      dataset='HF--'+dataset, region=region)
+                    hout['template'].fill_systematics('systematic', systematics, wsys[:,~ishf], index=index[~ishf],
+                                                      dataset='LF--'+dataset, region=region)
 
                     ## Cutflow loop
                     vcut=np.zeros(events.size, dtype=np.int)
-                    hout['cutflow'].fill(dataset='HF--'+dataset, region=region, cut=vcut, weight=weights.weight()*whf)
-                    hout['cutflow'].fill(dataset='LF--'+dataset, region=region, cut=vcut, weight=weights.weight()*wlf)
-                    allcuts = set()
-                    for i, icut in enumerate(cuts):
-                        allcuts.add(icut)
-                        jcut = selection.all(*allcuts)
+                    hout['cutflow'].fill(dataset='HF--'+dataset, region=region, cut=vcut, weight=wnom*whf)
+                    hout['cutflow'].fill(dataset='LF--'+dataset, region=region, cut=vcut, weight=wnom*wlf)
+                    for i, jcut in enumerate(masks):
                         vcut = (i+1)*jcut
-                        hout['cutflow'].fill(dataset='HF--'+dataset, region=region, cut=vcut, weight=weights.weight()*jcut*whf)
-                        hout['cutflow'].fill(dataset='LF--'+dataset, region=region, cut=vcut, weight=weights.weight()*jcut*wlf)
+                        hout['cutflow'].fill(dataset='HF--'+dataset, region=region, cut=vcut, weight=wnom*jcut*whf)
+                        hout['cutflow'].fill(dataset='LF--'+dataset, region=region, cut=vcut, weight=wnom*jcut*wlf)
 
-                    fill('HF--'+dataset, vgentype, weights.weight()*whf, cut)
-                    fill('LF--'+dataset, vgentype, weights.weight()*wlf, cut)
+                    fill('HF--'+dataset, vgentype, wnom*whf, cut)
+                    fill('LF--'+dataset, vgentype, wnom*wlf, cut)
                 else:
                     if not isFilled:
                         hout['sumw'].fill(dataset=dataset, sumw=1, weight=events.genWeight.sum())
                         isFilled=True
-                    cut = selection.all(*regions[region])
-                    for systematic in [None, 'btagUp', 'btagDown']:
-                        sname = 'nominal' if systematic is None else systematic
-                        hout['template'].fill(dataset=dataset,
-                                              region=region,
-                                              systematic=sname,
-                                              gentype=vgentype,
-                                              recoil=u[region].mag,
-                                              fjmass=leading_fj.msd_corr.sum(),
-                                              ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
-                                              #TvsQCD=leading_fj.TvsQCD.sum(),
-                                              #XvsQCD=leading_fj.XvsQCD.sum(),
-                                              weight=weights.weight(modifier=systematic)*cut)
+                    cut = masks[-1]
+                    sel = cut.astype(np.bool)
+                    index = hout['template'].index(gentype=vgentype[sel],
+                                                   recoil=recoil[sel],
+                                                   fjmass=fjmass[sel],
+                                                   ZHbbvsQCD=ZHbbvsQCD[sel])
+                    wsys = np.stack([weights.weight(modifier=systematic)[sel] for systematic in [None, 'btagUp', 'btagDown']])
+                    hout['template'].fill_systematics('systematic', ['nominal', 'btagUp', 'btagDown'], wsys, index=index,
+                                                      dataset=dataset, region=region)
                     ## Cutflow loop
                     vcut=np.zeros(events.size, dtype=np.int)
-                    hout['cutflow'].fill(dataset=dataset, region=region, cut=vcut, weight=weights.weight())
-                    allcuts = set()
-                    for i, icut in enumerate(cuts):
-                        allcuts.add(icut)
-                        jcut = selection.all(*allcuts)
+                    hout['cutflow'].fill(dataset=dataset, region=region, cut=vcut, weight=wnom)
+                    for i, jcut in enumerate(masks):
                         vcut = (i+1)*jcut
-                        hout['cutflow'].fill(dataset=dataset, region=region, cut=vcut, weight=weights.weight()*jcut)
+                        hout['cutflow'].fill(dataset=dataset, region=region, cut=vcut, weight=wnom*jcut)
+
+                    fill(dataset, vgentype, wnom, cut)
 
-                    fill(dataset, vgentype, weights.weight(), cut)
+        if self._skim:
+            keep = np.zeros(events.size, dtype=np.bool)
+            for region in selected_regions:
+                keep |= selection.all('fatjet', 'recoil_'+region)
+            skim.fill(keep, selection, {region: regions[region] for region in selected_regions}, 1 if isData else events.genWeight.sum())
 
+        profile.stop()
         return hout
 
     def postprocess(self, accumulator):
@@ -1589,7 +1249,7 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         for histname, h in accumulator.items():
             if histname == 'sumw': continue
-            if isinstance(h, hist.Hist):
+            if isinstance(h, (hist.Hist, DenseHist)):
                 h.scale(scale, axis='dataset')
 
         return accumulator
@@ -1605,7 +1265,7 @@ if __name__ == '__main__':
         samplefiles = json.load(fin)
         xsec = {k: v['xs'] for k,v in samplefiles.items()}
 
-    corrections = load('data/corrections.coffea')
+    corrections = LazyCorrections('data/corrections', options.year)
     ids         = load('data/ids.coffea')
     common      = load('data/common.coffea')
 
@@ -44,8 +44,17 @@ export PYTHONPATH=$(find ${_CONDOR_SCRATCH_DIR}/site-packages/ -name *.egg |tr '
 export PYTHONWARNINGS="ignore"
 echo "Updated python path: " $PYTHONPATH
 cd analysis
+if ls ${_CONDOR_SCRATCH_DIR}/*.futures >/dev/null 2>&1; then
+    mkdir -p ${1}
+    mv ${_CONDOR_SCRATCH_DIR}/*.futures ${1}/
+fi
 ls
-echo "python reduce.py --folder ${1} --variable ${2} --dataset ${3}"
-python reduce.py --folder ${1} --variable ${2} --dataset ${3}
-ls ${1}/${2}--${3}.reduced
-cp ${1}/${2}--${3}.reduced ${_CONDOR_SCRATCH_DIR}/${2}_${3}.reduced
+echo "python reduce.py --folder ${1} --variable ${2} --dataset ${3} --no-manifest"
+python reduce.py --folder ${1} --variable ${2} --dataset ${3} --no-manifest
+if [ -f ${1}/${2}--${3}.reduced ]; then
+    ls ${1}/${2}--${3}.reduced
+    cp ${1}/${2}--${3}.reduced ${_CONDOR_SCRATCH_DIR}/${2}_${3}.reduced
+else
+    echo "No ${2} histograms for ${3}, returning an empty ${2}_${3}.reduced"
+    touch ${_CONDOR_SCRATCH_DIR}/${2}_${3}.reduced
+fi
@@ -13,7 +13,7 @@ from optparse import OptionParser
 import uproot, uproot_methods
 import numpy as np
 from coffea import hist
-from coffea.util import load
+from helpers.futures import futures_keys
 
 parser = OptionParser()
 parser.add_option('-d', '--dataset', help='dataset', dest='dataset', default='')
@@ -33,6 +33,8 @@ if options.tar:
               '--exclude=\'analysis/results\' '
               '--exclude=\'analysis/hists/*/*.reduced\' '
               '--exclude=\'analysis/hists/*/*.merged\' '
+              '--exclude=\'analysis/hists/*/*.aggregated\' '
+              '--exclude=\'analysis/hists/*/.manifest\' '
               '../../decaf')
     os.system('tar --exclude-caches-all --exclude-vcs -czvf ../../pylocal.tgz -C ~/.local/lib/python3.6/ site-packages')
 
@@ -89,7 +91,7 @@ for filename in os.listdir(options.folder):
     if filename.split("____")[0] not in pd: pd.append(filename.split("____")[0])
 
 tag=options.folder.split('/')[-1]
-variables=load(options.folder+'/'+futurefile).keys()
+variables=futures_keys(options.folder+'/'+futurefile)
 for pdi in pd:
     if options.dataset:
         if not any(_dataset in pdi for _dataset in options.dataset.split(',')): continue
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+import os
+from optparse import OptionParser
+from coffea.util import load
+from helpers.skim import load_skim, refill
+from helpers.futures import save_futures, load_futures
+
+parser = OptionParser()
+parser.add_option('-p', '--processor', help='processor', dest='processor')
+parser.add_option('-d', '--dataset', help='dataset', dest='dataset', default=None)
+(options, args) = parser.parse_args()
+
+processor_instance=load('data/'+options.processor+'.processor')
+
+folder = 'hists/'+options.processor
+for filename in sorted(os.listdir(folder)):
+    if not filename.endswith('.skim.npz'): continue
+    dataset = filename[:-len('.skim.npz')]
+    if options.dataset:
+        if not any(_dataset in dataset for _dataset in options.dataset.split(',')): continue
+    print('Refilling:',dataset)
+    hout = refill(load_skim(folder+'/'+filename), processor_instance.accumulator.identity(), dataset)
+    processor_instance.postprocess(hout)
+    if os.path.exists(folder+'/'+dataset+'.futures'):
+        hout['cutflow'] = load_futures(folder+'/'+dataset+'.futures', keys=['cutflow'])['cutflow']
+    for key in ['profile', 'skim']:
+        hout.pop(key, None)
+    save_futures(hout, folder+'/'+dataset+'.futures')
@@ -6,6 +6,7 @@ import time
 import cloudpickle
 import gzip
 import os
+import hashlib
 from optparse import OptionParser
 
 import uproot
@@ -13,6 +14,12 @@ import numpy as np
 from coffea import hist, processor
 from coffea.util import load, save
 from coffea.nanoaod.methods import collection_methods, LorentzVector, FatJet 
+from helpers.columns import discover, save_columns, load_columns
+from helpers.executor import run_datasets
+from helpers.chunking import AdaptiveChunker
+from helpers.profile import MODES, table
+from helpers.skim import save_skim
+from helpers.futures import save_futures
 
 collection_methods['AK15Puppi'] = FatJet
 collection_methods['AK15PuppiSubJet'] = LorentzVector
@@ -23,39 +30,89 @@ parser.add_option('-p', '--processor', help='processor', dest='processor')
 parser.add_option('-m', '--metadata', help='metadata', dest='metadata')
 parser.add_option('-d', '--dataset', help='dataset', dest='dataset')
 parser.add_option('-w', '--workers', help='Number of workers to use for multi-worker executors (e.g. futures or condor)', dest='workers', type=int, default=8)
+parser.add_option('-c', '--columns', action='store_true', dest='columns', help='Trace a small chunk of every dataset through the processor and freeze the branches it reads', default=False)
+parser.add_option('-n', '--nevents', help='Number of events per dataset to trace with --columns', dest='nevents', type=int, default=1000)
+parser.add_option('-s', '--single-job', action='store_true', dest='single_job', help='Process all the selected datasets in one worker pool, still saving one output per dataset', default=False)
+parser.add_option('-t', '--target-time', help='Target wall time per chunk in seconds, e.g. 60, 0 keeps the default chunk size', dest='target_time', type=float, default=0.)
+parser.add_option('--memory', help='Memory available to all the workers in MB, as request_memory in run_condor.py', dest='memory', type=float, default=5700.)
+parser.add_option('--profile', type='choice', choices=MODES, dest='profile', help='Profile the stages of the processor per dataset: time prints us/event, memory traces the allocations and prints MB/event', default=None)
+parser.add_option('--ledger-dir', help='Folder for the ledgers, named <processor>_<dataset>.ledger there, instead of hists/<processor>/<dataset>.ledger', dest='ledger_dir', default=None)
+parser.add_option('--skim', action='store_true', dest='skim', help='Also write the per-event quantities of the preselected events to hists/<processor>/<dataset>.skim.npz, see refill.py', default=False)
 (options, args) = parser.parse_args()
 
 processor_instance=load('data/'+options.processor+'.processor')
+columnfile = 'data/'+options.processor+'.columns'
+processor_hash = hashlib.sha1(repr((options.profile, options.skim)).encode())
+for filename in ['data/'+options.processor+'.processor', columnfile]:
+    if os.path.exists(filename):
+        with open(filename, 'rb') as fin:
+            processor_hash.update(fin.read())
+processor_hash = processor_hash.hexdigest()
+if not options.columns and os.path.exists(columnfile):
+    processor_instance._columns = load_columns(columnfile)
+processor_instance._profile = options.profile
+processor_instance._skim = options.skim
 
 fileslice = slice(None)
 with open("metadata/"+options.metadata+".json") as fin:
     samplefiles = json.load(fin)
 
+os.system("mkdir -p hists/"+options.processor)
+chunker = AdaptiveChunker(target_time=options.target_time, memory=options.memory, workers=options.workers) if options.target_time else None
+if options.ledger_dir:
+    ledger = lambda dataset: options.ledger_dir+'/'+options.processor+'_'+dataset+'.ledger'
+else:
+    ledger = lambda dataset: 'hists/'+options.processor+'/'+dataset+'.ledger'
+
+def save_dataset(dataset, output, metrics):
+    if processor_instance.columns:
+        missing = set(metrics['columns']) - set(processor_instance.columns)
+        if missing:
+            print('WARNING:',len(missing),'columns read outside of',columnfile+', rerun with --columns:',' '.join(sorted(missing)))
+    profile = output.pop('profile', None)
+    if options.profile and profile:
+        print('\n'.join(table(profile)))
+        save(profile,'hists/'+options.processor+'/'+dataset+'.profile')
+    skim = output.pop('skim', None)
+    if options.skim and skim:
+        save_skim(skim,'hists/'+options.processor+'/'+dataset+'.skim.npz')
+    save_futures(output,'hists/'+options.processor+'/'+dataset+'.futures')
+
+fileset = {}
 for dataset, info in samplefiles.items():
     filelist = {}
     if options.dataset:
         if not any(_dataset in dataset for _dataset in options.dataset.split(',')): continue
-    print('Processing:',dataset)
     files = []
     for file in info['files'][fileslice]:
         files.append(file)
     filelist[dataset] = files
 
+    if options.columns:
+        print('Tracing:',dataset)
+        columns = discover(processor_instance, files[0], dataset, entrystop=options.nevents)
+        print('Reading',len(columns),'columns')
+        processor_instance._columns |= columns
+        continue
+
+    if options.single_job:
+        fileset.update(filelist)
+        continue
+
+    print('Processing:',dataset)
     tstart = time.time()
-    output = processor.run_uproot_job(filelist,
-                                      treename='Events',
-                                      processor_instance=processor_instance,
-                                      executor=processor.futures_executor,
-                                      executor_args={'nano': True, 'workers': options.workers},
-                                      )
-    
-    #nbins = sum(sum(arr.size for arr in h._sumw.values()) for h in output.values() if isinstance(h, hist.Hist))
-    #nfilled = sum(sum(np.sum(arr > 0) for arr in h._sumw.values()) for h in output.values() if isinstance(h, hist.Hist))
-    #print("Filled %.1fM bins" % (nbins/1e6, ))
-    #print("Nonzero bins: %.1f%%" % (100*nfilled/nbins, ))
-
-    os.system("mkdir -p hists/"+options.processor)
-    save(output,'hists/'+options.processor+'/'+dataset+'.futures')        
+    run_datasets(filelist, processor_instance, save_dataset, workers=options.workers, ledger=ledger, chunker=chunker, processor_hash=processor_hash)
     dt = time.time() - tstart
     nworkers = options.workers
     print("%.2f us*cpu overall" % (1e6*dt*nworkers, ))
+
+if fileset:
+    print('Processing',len(fileset),'datasets in a single job')
+    tstart = time.time()
+    run_datasets(fileset, processor_instance, save_dataset, workers=options.workers, ledger=ledger, chunker=chunker, processor_hash=processor_hash)
+    dt = time.time() - tstart
+    print("%.2f us*cpu overall" % (1e6*dt*options.workers, ))
+
+if options.columns:
+    save_columns(processor_instance.columns, columnfile)
+    print('Saved',len(processor_instance.columns),'columns to',columnfile)
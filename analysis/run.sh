@@ -43,8 +43,14 @@ export PYTHONPATH=$(find ${_CONDOR_SCRATCH_DIR}/site-packages/ -name *.egg |tr '
 export PYTHONWARNINGS="ignore"
 echo "Updated python path: " $PYTHONPATH
 cd analysis
-echo "python run.py --metadata ${1} --dataset ${2} --processor ${3}"
-python run.py --metadata ${1} --dataset ${2} --processor ${3}
-ls hists/${3}/${2}.futures
-cp hists/${3}/${2}.futures ${_CONDOR_SCRATCH_DIR}/${3}_${2}.futures
-
+if [ -f ${_CONDOR_SCRATCH_DIR}/${2}.ledger ]; then
+    mv ${_CONDOR_SCRATCH_DIR}/${2}.ledger ${_CONDOR_SCRATCH_DIR}/${3}_${2}.ledger
+fi
+echo "python run.py --metadata ${1} --dataset ${2} --processor ${3} --ledger-dir ${_CONDOR_SCRATCH_DIR}"
+python run.py --metadata ${1} --dataset ${2} --processor ${3} --ledger-dir ${_CONDOR_SCRATCH_DIR}
+status=$?
+if [ -f hists/${3}/${2}.futures ]; then
+    ls hists/${3}/${2}.futures
+    cp hists/${3}/${2}.futures ${_CONDOR_SCRATCH_DIR}/${3}_${2}.futures
+fi
+exit ${status}
@@ -13,6 +13,8 @@ from optparse import OptionParser
 import uproot, uproot_methods
 import numpy as np
 from coffea import hist
+from coffea.util import load
+from helpers.ledger import drop_stale
 
 parser = OptionParser()
 parser.add_option('-d', '--dataset', help='dataset', dest='dataset', default='')
@@ -22,6 +24,7 @@ parser.add_option('-m', '--metadata', help='metadata', dest='metadata', default=
 parser.add_option('-c', '--cluster', help='cluster', dest='cluster', default='lpc')
 parser.add_option('-t', '--tar', action='store_true', dest='tar')
 parser.add_option('-x', '--copy', action='store_true', dest='copy')
+parser.add_option('-r', '--resubmit-failed', action='store_true', dest='resubmit_failed', help='Only resubmit datasets without output, resuming from their ledgers')
 (options, args) = parser.parse_args()
 
 os.system("mkdir -p hists/"+options.processor)
@@ -34,8 +37,11 @@ if options.tar:
               '--exclude=\'analysis/results\' '
               '--exclude=\'analysis/data/models\' '
               '--exclude=\'analysis/hists/*/*.futures\' '
+              '--exclude=\'analysis/hists/*/*.ledger\' '
               '--exclude=\'analysis/hists/*/*.merged\' '
+              '--exclude=\'analysis/hists/*/*.aggregated\' '
               '--exclude=\'analysis/hists/*/*.reduced\' '
+              '--exclude=\'analysis/hists/*/.manifest\' '
               '../../decaf')
     os.system('tar --exclude-caches-all --exclude-vcs -czvf ../../pylocal.tgz -C ~/.local/lib/python3.6/ site-packages')
 
@@ -50,12 +56,12 @@ if options.cluster == 'kisti':
     jdl = """universe = vanilla
 Executable = run.sh
 Should_Transfer_Files = YES
-WhenToTransferOutput = ON_EXIT
-Transfer_Input_Files = run.sh, /tmp/x509up_u556950957
+WhenToTransferOutput = ON_EXIT_OR_EVICT
+Transfer_Input_Files = run.sh, /tmp/x509up_u556950957$ENV(LEDGER)
 Output = logs/condor/run/out/$ENV(PROCESSOR)_$ENV(SAMPLE)_$(Cluster)_$(Process).stdout
 Error = logs/condor/run/err/$ENV(PROCESSOR)_$ENV(SAMPLE)_$(Cluster)_$(Process).stderr
 Log = logs/condor/run/log/$ENV(PROCESSOR)_$ENV(SAMPLE)_$(Cluster)_$(Process).log
-TransferOutputRemaps = "$ENV(PROCESSOR)_$ENV(SAMPLE).futures=$ENV(PWD)/hists/$ENV(PROCESSOR)/$ENV(SAMPLE).futures"
+TransferOutputRemaps = "$ENV(PROCESSOR)_$ENV(SAMPLE).futures=$ENV(PWD)/hists/$ENV(PROCESSOR)/$ENV(SAMPLE).futures;$ENV(PROCESSOR)_$ENV(SAMPLE).ledger=$ENV(PWD)/hists/$ENV(PROCESSOR)/$ENV(SAMPLE).ledger"
 Arguments = $ENV(METADATA) $ENV(SAMPLE) $ENV(PROCESSOR) $ENV(CLUSTER) $ENV(USER)
 accounting_group=group_cms
 JobBatchName = $ENV(BTCN)
@@ -70,12 +76,12 @@ if options.cluster == 'lpc':
     jdl = """universe = vanilla
 Executable = run.sh
 Should_Transfer_Files = YES
-WhenToTransferOutput = ON_EXIT
-Transfer_Input_Files = run.sh
+WhenToTransferOutput = ON_EXIT_OR_EVICT
+Transfer_Input_Files = run.sh$ENV(LEDGER)
 Output = logs/condor/run/out/$ENV(PROCESSOR)_$ENV(SAMPLE)_$(Cluster)_$(Process).stdout
 Error = logs/condor/run/err/$ENV(PROCESSOR)_$ENV(SAMPLE)_$(Cluster)_$(Process).stderr
 Log = logs/condor/run/log/$ENV(PROCESSOR)_$ENV(SAMPLE)_$(Cluster)_$(Process).log
-TransferOutputRemaps = "$ENV(PROCESSOR)_$ENV(SAMPLE).futures=$ENV(PWD)/hists/$ENV(PROCESSOR)/$ENV(SAMPLE).futures"
+TransferOutputRemaps = "$ENV(PROCESSOR)_$ENV(SAMPLE).futures=$ENV(PWD)/hists/$ENV(PROCESSOR)/$ENV(SAMPLE).futures;$ENV(PROCESSOR)_$ENV(SAMPLE).ledger=$ENV(PWD)/hists/$ENV(PROCESSOR)/$ENV(SAMPLE).ledger"
 Arguments = $ENV(METADATA) $ENV(SAMPLE) $ENV(PROCESSOR) $ENV(CLUSTER) $ENV(USER) 
 request_cpus = 8
 request_memory = 5700
@@ -93,6 +99,15 @@ for dataset, info in datadef.items():
         if not any(_dataset in dataset for _dataset in options.dataset.split(',')): continue
     if options.exclude:
         if any(_dataset in dataset for _dataset in options.exclude.split(',')): continue
+    ledger = 'hists/'+options.processor+'/'+dataset+'.ledger'
+    drop_stale(ledger, 'hists/'+options.processor+'/'+dataset+'.futures')
+    if options.resubmit_failed:
+        if os.path.exists(ledger):
+            state = load(ledger)
+            print('Resubmitting',dataset+':',len(state['chunks'])-len(state['done']),'of',len(state['chunks']),'chunks missing')
+        elif os.path.exists('hists/'+options.processor+'/'+dataset+'.futures'): continue
+        else: print('Resubmitting',dataset+': no output')
+    os.environ['LEDGER'] = ', '+ledger if os.path.exists(ledger) else ''
     os.system('mkdir -p logs/condor/run/err/')
     os.system('rm -rf logs/condor/run/err/*'+options.processor+'*'+dataset+'*')
     os.system('mkdir -p logs/condor/run/log/')
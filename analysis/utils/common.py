@@ -2,10 +2,7 @@ from coffea.util import save
 import awkward
 import uproot, uproot_methods
 import numpy as np
-
-def match(a, b, val):
-    combinations = a.cross(b, nested=True)
-    return (combinations.i0.delta_r(combinations.i1)<val).any()
+from helpers.match import match
 
 def sigmoid(x,a,b,c,d):
     """
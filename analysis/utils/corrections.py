@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 import uproot, uproot_methods
 import numpy as np
+import awkward
 import os
 from coffea import hist, lookup_tools
 from coffea.lookup_tools import extractor, dense_lookup
 from coffea.util import save, load
 from coffea.btag_tools import BTagScaleFactor
+from helpers.eventlist import EventList
+from helpers.lookup import FusedLookup
+from helpers.corrections import save_corrections
 
 ###
 # Pile-up weight
@@ -193,6 +197,27 @@ get_mu_loose_iso_sf = {}
 for year in ['2016','2017','2018']:
     get_mu_tight_iso_sf[year] = lookup_tools.dense_lookup.dense_lookup(mu_iso_tight_hist[year].values, mu_iso_tight_hist[year].edges)
     get_mu_loose_iso_sf[year] = lookup_tools.dense_lookup.dense_lookup(mu_iso_loose_hist[year].values, mu_iso_loose_hist[year].edges)
+
+###
+# Electron and muon SFs stacked into one table per year, for objects that need several of them at the same coordinates
+###
+
+get_ele_sf = {}
+get_mu_sf = {}
+for year in ['2016','2017','2018']:
+    get_ele_sf[year] = FusedLookup({
+        'trig':     get_ele_trig_weight[year],
+        'loose_id': get_ele_loose_id_sf[year],
+        'tight_id': get_ele_tight_id_sf[year],
+        'reco':     get_ele_reco_sf[year]
+    })
+    get_mu_sf[year] = FusedLookup({
+        'tight_id':  get_mu_tight_id_sf[year],
+        'loose_id':  get_mu_loose_id_sf[year],
+        'tight_iso': get_mu_tight_iso_sf[year],
+        'loose_iso': get_mu_loose_iso_sf[year]
+    })
+
 ###
 # V+jets NLO k-factors
 ###
@@ -351,30 +376,42 @@ def get_msd_weight(pt, eta):
     return genw*weight
 
 
+###
+# ECAL bad calibration filter, events to veto per year and primary dataset.
+# Lists are read once here and shipped as sorted packed (run, lumi, event) keys.
+###
+
+ecal_bad_calib_files = {
+    '2016': {
+        'MET':            "data/ecalBadCalib/Run2016_MET.root",
+        'SinglePhoton':   "data/ecalBadCalib/Run2016_SinglePhoton.root",
+        'SingleElectron': "data/ecalBadCalib/Run2016_SingleElectron.root",
+    },
+    '2017': {
+        'MET':            "data/ecalBadCalib/Run2017_MET.root",
+        'SinglePhoton':   "data/ecalBadCalib/Run2017_SinglePhoton.root",
+        'SingleElectron': "data/ecalBadCalib/Run2017_SingleElectron.root",
+    },
+    '2018': {
+        'MET':            "data/ecalBadCalib/Run2018_MET.root",
+        'EGamma':         "data/ecalBadCalib/Run2018_EGamma.root",
+    }
+}
+ecal_bad_calib = {}
+for year in ['2016','2017','2018']:
+    ecal_bad_calib[year] = {}
+    for name, filename in ecal_bad_calib_files[year].items():
+        if not os.path.exists(filename):
+            print('Missing ECAL bad calibration list:', filename)
+            continue
+        bad_tree = uproot.open(filename)["vetoEvents"]
+        ecal_bad_calib[year][name] = EventList(bad_tree.array("Run"), bad_tree.array("LS"), bad_tree.array("Event"))
+
 def get_ecal_bad_calib(run_number, lumi_number, event_number, year, dataset):
-    bad = {}
-    bad["2016"] = {}
-    bad["2017"] = {}
-    bad["2018"] = {}
-    bad["2016"]["MET"]            = "ecalBadCalib/Run2016_MET.root"
-    bad["2016"]["SinglePhoton"]   = "ecalBadCalib/Run2016_SinglePhoton.root"
-    bad["2016"]["SingleElectron"] = "ecalBadCalib/Run2016_SingleElectron.root"
-    bad["2017"]["MET"]            = "ecalBadCalib/Run2017_MET.root"
-    bad["2017"]["SinglePhoton"]   = "ecalBadCalib/Run2017_SinglePhoton.root"
-    bad["2017"]["SingleElectron"] = "ecalBadCalib/Run2017_SingleElectron.root"
-    bad["2018"]["MET"]            = "ecalBadCalib/Run2018_MET.root"
-    bad["2018"]["EGamma"]         = "ecalBadCalib/Run2018_EGamma.root"
-    
-    regular_dataset = ""
-    regular_dataset = [name for name in ["MET","SinglePhoton","SingleElectron","EGamma"] if (name in dataset)]
-    fbad = uproot.open(bad[year][regular_dataset[0]])
-    bad_tree = fbad["vetoEvents"]
-    runs_to_veto = bad_tree.array("Run")
-    lumis_to_veto = bad_tree.array("LS")
-    events_to_veto = bad_tree.array("Event")
-
-    # We want events that do NOT have (a vetoed run AND a vetoed LS and a vetoed event number)
-    return np.logical_not(np.isin(run_number, runs_to_veto) * np.isin(lumi_number, lumis_to_veto) * np.isin(event_number, events_to_veto))
+    # We want events that do NOT have a vetoed (run, LS, event)
+    regular_dataset = [name for name in ["MET","SinglePhoton","SingleElectron","EGamma"] if (name in dataset) and (name in ecal_bad_calib[year])]
+    if not regular_dataset: return np.ones(len(run_number), dtype=np.bool)
+    return np.logical_not(ecal_bad_calib[year][regular_dataset[0]](run_number, lumi_number, event_number))
 
 class BTagCorrector:
 
@@ -408,66 +445,67 @@ class BTagCorrector:
         nom = bpass / np.maximum(ball, 1.)
         self.eff = lookup_tools.dense_lookup.dense_lookup(nom, [ax.edges() for ax in btag[tagger].axes()[3:]])
 
-    def btag_weight(self, pt, eta, flavor, tag):
-        abseta = abs(eta)
-        
+    def btag_weights(self, pt, eta, flavor):
+        """Nominal, up and down weights of the 0 tag ('0') and the >=1 tag ('-1') categories.
+
+        The efficiency and the three SF variations are evaluated once on the
+        flat jet content, and the probabilities of no tagged jet are summed
+        as logs per event, so both categories come from a single pass.
+        """
+        counts = pt.counts
+        pt, abseta, flavor = pt.flatten(), abs(eta.flatten()), flavor.flatten()
+
         #https://twiki.cern.ch/twiki/bin/viewauth/CMS/BTagSFMethods#1b_Event_reweighting_using_scale
         def zerotag(eff):
-            return (1 - eff).prod()
+            with np.errstate(divide='ignore'):
+                return np.exp(awkward.JaggedArray.fromcounts(counts, np.log1p(-eff)).sum())
 
         eff = self.eff(flavor, pt, abseta)
-        sf_nom = self.sf.eval('central', flavor, abseta, pt)
-        sf_up = self.sf.eval('up', flavor, abseta, pt)
-        sf_down = self.sf.eval('down', flavor, abseta, pt)
-
-        eff_data_nom  = np.minimum(1., sf_nom*eff)
-        eff_data_up   = np.minimum(1., sf_up*eff)
-        eff_data_down = np.minimum(1., sf_down*eff)
-
-        nom = zerotag(eff_data_nom)/zerotag(eff)
-        up = zerotag(eff_data_up)/zerotag(eff)
-        down = zerotag(eff_data_down)/zerotag(eff)
+        zerotag_mc = zerotag(eff)
+        weights = {'0': [], '-1': []}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for systematic in ['central', 'up', 'down']:
+                zerotag_data = zerotag(np.minimum(1., self.sf.eval(systematic, flavor, abseta, pt)*eff))
+                weights['0'].append(np.nan_to_num(zerotag_data/zerotag_mc))
+                weights['-1'].append(np.nan_to_num((1 - zerotag_data) / (1 - zerotag_mc)))
+        return {tag: tuple(weight) for tag, weight in weights.items()}
 
-        if '-1' in tag: 
-            nom = (1 - zerotag(eff_data_nom)) / (1 - zerotag(eff))
-            up = (1 - zerotag(eff_data_up)) / (1 - zerotag(eff))
-            down = (1 - zerotag(eff_data_down)) / (1 - zerotag(eff))
-
-        return np.nan_to_num(nom), np.nan_to_num(up), np.nan_to_num(down)
+    def btag_weight(self, pt, eta, flavor, tag):
+        return self.btag_weights(pt, eta, flavor)['-1' if '-1' in tag else '0']
 
 get_btag_weight = {
     'deepflav': {
         '2016': {
-            'loose'  : BTagCorrector('deepflav','2016','loose').btag_weight,
-            'medium' : BTagCorrector('deepflav','2016','medium').btag_weight,
-            'tight'  : BTagCorrector('deepflav','2016','tight').btag_weight
+            'loose'  : BTagCorrector('deepflav','2016','loose').btag_weights,
+            'medium' : BTagCorrector('deepflav','2016','medium').btag_weights,
+            'tight'  : BTagCorrector('deepflav','2016','tight').btag_weights
         },
         '2017': {
-            'loose'  : BTagCorrector('deepflav','2017','loose').btag_weight,
-            'medium' : BTagCorrector('deepflav','2017','medium').btag_weight,
-            'tight'  : BTagCorrector('deepflav','2017','tight').btag_weight
+            'loose'  : BTagCorrector('deepflav','2017','loose').btag_weights,
+            'medium' : BTagCorrector('deepflav','2017','medium').btag_weights,
+            'tight'  : BTagCorrector('deepflav','2017','tight').btag_weights
         },
         '2018': {
-            'loose'  : BTagCorrector('deepflav','2018','loose').btag_weight,
-            'medium' : BTagCorrector('deepflav','2018','medium').btag_weight,
-            'tight'  : BTagCorrector('deepflav','2018','tight').btag_weight
+            'loose'  : BTagCorrector('deepflav','2018','loose').btag_weights,
+            'medium' : BTagCorrector('deepflav','2018','medium').btag_weights,
+            'tight'  : BTagCorrector('deepflav','2018','tight').btag_weights
         }
     },
     'deepcsv' : {
         '2016': {
-            'loose'  : BTagCorrector('deepcsv','2016','loose').btag_weight,
-            'medium' : BTagCorrector('deepcsv','2016','medium').btag_weight,
-            'tight'  : BTagCorrector('deepcsv','2016','tight').btag_weight
+            'loose'  : BTagCorrector('deepcsv','2016','loose').btag_weights,
+            'medium' : BTagCorrector('deepcsv','2016','medium').btag_weights,
+            'tight'  : BTagCorrector('deepcsv','2016','tight').btag_weights
         },
         '2017': {
-            'loose'  : BTagCorrector('deepcsv','2017','loose').btag_weight,
-            'medium' : BTagCorrector('deepcsv','2017','medium').btag_weight,
-            'tight'  : BTagCorrector('deepcsv','2017','tight').btag_weight
+            'loose'  : BTagCorrector('deepcsv','2017','loose').btag_weights,
+            'medium' : BTagCorrector('deepcsv','2017','medium').btag_weights,
+            'tight'  : BTagCorrector('deepcsv','2017','tight').btag_weights
         },
         '2018': {
-            'loose'  : BTagCorrector('deepcsv','2018','loose').btag_weight,
-            'medium' : BTagCorrector('deepcsv','2018','medium').btag_weight,
-            'tight'  : BTagCorrector('deepcsv','2018','tight').btag_weight
+            'loose'  : BTagCorrector('deepcsv','2018','loose').btag_weights,
+            'medium' : BTagCorrector('deepcsv','2018','medium').btag_weights,
+            'tight'  : BTagCorrector('deepcsv','2018','tight').btag_weights
         }
     }
 }
@@ -509,11 +547,13 @@ corrections = {
     'get_ele_reco_lowet_sf':    get_ele_reco_lowet_sf,
     'get_mu_tight_iso_sf':      get_mu_tight_iso_sf,
     'get_mu_loose_iso_sf':      get_mu_loose_iso_sf,
+    'get_ele_sf':               get_ele_sf,
+    'get_mu_sf':                get_mu_sf,
     'get_ecal_bad_calib':       get_ecal_bad_calib,
     'get_btag_weight':          get_btag_weight,
     #'Jetevaluator':             Jetevaluator,
 }
-save(corrections, 'data/corrections.coffea')
+save_corrections(corrections, 'data/corrections')
 
 
 